@@ -20,13 +20,17 @@ class Sequence:
         self.time_resolution = Decimal(PulserConfiguration.time_resolution)
         self.max_switches = PulserConfiguration.max_switches
         self.reset_step_duration = PulserConfiguration.reset_step_duration
-        # dictionary in the form "time:switches"
+        # switch events, as lists of "time", "channel" and "switch"
         # "time" is expressed as timestep with the given resolution
-        # "switches" is a ttl_channel_count-long array with 1 to switch ON, -1 to switch OFF, 0 to do nothing
-        self.ttl_switching_times = {
-            0: numpy.zeros(self.ttl_channel_count, dtype=numpy.int8)
-        }
-        # same as the number of keys in the ttl_switching_times dictionary
+        # "switch" is 1 to switch ON, -1 to switch OFF, 0 to do nothing
+        self.ttl_event_steps = [0]
+        self.ttl_event_channels = [0]
+        self.ttl_event_switches = [0]
+        # position of each (time, channel) pair in the event lists
+        self._ttl_event_index = {(0, 0): 0}
+        # the timesteps that have switch events, including ones that do nothing
+        self.ttl_switch_steps = {0}
+        # same as the number of ttl_switch_steps
         self.ttl_switches = 1  # keeps track of how many switches are to be performed
         # for storing information about dds switches, in the format:
         # timestep: {channel_name: integer representing the state}
@@ -97,29 +101,38 @@ class Sequence:
         :param value: should be 1 for switching on, -1 for switching off, or 0 for staying the same
         :return:
         """
-        if time_step in self.ttl_switching_times:
-            if self.ttl_switching_times[time_step][chan]:  # checks if 0 or 1/-1
+        index = self._ttl_event_index.get((time_step, chan))
+        if time_step in self.ttl_switch_steps:
+            if (
+                index is not None and self.ttl_event_switches[index]
+            ):  # checks if 0 or 1/-1
                 # if set to turn off, but want on, replace with zero, fixes error adding 2 TTLs back to back
-                if self.ttl_switching_times[time_step][chan] * value == -1:
-                    self.ttl_switching_times[time_step][chan] = 0
+                if self.ttl_event_switches[index] * value == -1:
+                    self.ttl_event_switches[index] = 0
                 else:
                     raise Exception(
                         "Double switch at time {} for channel {}".format(
                             time_step, chan
                         )
                     )
+            elif index is not None:
+                self.ttl_event_switches[index] = value
             else:
-                self.ttl_switching_times[time_step][chan] = value
+                self._append_switch(time_step, chan, value)
         else:
             if self.ttl_switches == self.max_switches:
                 raise Exception(
                     "Exceeded maximum number of switches {}".format(self.ttl_switches)
                 )
-            self.ttl_switching_times[time_step] = numpy.zeros(
-                self.ttl_channel_count, dtype=numpy.int8
-            )
+            self.ttl_switch_steps.add(time_step)
             self.ttl_switches += 1
-            self.ttl_switching_times[time_step][chan] = value
+            self._append_switch(time_step, chan, value)
+
+    def _append_switch(self, time_step: int, chan: int, value: int) -> None:
+        self._ttl_event_index[(time_step, chan)] = len(self.ttl_event_steps)
+        self.ttl_event_steps.append(time_step)
+        self.ttl_event_channels.append(chan)
+        self.ttl_event_switches.append(value)
 
     def prog_representation(self, parse: bool = True) -> Tuple[Dict[str, bytes], bytes]:
         """
@@ -170,7 +183,7 @@ class Sequence:
                 for name in dds_program.keys():
                     dds_program[name] += b"\x00\x00"
                 # at the end of the sequence, reset dds
-                last_ttl = max(self.ttl_switching_times.keys())
+                last_ttl = max(self.ttl_switch_steps)
                 self._add_new_switch(last_ttl, self.reset_dds, 1)
                 self._add_new_switch(
                     last_ttl + self.reset_step_duration, self.reset_dds, -1
@@ -219,22 +232,46 @@ class Sequence:
             prog[name] += buf
 
     def parse_ttl(self) -> bytes:
-        """Returns the bytewise representation of the TTL sequence for programming the FPGA"""
-        rep = bytes()
-        last_channels = numpy.zeros(self.ttl_channel_count)
-        power_array = 2 ** numpy.arange(self.ttl_channel_count, dtype=numpy.uint64)
-        for key, new_channels in sorted(self.ttl_switching_times.items()):
-            channels = (
-                last_channels + new_channels
-            )  # computes the action of switching on the state
-            if (channels < 0).any():
-                raise Exception("Trying to switch off channel that is not already on")
-            channel_int = numpy.dot(channels, power_array)
-            # convert the new state to hex and adds it to the sequence
-            rep = rep + self._num_to_hex(key) + self._num_to_hex(channel_int)
-            last_channels = channels
-        rep = rep + 2 * self._num_to_hex(0)  # adding termination
-        return rep
+        """
+        Returns the bytewise representation of the TTL sequence for programming the FPGA.
+        The switch events are compiled as arrays: the state of each channel is the cumulative
+        sum of its switches, and the channel mask of each timestep is the cumulative sum of
+        the switches shifted to their channel's bit.
+        """
+        steps, rows = numpy.unique(
+            numpy.array(self.ttl_event_steps, dtype=numpy.int64), return_inverse=True
+        )
+        channels = numpy.array(self.ttl_event_channels, dtype=numpy.int64)
+        switches = numpy.array(self.ttl_event_switches, dtype=numpy.int64)
+        # the state of each channel after each of its switches, in the order of the channels
+        order = numpy.lexsort((rows, channels))
+        sorted_switches = switches[order]
+        states = numpy.cumsum(sorted_switches)
+        firsts = numpy.flatnonzero(numpy.diff(channels[order], prepend=-1))
+        offsets = states[firsts] - sorted_switches[firsts]
+        states -= numpy.repeat(offsets, numpy.diff(numpy.append(firsts, len(order))))
+        if (states < 0).any():
+            raise Exception("Trying to switch off channel that is not already on")
+        # each channel's switches moved to its bit, summed per timestep and over time
+        changes = numpy.zeros(len(steps), dtype=numpy.int64)
+        numpy.add.at(changes, rows, switches << channels)
+        channel_ints = numpy.cumsum(changes)
+        return self._words_to_bytes(steps, channel_ints)
+
+    @staticmethod
+    def _words_to_bytes(steps: numpy.ndarray, channel_ints: numpy.ndarray) -> bytes:
+        """
+        Packs (timestep, channels) pairs into a program, as _num_to_hex does for each number:
+        every 32 bit number is written as its high and then its low 16 bit little-endian word.
+        The program is terminated by a pair of zeros.
+        """
+        numbers = numpy.zeros((len(steps) + 1, 2), dtype=numpy.uint32)
+        numbers[:-1, 0] = steps.astype(numpy.uint32)
+        numbers[:-1, 1] = channel_ints.astype(numpy.uint32)
+        words = numpy.empty(numbers.shape + (2,), dtype="<u2")
+        words[..., 0] = numbers >> 16
+        words[..., 1] = numbers & 0xFFFF
+        return words.tobytes()
 
     def human_representation(
         self,
@@ -4,11 +4,14 @@ Contains the class structures needed for creating data files and directories.
 
 import os
 import re
-import h5py
 from datetime import datetime
 from weakref import WeakValueDictionary
+from twisted.internet.defer import DeferredLock
 
-from . import backend, errors, util
+import numpy as np
+
+from . import backend, catalog, decimate, durability, errors, listing, rangeindex, util
+from .listing import check_if_multiple_datasets
 
 # todo: move session/sessionstore/dataset objects into a different file
 # todo: move shared functions into util
@@ -95,30 +98,6 @@ def parse_dependent(s):
     return label, legend, units
 
 
-def check_if_multiple_datasets(filename):
-    """
-    Check if hdf5 or h5 file has multiple datasets.
-    Arguments:
-        filename    (str): the name of the file to check
-    Returns:
-                    (bool): whether the file has multiple datasets.
-    """
-    # open file
-    num_datasets = 0
-    with h5py.File(filename, "r") as file_tmp:
-        # todo: more general way of checking; check # of datasets of all groups
-        try:
-            num_datasets = len(file_tmp["datasets"])
-        except:
-            return False
-
-    # get number of datasets
-    if num_datasets > 1:
-        return True
-    else:
-        return False
-
-
 # data-url support for storing parameters
 DATA_URL_PREFIX = "data:application/labrad;base64,"
 
@@ -131,10 +110,24 @@ class SessionStore:
 
     # todo: ensure repositories can't contain one another
 
-    def __init__(self, datadirs, hub, use_virtual_session=True):
+    def __init__(
+        self,
+        datadirs,
+        hub,
+        use_virtual_session=True,
+        metadata_interval=util.METADATA_SAVE_INTERVAL,
+        io_threads=util.IO_THREADS,
+        catalog_file=None,
+    ):
         self._sessions = WeakValueDictionary()
         self.hub = hub
         self.use_virtual_session = use_virtual_session
+        # shared by all sessions and datasets to coalesce metadata writes
+        self.metadata_writer = util.MetadataWriter(metadata_interval)
+        # threads for reading and writing dataset files off the reactor thread
+        self.io_pool = util.IOPool(io_threads)
+        # flushes datasets to disk according to their durability policies
+        self.flusher = durability.FlushScheduler(self.io_pool)
 
         datadirs = [datadirs] if isinstance(datadirs, str) else datadirs
 
@@ -144,6 +137,33 @@ class SessionStore:
             os.path.basename(datadir): os.path.dirname(datadir) for datadir in datadirs
         }
 
+        # searchable index of all datasets, kept in the first data directory by
+        # default; the database is only opened once it is used
+        if catalog_file is None:
+            catalog_file = os.path.join(datadirs[0], catalog.CATALOG_FILENAME)
+        self.catalog = catalog.Catalog(catalog_file)
+        # servers using the store, see open and close
+        self.owners = 0
+
+    def open(self):
+        """
+        Register a server that uses the store.
+        """
+        self.owners += 1
+
+    def close(self):
+        """
+        Unregister a server. Once the last one is gone, the I/O threads are
+        stopped and the catalog is closed; both start again when they are used.
+        Datasets should be closed by the last server before it calls this.
+        """
+        self.owners = max(self.owners - 1, 0)
+        if self.owners:
+            return
+        self.flusher.stop()
+        self.io_pool.stop()
+        self.catalog.close()
+
     def get_all(self):
         return self._sessions.values()
 
@@ -188,6 +208,8 @@ class SessionStore:
                 path = ("", list(self.datadirs.keys())[0])
             else:
                 path = ("", list(self.datadirs.keys())[0], *path[1:])
+            if path in self._sessions:
+                return self._sessions[path]
             datadir = self.datadirs[path[1]]
 
             # return a virtual file directory if filepath contains a real hdf5/h5 file
@@ -201,6 +223,21 @@ class SessionStore:
         self._sessions[path] = session
         return session
 
+    def search(self, query, limit=catalog.SEARCH_LIMIT):
+        """
+        Find datasets in the catalog.
+        Arguments:
+            query   (str): the search terms (see catalog).
+            limit   (int): the largest number of datasets returned.
+        Returns:
+            list((list(str), str)): the path of the directory, as passed to
+                get, and the name of each matching dataset, newest first.
+        """
+        # session paths include the name of the data directory, which get adds
+        return [
+            ([""] + path[2:], name) for path, name in self.catalog.search(query, limit)
+        ]
+
 
 class Session:
     """
@@ -220,7 +257,13 @@ class Session:
         self.hub = hub
         self.dir = filedir(datadir, path)
         self.infofile = os.path.join(str(self.dir), "session.ini")
+        self.writer = session_store.metadata_writer
+        self.catalog = session_store.catalog
         self.datasets = WeakValueDictionary()
+        # number -> name and the set of names of datasets on disk, filled on first
+        # lookup by open_dataset and kept up to date by new_dataset
+        self._dataset_numbers = None
+        self._dataset_names = None
 
         # create new directory if it doesn't exist
         if not os.path.exists(self.dir):
@@ -228,20 +271,24 @@ class Session:
 
             # notify listeners about this new directory
             parent_session = session_store.get(path[:-1])
+            parent_session.entry_added(filename_encode(path[-1]), listing.DIR)
             hub.onNewDir(path[-1], parent_session.listeners)
 
+        self.listing = listing.ListingIndex(str(self.dir))
+
         # load existing infofile (session.ini file) if it exists,
         # otherwise create it
+        self.writer.flush(self.infofile)
         if os.path.exists(self.infofile):
             self.load()
+            # update current access time and save
+            self.access()
         else:
             self.counter = 1
-            self.created = self.modified = datetime.now()
+            self.created = self.modified = self.accessed = datetime.now()
             self.session_tags = {}
             self.dataset_tags = {}
-
-        # update current access time and save
-        self.access()
+            self.save()
         self.listeners = set()
 
     def load(self):
@@ -288,15 +335,15 @@ class Session:
         s.set(sec, "sessions", repr(self.session_tags))
         s.set(sec, "datasets", repr(self.dataset_tags))
 
-        with open(self.infofile, "w") as f:
+        with util.atomic_write(self.infofile) as f:
             s.write(f)
 
     def access(self):
         """
-        Update last access time and save.
+        Update last access time and schedule a save.
         """
         self.accessed = datetime.now()
-        self.save()
+        self.writer.mark(self.infofile, self.save)
 
     def list_contents(self, tag_filters):
         """
@@ -306,47 +353,20 @@ class Session:
         Returns:
             tuple(str), tuple(str): sorted tuples of directories and datasets, respectively.
         """
-        # get all names in the directory
-        files = os.listdir(str(self.dir))
+        # classification of each entry is cached in the listing index, so only
+        # hdf5 files that changed since the last listing are opened
+        dir_files, dataset_files = self.listing.contents()
 
         # get directories (objects that end in '.dir' are directories,
         # though we also allow folders that don't end in dir)
+        # hdf5 files with multiple datasets are treated as virtual directories
         # todo: fix .dir suffix problem, maybe try/except block that does .dir if fails?
-        # dirs = [filename_decode(filename.split('.')[0]) for filename in files if os.path.isdir(os.path.join(self.dir, filename))]
-        dirs = [
-            filename_decode(filename)
-            for filename in files
-            if os.path.isdir(os.path.join(str(self.dir), filename))
-        ]
+        dirs = [filename_decode(filename) for filename in dir_files]
 
         # get only valid dataset files (ignore csv since they're partnered with ini files)
-        filetype_suffixes = (".ini", ".hdf5", ".h5")
-
-        def valid_datafile(filename):
-            if filename == "session.ini":
-                return False
-            # hdf5 files with more than multiple datasets are to be treated as virtual directories
-            elif filename.endswith(".hdf5") or filename.endswith(".h5"):
-                multiple_datasets = check_if_multiple_datasets(
-                    os.path.join(str(self.dir), filename)
-                )
-                # add filename to directories
-                if multiple_datasets:
-                    dirs.append(filename_decode(filename))
-                    return False
-                else:
-                    return True
-            else:
-                return any(
-                    [filename.endswith(filetype) for filetype in filetype_suffixes]
-                )
-
+        # migrated csv datasets have both an .ini and an .hdf5 file
         datasets = sorted(
-            [
-                filename_decode(filename.split(".")[0])
-                for filename in files
-                if valid_datafile(filename)
-            ]
+            {filename_decode(filename.split(".")[0]) for filename in dataset_files}
         )
 
         # todo: turn these functions into lambda functions
@@ -395,9 +415,78 @@ class Session:
             base, _, ext = s.rpartition(".")
             if ext in ["csv", "hdf5", "h5"]:
                 filenames.append(filename_decode(base))
-        return sorted(filenames)
+        # migrated csv datasets have both a .csv and an .hdf5 file
+        return sorted(set(filenames))
+
+    def _index_datasets(self):
+        """
+        Rebuild the number and name lookup tables from the directory.
+        """
+        self._dataset_numbers = {}
+        self._dataset_names = set()
+        for name in self.list_datasets():
+            self._add_dataset_name(name)
+
+    def _add_dataset_name(self, name):
+        self._dataset_names.add(name)
+        try:
+            self._dataset_numbers.setdefault(int(name[:5]), name)
+        except ValueError:
+            # not created by the data vault, so it can only be opened by name
+            pass
 
-    def new_dataset(self, title, independents, dependents, extended=False):
+    def _next_dataset_number(self):
+        """
+        Take the number of a new dataset.
+
+        The counter is saved lazily, so it may be behind the datasets on disk
+        if the server stopped before the last save. If its number is taken, it
+        is moved past the datasets in the directory.
+        """
+        if self._dataset_numbers is None:
+            self._index_datasets()
+        if self.counter in self._dataset_numbers:
+            self.counter = max(self._dataset_numbers) + 1
+        num = self.counter
+        self.counter += 1
+        return num
+
+    def _lookup_dataset(self, name):
+        """
+        Find a dataset by number or name.
+
+        The lookup tables are rebuilt from disk if they don't have the dataset,
+        in case it was added by someone else.
+        Arguments:
+            name    (int or str): the number or full name of the dataset.
+        Returns:
+            str: the full name of the dataset, or None if it does not exist.
+        """
+        fresh = self._dataset_numbers is None
+        if fresh:
+            self._index_datasets()
+        found = self._find_indexed_dataset(name)
+        if found is None and not fresh:
+            self._index_datasets()
+            found = self._find_indexed_dataset(name)
+        return found
+
+    def _find_indexed_dataset(self, name):
+        if isinstance(name, int):
+            return self._dataset_numbers.get(name)
+        if name in self._dataset_names:
+            return name
+        return None
+
+    def new_dataset(
+        self,
+        title,
+        independents,
+        dependents,
+        extended=False,
+        profile=None,
+        swmr=False,
+    ):
         """
         todo: document
         Args:
@@ -405,11 +494,12 @@ class Session:
             independents:
             dependents:
             extended:
+            profile:    (str) name of the storage profile used to lay out the new file.
+            swmr:       (bool) write the new file in single-writer/multiple-reader mode.
         Returns:
             todo
         """
-        num = self.counter
-        self.counter += 1
+        num = self._next_dataset_number()
         self.modified = datetime.now()
 
         # todo: this is what makes the datasets have strange numbers in front of it; fix it up
@@ -422,9 +512,21 @@ class Session:
             independents=independents,
             dependents=dependents,
             extended=extended,
+            profile=profile,
+            swmr=swmr,
         )
         self.datasets[name] = dataset
+        self._add_dataset_name(name)
         self.access()
+        self.catalog.add_dataset(
+            self.path,
+            name,
+            title,
+            self.modified.timestamp(),
+            cols=len(independents) + len(dependents),
+            tags=sorted(self.dataset_tags.get(name, ())),
+        )
+        self.entry_added(filename_encode(name) + ".hdf5", listing.DATASET)
 
         # notify listeners about the new dataset
         self.hub.onNewDataset(name, self.listeners)
@@ -438,28 +540,13 @@ class Session:
         Returns:
             Dataset: a Dataset object.
         """
-        # try to look up dataset by number
-        if isinstance(name, (int, int)):
-            for oldName in self.list_datasets():
-                num = int(oldName[:5])
-                if name == num:
-                    name = oldName
-                    break
-
-        # if it's still a number, we didn't find the dataset
-        if isinstance(name, (int, int)):
-            raise errors.DatasetNotFoundError(name)
-
-        # try to find dataset file
-        filename = filename_encode(name)
-        file_base = os.path.join(str(self.dir), filename)
-        # if not all(map(os.path.exists, [file_base + suffix for suffix in ['.csv', '.hdf5', '.h5']])):
-        if not (
-            os.path.exists(file_base + ".csv")
-            or os.path.exists(file_base + ".hdf5")
-            or os.path.exists(file_base + ".h5")
-        ):
-            raise errors.DatasetNotFoundError(name)
+        # look up the dataset by number or name; wrappers that are already open
+        # don't need to be looked up
+        if isinstance(name, int) or name not in self.datasets:
+            found = self._lookup_dataset(name)
+            if found is None:
+                raise errors.DatasetNotFoundError(name)
+            name = found
 
         # get dataset wrapper if it already exists
         if name in self.datasets:
@@ -507,6 +594,8 @@ class Session:
 
         sess_updates = update_tag_dict(tags, sessions, self.session_tags)
         data_updates = update_tag_dict(tags, datasets, self.dataset_tags)
+        for name, entry_tags in data_updates:
+            self.catalog.set_tags(self.path, name, entry_tags)
 
         self.access()
         if len(sess_updates) + len(data_updates):
@@ -519,6 +608,13 @@ class Session:
         data_tags = [(d, sorted(self.dataset_tags.get(d, []))) for d in datasets]
         return sess_tags, data_tags
 
+    def entry_added(self, filename, kind):
+        """
+        Record a file or directory created in this directory by the server.
+        """
+        self.listing.add(filename, kind)
+        self.writer.mark(self.listing.filename, self.listing.save)
+
 
 class VirtualSession:
     """
@@ -532,6 +628,8 @@ class VirtualSession:
         """
         self.path = path
         self.hub = hub
+        self.writer = session_store.metadata_writer
+        self.catalog = session_store.catalog
         self.listeners = set()
         self.datasets = WeakValueDictionary()
         self.subdirs = sorted(datadirs.keys())
@@ -542,7 +640,15 @@ class VirtualSession:
         """
         return self.subdirs, []
 
-    def new_dataset(self, title, independents, dependents, extended=False):
+    def new_dataset(
+        self,
+        title,
+        independents,
+        dependents,
+        extended=False,
+        profile=None,
+        swmr=False,
+    ):
         raise errors.VirtualSessionError("newDataset")
 
     def open_dataset(self, name):
@@ -554,6 +660,9 @@ class VirtualSession:
     def get_tags(self, sessions, datasets):
         raise errors.VirtualSessionError("getTags")
 
+    def entry_added(self, filename, kind):
+        pass
+
 
 class VirtualFileSession(VirtualSession):
     """
@@ -581,14 +690,13 @@ class VirtualFileSession(VirtualSession):
             raise errors.DatasetNotFoundError(self.dataset_filename)
 
         # get dataset names
-        with h5py.File(self.dataset_filedir) as file_tmp:
-            datasets = file_tmp["datasets"]
-            self.dataset_names = sorted(list(map(str, datasets.keys())))
+        self.dataset_names = backend.hdf5_dataset_names(self.dataset_filedir)
 
     def list_contents(self, tag_filters):
         """
         Get a list of directory names in this directory.
         """
+        self.dataset_names = backend.hdf5_dataset_names(self.dataset_filedir)
         return [], self.dataset_names
 
     def open_dataset(self, dataset_name):
@@ -626,7 +734,15 @@ class VirtualFileSession(VirtualSession):
 
         return dataset
 
-    def new_dataset(self, title, independents, dependents, extended=False):
+    def new_dataset(
+        self,
+        title,
+        independents,
+        dependents,
+        extended=False,
+        profile=None,
+        swmr=False,
+    ):
         raise errors.VirtualSessionError("newDataset")
 
     def update_tags(self, tags, sessions, datasets):
@@ -653,6 +769,8 @@ class Dataset:
         dependents=None,
         extended=False,
         dataset_name=None,
+        profile=None,
+        swmr=False,
     ):
         if independents is None:
             independents = []
@@ -660,24 +778,59 @@ class Dataset:
             dependents = []
 
         self.hub = session.hub
+        self.writer = session.writer
+        self.catalog = session.catalog
+        self.session_path = session.path
         self.name = name
         file_base = os.path.join(session.dir, filename_encode(name))
+        self._metadata_key = (file_base, dataset_name)
         self.listeners = set()  # contexts that want to hear about added data
         self.param_listeners = set()
         self.comment_listeners = set()
+        # rate-limits the data-available signals to listeners
+        self.data_notifier = util.NotifyBatcher(self._send_data_available)
+        # serializes file I/O run in the I/O pool, so that it happens in request order
+        self.io_lock = DeferredLock()
+        # cached min/max envelope blocks for get_decimated
+        self.envelope = decimate.Envelope()
+        # {column: rangeindex.ColumnIndex} for get_range
+        self._column_indexes = {}
+        # durability.DurabilityPolicy overriding the server's, if any
+        self.durability = None
+        # rows added since the file was last flushed, and their size in bytes
+        self.unflushed_rows = 0
+        self.unflushed_bytes = 0
+        # number of rows when the file was last written or read, sent with new rows signals
+        self.rows = 0
 
         if create:
             indep = [self.make_independent(i, extended) for i in independents]
             dep = [self.make_dependent(d, extended) for d in dependents]
-            self.data = backend.create_backend(file_base, title, indep, dep, extended)
+            self.data = backend.create_backend(
+                file_base, title, indep, dep, extended, profile, swmr
+            )
             self.save()
         else:
+            # a previous wrapper for this dataset may still have unsaved metadata
+            self.writer.flush(self._metadata_key)
             self.data = backend.open_backend(file_base, dataset_name)
             self.load()
             self.access()
 
     def save(self):
-        self.data.save()
+        """
+        Schedule a save of the dataset metadata.
+
+        Only the metadata is written; buffered rows are flushed according to
+        the durability policy.
+        """
+        self.writer.mark(self._metadata_key, self.data.save_metadata)
+
+    def flush_metadata(self):
+        """
+        Write any pending metadata changes to the file now.
+        """
+        self.writer.flush(self._metadata_key)
 
     def load(self):
         self.data.load()
@@ -688,7 +841,8 @@ class Dataset:
 
     def access(self):
         """
-        Update time of last access for this dataset.
+        Update time of last access for this dataset, to be written with the
+        next metadata save.
         """
         self.data.access()
         self.save()
@@ -735,6 +889,7 @@ class Dataset:
         self.data.add_param(name, data)
         if save_now:
             self.save()
+        self.catalog.add_parameters(self.session_path, self.name, [(name, data)])
 
         # notify all listening contexts
         self.hub.onNewParameter(None, self.param_listeners)
@@ -742,10 +897,10 @@ class Dataset:
         return name
 
     def add_parameters(self, params, save_now=True):
-        for name, data in params:
-            self.data.add_param(name, data)
+        self.data.add_params(params)
         if save_now:
             self.save()
+        self.catalog.add_parameters(self.session_path, self.name, params)
 
         # notify all listening contexts
         self.hub.onNewParameter(None, self.param_listeners)
@@ -754,21 +909,130 @@ class Dataset:
     def get_parameter(self, name, case_sensitive=True):
         return self.data.get_parameter(name, case_sensitive)
 
+    def get_parameters(self):
+        return self.data.get_parameters()
+
     def getParamNames(self):
         return self.data.get_param_names()
 
     def add_data(self, data):
-        # append the data to the file
+        self.write_rows(data)
+        self.notify_data_available()
+
+    def write_rows(self, data):
+        """
+        Append rows to the file without notifying listeners. Used from I/O threads.
+        """
         self.data.add_data(data)
+        self.unflushed_rows += len(data)
+        self.unflushed_bytes += data.nbytes
+        self.count_rows()
 
+    def count_rows(self):
+        """
+        Record the number of rows in the file. Used from I/O threads, so that
+        signals sent from the reactor thread don't have to read the file.
+        """
+        self.rows = len(self.data)
+        return self.rows
+
+    def flush(self, sync=False):
+        """
+        Write out buffered rows and flush the file, and fsync it if sync is set.
+        Returns:
+            int: the size in bytes of the rows added since the last flush.
+        """
+        with self.data._file.lock:
+            if hasattr(self.data, "flush"):
+                # HDF5 containers write out their append buffer before flushing
+                self.data.flush()
+            elif self.data._file.is_open():
+                self.data._file._file.flush()
+            if sync:
+                backend.sync_file(self.data._file)
+            nbytes = self.unflushed_bytes
+            self.unflushed_rows = self.unflushed_bytes = 0
+        return nbytes
+
+    def notify_data_available(self):
         # notify all listening contexts
-        self.hub.onDataAvailable(None, self.listeners)
+        self.data_notifier.notify(self.listeners)
         self.listeners = set()
 
+    def _send_data_available(self, contexts):
+        self.hub.onDataAvailable(None, contexts)
+        # for clients that listen for the number of rows instead
+        self.hub.onNewRows(self.rows, contexts)
+
+    def call_with_file(self, f, *args):
+        """
+        Call f while holding the backend file, so that it is not closed or
+        flushed from the reactor thread in the meantime. Used for I/O threads.
+        """
+        with self.data._file.lock:
+            return f(*args)
+
     def get_data(self, limit, start, transpose=False, simple_only=False):
         return self.data.get_data(limit, start, transpose, simple_only)
 
-    def keep_streaming(self, context, pos):
+    def finalize(self):
+        """
+        Rewrite an HDF5 dataset with its rows stored contiguously, so that reads
+        are mapped straight from the file. Pending metadata should be written
+        with flush_metadata first.
+        Returns whether the file was rewritten.
+        """
+        if not hasattr(self.data, "finalize"):
+            return False
+        return self.data.finalize()
+
+    def _num_columns(self):
+        return len(self.get_independents()) + len(self.get_dependents())
+
+    def _read_rows(self, start, stop):
+        """
+        Get rows [start, stop) as a 2-D float array.
+        Only works for datasets with scalar numeric columns.
+        """
+        data, _ = self.data.get_data(stop - start, start, False, True)
+        return np.asarray(data, dtype=np.float64).reshape(-1, self._num_columns())
+
+    def get_decimated(self, max_points, start=0, stop=None):
+        """
+        Get at most max_points rows of [start, stop) as a min/max envelope.
+        Only works for datasets with scalar numeric columns.
+        """
+        return self.envelope.get(
+            self._read_rows,
+            len(self.data),
+            self._num_columns(),
+            max_points,
+            start,
+            stop,
+        )
+
+    def get_range(self, column, lo, hi):
+        """
+        Get the rows whose value in the given column is in [lo, hi].
+        Only works for datasets with scalar numeric columns.
+        """
+        ncols = self._num_columns()
+        if not 0 <= column < ncols:
+            raise errors.BadColumnError(column, ncols)
+        index = self._column_indexes.get(column)
+        if index is None:
+            if hasattr(self.data, "load_column_index"):
+                index = self.data.load_column_index(column)
+            if index is None:
+                index = rangeindex.ColumnIndex(column)
+            self._column_indexes[column] = index
+        rows = len(self.data)
+        if index.update(self._read_rows, rows):
+            if hasattr(self.data, "save_column_index"):
+                self.data.save_column_index(index)
+        return index.get_range(self._read_rows, rows, lo, hi)
+
+    def keep_streaming(self, context, pos, has_more=None):
         # keepStreaming does something a bit odd and has a confusing name (ERJ)
         #
         # The goal is this: a client that is listening for "new data" events should only
@@ -783,11 +1047,21 @@ class Dataset:
         #
         # If a client reads, but not to the end of the dataset, it is immediately notified that
         # there is more data for it to read, and then removed from the set of notifiers.
-        if self.data.has_more(pos):
+        #
+        # Reads done in an I/O thread pass in has_more, which they check along with the read.
+        if has_more is None:
+            has_more = self.data.has_more(pos)
+            self.count_rows()
+        #
+        # Both kinds of notification go through data_notifier, which batches them if they
+        # come faster than its minimum interval.
+        if has_more:
             if context in self.listeners:
                 self.listeners.remove(context)
-            self.hub.onDataAvailable(None, [context])
+            self.data_notifier.notify([context])
         else:
+            # a pending notification is no longer needed
+            self.data_notifier.discard(context)
             self.listeners.add(context)
 
     def add_comment(self, user, comment):
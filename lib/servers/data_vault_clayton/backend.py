@@ -2,17 +2,21 @@
 Contains all data file objects used by the server and utilities used to create/open them.
 """
 
+import io
 import os
 import h5py
+import threading
 import base64
 import datetime
 import numpy as np
+import numpy.lib.recfunctions as recfunctions
 
 from time import time
 from sys import maxsize
-from collections import namedtuple
+from collections import OrderedDict, namedtuple
+from weakref import WeakKeyDictionary, WeakValueDictionary, finalize
 
-from . import errors, util
+from . import errors, rangeindex, util
 from labrad import types
 from twisted.internet import reactor
 
@@ -24,8 +28,48 @@ TIME_FORMAT = "%Y-%m-%d, %H:%M:%S"
 PRECISION = 12  # digits of precision to use when saving data
 DATA_FORMAT = "%%.%dG" % PRECISION
 FILE_TIMEOUT_SEC = 60  # how long to keep datafiles open if not accessed
+MAX_OPEN_FILES = 64  # most datafiles kept open at once by a FilePool
 DATA_TIMEOUT = 300  # how long to keep data in memory if not accessed
+BUFFER_MAX_ROWS = 1000  # write buffered rows to disk once this many are waiting
+BUFFER_MAX_BYTES = (
+    1024**2
+)  # write buffered rows to disk once they take this much memory
+BUFFER_MAX_AGE_SEC = 1.0  # longest time a buffered row waits before being written
+REPACK_COPY_ROWS = (
+    65536  # rows copied at a time when finalizing or compacting a dataset
+)
+# attributes recording the CSV file an HDF5 file was migrated from
+CSV_SOURCE_SIZE = "CSV Source Size"
+CSV_SOURCE_MTIME = "CSV Source Mtime"
+# attribute marking HDF5 files written in single-writer/multiple-reader mode
+SWMR_ATTR = "SWMR"
+# group holding the column indexes used by range queries
+INDEX_GROUP = "DataVaultIndex"
+# attribute holding all parameters of an HDF5 dataset
+PARAMETERS_ATTR = "Parameters"
 DATA_URL_PREFIX = "data:application/labrad;base64,"
+
+# Storage layouts for new HDF5 datasets.
+# chunk_rows:       rows per HDF5 chunk (None lets h5py choose)
+# compression:      HDF5 filter name ("lzf", "gzip", or None for no compression)
+# compression_opts: filter options (e.g. the gzip level)
+# shuffle:          whether to apply the byte shuffle filter before compressing
+# cache_bytes:      size of the raw chunk cache used when the file is opened (None for the h5py default)
+StorageProfile = namedtuple(
+    "StorageProfile",
+    ["chunk_rows", "compression", "compression_opts", "shuffle", "cache_bytes"],
+)
+STORAGE_PROFILES = {
+    # original layout: automatic chunking, no compression
+    "default": StorageProfile(None, None, None, False, None),
+    # small chunks with a cheap filter, for live datasets that are read back often
+    "fast": StorageProfile(1024, "lzf", None, True, 4 * 1024**2),
+    # larger chunks with moderate compression, for long PMT and scan runs
+    "compact": StorageProfile(8192, "gzip", 4, True, 16 * 1024**2),
+    # maximum compression, for data that is rarely read back
+    "archive": StorageProfile(32768, "gzip", 9, True, 16 * 1024**2),
+}
+DEFAULT_STORAGE_PROFILE = "default"
 # todo: break backend up into general stuff (e.g. selfclosingfile, helper functions) and file format implementations
 # todo: note somewhere that versioning uses semantic versioning
 # todo: document versions and differences
@@ -41,6 +85,42 @@ def time_from_str(s):
     return datetime.datetime.strptime(s, TIME_FORMAT)
 
 
+def decode_str(value):
+    """
+    Convert a string read from an HDF5 attribute to str.
+
+    h5py returns variable-length strings inside compound types as bytes.
+    """
+    if isinstance(value, bytes):
+        return value.decode("utf-8")
+    return str(value)
+
+
+def decode_vlen_strings(column):
+    """
+    Convert a vlen string column of a struct array to a list of str.
+
+    Rows read from the file hold bytes and buffered rows hold str.  The values
+    are joined and decoded in one go rather than one at a time, falling back
+    to decode_str for mixed columns or strings containing the separator.
+    """
+    values = column.tolist()
+    if not values:
+        return values
+    for sep in (b"\x00", "\x00"):
+        try:
+            joined = sep.join(values)
+        except TypeError:
+            continue
+        if isinstance(joined, bytes):
+            joined = joined.decode("utf-8")
+        decoded = joined.split("\x00")
+        if len(decoded) == len(values):
+            return decoded
+        break
+    return [decode_str(value) for value in values]
+
+
 def labrad_urlencode(data):
     if hasattr(types, "FlatData"):
         # pylabrad 0.95+
@@ -70,12 +150,209 @@ def labrad_urldecode(data_url):
         )
 
 
+def get_storage_profile(profile=None):
+    """
+    Look up a storage profile by name.
+
+    None returns the default profile, and StorageProfile objects are passed through unchanged.
+    """
+    if profile is None:
+        profile = DEFAULT_STORAGE_PROFILE
+    if isinstance(profile, StorageProfile):
+        return profile
+    try:
+        return STORAGE_PROFILES[profile]
+    except KeyError:
+        raise errors.BadStorageProfileError(profile, sorted(STORAGE_PROFILES.keys()))
+
+
+def create_data_vault_dataset(h5file, dtype, profile=None):
+    """
+    Create the resizable /DataVault dataset using the layout of the given storage profile.
+    """
+    profile = get_storage_profile(profile)
+    chunks = (profile.chunk_rows,) if profile.chunk_rows else True
+    return h5file.create_dataset(
+        "DataVault",
+        (0,),
+        dtype=dtype,
+        maxshape=(None,),
+        chunks=chunks,
+        compression=profile.compression,
+        compression_opts=profile.compression_opts,
+        shuffle=profile.shuffle,
+    )
+
+
+def sync_file(fh):
+    """
+    Flush a SelfClosingFile and fsync it, if it is open.
+    """
+    if not fh.is_open():
+        return
+    f = fh._file
+    f.flush()
+    if isinstance(f, h5py.File):
+        os.fsync(f.id.get_vfd_handle())
+    else:
+        os.fsync(f.fileno())
+
+
+class FilePool(object):
+    """
+    Shared limit on the number of SelfClosingFiles that are open at once.
+
+    Open files are kept in order of last use. Opening a file while max_open
+    files are open closes the least recently used ones, and one sweep timer
+    closes all files that have not been used for their timeout, so using a
+    file only updates its place in the order. Files are closed through
+    SelfClosingFile.close, so their on_close callbacks run first. Files whose
+    lock is held by a thread are not closed; they count as just used instead.
+    Files are only closed by the pool on the reactor thread.
+    """
+
+    def __init__(
+        self, max_open=MAX_OPEN_FILES, idle_timeout=FILE_TIMEOUT_SEC, reactor=reactor
+    ):
+        self.max_open = max_open
+        self.idle_timeout = idle_timeout
+        self.reactor = reactor
+        # opens of files that were already open, and opens of closed files
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # open SelfClosingFile -> time of last use, least recently used first
+        self._files = OrderedDict()
+        self._sweep_call = None
+
+    def __len__(self):
+        return len(self._files)
+
+    def opened(self, fh):
+        """
+        Add a file that has just been opened.
+        """
+        with self._lock:
+            self.misses += 1
+            self._files[fh] = self.reactor.seconds()
+        util.call_in_reactor(self.reactor, self._opened)
+
+    def used(self, fh):
+        """
+        Record a use of a file that was already open.
+        """
+        with self._lock:
+            self.hits += 1
+            self._touch(fh)
+
+    def closed(self, fh):
+        with self._lock:
+            self._files.pop(fh, None)
+
+    def set_limits(self, max_open=None, idle_timeout=None):
+        """
+        Change max_open and idle_timeout, closing files as needed.
+        Arguments that are None are left unchanged.
+        """
+        if max_open is not None:
+            self.max_open = max_open
+        if idle_timeout is not None:
+            self.idle_timeout = idle_timeout
+        self.evict()
+        if self._sweep_call is not None and self._sweep_call.active():
+            self._sweep_call.cancel()
+        self._schedule_sweep()
+
+    def _touch(self, fh):
+        if fh in self._files:
+            self._files[fh] = self.reactor.seconds()
+            self._files.move_to_end(fh)
+
+    def _due(self, fh, last_used):
+        timeout = self.idle_timeout if fh.timeout is None else fh.timeout
+        return last_used + timeout
+
+    def _close(self, fh):
+        """
+        Close a file unless a thread is using it.
+        Returns:
+            bool: whether the file was closed.
+        """
+        if not fh.lock.acquire(False):
+            with self._lock:
+                self._touch(fh)
+            return False
+        try:
+            fh.close()
+        finally:
+            fh.lock.release()
+        return True
+
+    def _opened(self):
+        self.evict()
+        self._schedule_sweep()
+
+    def evict(self):
+        """
+        Close least recently used files until at most max_open are open.
+        """
+        with self._lock:
+            files = list(self._files)
+        for fh in files:
+            if len(self._files) <= self.max_open:
+                break
+            self._close(fh)
+
+    def _schedule_sweep(self):
+        with self._lock:
+            if not self._files:
+                return
+            due = min(self._due(fh, t) for fh, t in self._files.items())
+        call = self._sweep_call
+        if (call is not None) and call.active():
+            if call.getTime() <= due:
+                return
+            call.cancel()
+        delay = max(due - self.reactor.seconds(), 0)
+        self._sweep_call = self.reactor.callLater(delay, self._sweep)
+
+    def _sweep(self):
+        """
+        Close the files that have not been used for their timeout.
+        """
+        self._sweep_call = None
+        now = self.reactor.seconds()
+        with self._lock:
+            idle = [fh for fh, t in self._files.items() if self._due(fh, t) <= now]
+        for fh in idle:
+            self._close(fh)
+        self._schedule_sweep()
+
+
+_file_pools = WeakKeyDictionary()
+
+
+def get_file_pool(reactor=reactor):
+    """
+    Get the FilePool shared by all files using the given reactor.
+    """
+    pool = _file_pools.get(reactor)
+    if pool is None:
+        pool = _file_pools[reactor] = FilePool(reactor=reactor)
+    return pool
+
+
 class SelfClosingFile(object):
     """
     A container for a file object that manages the underlying file handle.
 
     The file will be opened on demand when this container is called, then
-    closed automatically if not accessed within a specified timeout.
+    closed automatically if not accessed within a specified timeout, or
+    earlier if too many files are open (see FilePool). A timeout of None uses
+    the idle timeout of the pool.
+
+    Threads using the file hold its lock, so that it is not closed or
+    flushed by the reactor while they are working with it.
     """
 
     def __init__(
@@ -83,48 +360,59 @@ class SelfClosingFile(object):
         opener=open,
         open_args=(),
         open_kw=None,
-        timeout=FILE_TIMEOUT_SEC,
+        timeout=None,
         touch=True,
         reactor=reactor,
+        pool=None,
     ):
         if open_kw is None:
             open_kw = dict()
+        if pool is None:
+            pool = get_file_pool(reactor)
         self.opener = opener
         self.open_args = open_args
         self.open_kw = open_kw
         self.timeout = timeout
         self.callbacks = []
         self.reactor = reactor
+        self.pool = pool
+        self.lock = threading.RLock()
+        self._open_lock = threading.Lock()
         if touch:
             self.__call__()
 
     def __call__(self):
         """
-        Start timeout-polling the file for closing.
+        Get the file object, opening the file if it isn't open.
         Runs when an instance is called without arguments
         (e.g. e = Example, e())
         """
         # open the file if we don't already have one
         if not hasattr(self, "_file"):
-            self._file = self.opener(*self.open_args, **self.open_kw)
-            # begin the countdown if called after exceeding the timeout
-            self._fileTimeoutCall = self.reactor.callLater(
-                self.timeout, self._file_timeout
-            )
-        # otherwise, reset the timer
-        else:
-            self._fileTimeoutCall.reset(self.timeout)
+            with self._open_lock:
+                if not hasattr(self, "_file"):
+                    self._file = self.opener(*self.open_args, **self.open_kw)
+                    self.pool.opened(self)
+                    return self._file
+        self.pool.used(self)
         return self._file
 
-    def _file_timeout(self):
+    def close(self):
         """
-        Run all cleanup callbacks, close the file, and delete timeout functions.
+        Close the file now (if it is open), running all cleanup callbacks.
+        Waits for any thread using the file to finish.
         """
-        for callback in self.callbacks:
-            callback(self)
-        self._file.close()
-        del self._file
-        del self._fileTimeoutCall
+        with self.lock:
+            if not hasattr(self, "_file"):
+                return
+            for callback in self.callbacks:
+                callback(self)
+            self._file.close()
+            del self._file
+            self.pool.closed(self)
+
+    def is_open(self):
+        return hasattr(self, "_file")
 
     def size(self):
         return os.fstat(self().fileno()).st_size
@@ -136,6 +424,71 @@ class SelfClosingFile(object):
         self.callbacks.append(callback)
 
 
+class AppendBuffer(object):
+    """
+    In-memory buffer for rows that have been added to a dataset but not yet written to disk.
+
+    The owner's flush function is called once the buffer holds more than max_rows rows
+    or max_bytes bytes, or once the oldest buffered row has waited for max_age seconds.
+    Buffered rows can be read back before they are written. If a lock is given,
+    the max_age flush waits until it can be taken without blocking.
+    """
+
+    def __init__(
+        self,
+        flush,
+        max_rows=BUFFER_MAX_ROWS,
+        max_bytes=BUFFER_MAX_BYTES,
+        max_age=BUFFER_MAX_AGE_SEC,
+        reactor=reactor,
+        lock=None,
+    ):
+        self.flush = flush
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.reactor = reactor
+        self.chunks = []
+        self.rows = 0
+        self.nbytes = 0
+        self._age_timeout = util.Timeout(max_age, self.flush, lock, reactor)
+
+    def __len__(self):
+        return self.rows
+
+    def append(self, data):
+        self.chunks.append(data)
+        self.rows += len(data)
+        self.nbytes += data.nbytes
+        if (self.rows >= self.max_rows) or (self.nbytes >= self.max_bytes):
+            self.flush()
+        else:
+            self._age_timeout.start()
+
+    def _consolidate(self):
+        if len(self.chunks) > 1:
+            self.chunks = [np.concatenate(self.chunks)]
+
+    def read(self, start, stop):
+        """
+        Get buffered rows [start, stop), counted from the first buffered row.
+        """
+        self._consolidate()
+        return self.chunks[0][start:stop]
+
+    def take(self):
+        """
+        Remove and return all buffered rows as a single array.
+        """
+        self._age_timeout.cancel()
+        self._consolidate()
+        data = self.chunks[0]
+        self.chunks = []
+        self.rows = 0
+        self.nbytes = 0
+        return data
+
+
 # INI & CSV FILES
 class IniData(object):
     """
@@ -264,7 +617,7 @@ class IniData(object):
             time = time_to_str(time)
             s.set(sec, "c{}".format(i), repr((time, user, comment)))
 
-        with open(self.infofile, "w") as f:
+        with util.atomic_write(self.infofile) as f:
             s.write(f)
 
     def initialize_info(self, title, indep, dep):
@@ -280,6 +633,12 @@ class IniData(object):
     def dtype(self):
         return np.dtype(",".join(["f8"] * self.cols))
 
+    def save_metadata(self):
+        """
+        Write the metadata; the INI file holds nothing else.
+        """
+        self.save()
+
     def access(self):
         self.accessed = datetime.datetime.now()
 
@@ -310,6 +669,18 @@ class IniData(object):
         d = dict(label=name, data=data)
         self.parameters.append(d)
 
+    def add_params(self, params):
+        """
+        Add several (name, data) parameters. No parameter is added if any name is in use.
+        """
+        names = self.get_param_names()
+        for name, _ in params:
+            if name in names:
+                raise errors.ParameterInUseError(name)
+            names.append(name)
+        for name, data in params:
+            self.parameters.append(dict(label=name, data=data))
+
     def get_parameter(self, name, case_sensitive=True):
         for p in self.parameters:
             if case_sensitive:
@@ -323,6 +694,9 @@ class IniData(object):
     def get_param_names(self):
         return [p["label"] for p in self.parameters]
 
+    def get_parameters(self):
+        return [(p["label"], p["data"]) for p in self.parameters]
+
     def add_comment(self, user, comment):
         self.comments.append((datetime.datetime.now(), user, comment))
 
@@ -346,7 +720,7 @@ class CsvListData(IniData):
     def __init__(
         self,
         filename,
-        file_timeout=FILE_TIMEOUT_SEC,
+        file_timeout=None,
         data_timeout=DATA_TIMEOUT,
         reactor=reactor,
     ):
@@ -357,6 +731,9 @@ class CsvListData(IniData):
         self.timeout = data_timeout
         self.infofile = filename[:-4] + ".ini"
         self.reactor = reactor
+        self._data_timeout = util.Timeout(
+            data_timeout, self._on_timeout, self._file.lock, reactor
+        )
 
     @property
     def file(self):
@@ -374,9 +751,7 @@ class CsvListData(IniData):
         if not hasattr(self, "_data"):
             self._data = []
             self._datapos = 0
-            self._timeout_call = self.reactor.callLater(self.timeout, self._on_timeout)
-        else:
-            self._timeout_call.reset(DATA_TIMEOUT)
+        self._data_timeout.reset()
         f = self.file
         f.seek(self._datapos)
         lines = f.readlines()
@@ -387,7 +762,6 @@ class CsvListData(IniData):
     def _on_timeout(self):
         del self._data
         del self._datapos
-        del self._timeout_call
 
     def _save_data(self, data):
         f = self.file
@@ -416,6 +790,9 @@ class CsvListData(IniData):
             data = self.data[start : start + limit]
         return data, start + len(data)
 
+    def __len__(self):
+        return len(self.data)
+
     def has_more(self, pos):
         return pos < len(self.data)
 
@@ -432,6 +809,9 @@ class CsvNumpyData(CsvListData):
         self._file = SelfClosingFile(open_args=(filename, "a+"), reactor=reactor)
         self.infofile = filename[:-4] + ".ini"
         self.reactor = reactor
+        self._data_timeout = util.Timeout(
+            DATA_TIMEOUT, self._on_timeout, self._file.lock, reactor
+        )
 
     @property
     def file(self):
@@ -441,42 +821,61 @@ class CsvNumpyData(CsvListData):
         """
         Read data from file on demand.
         The data is scheduled to be cleared from memory unless accessed.
+
+        Rows are kept in an array with spare capacity that doubles as it fills,
+        and only lines written to the file since the last read are parsed.
         """
         if not hasattr(self, "_data"):
-            try:
-                # if the file is empty, this line can barf in certain versions
-                # of numpy.  Clearly, if the file does not exist on disk, this
-                # will be the case.  Even if the file exists on disk, we must
-                # check its size
-                if self._file.size() > 0:
-                    self.file.seek(0)
-                    self._data = np.loadtxt(self.file, delimiter=",")
-                else:
-                    self._data = np.array([[]])
-                if len(self._data.shape) == 1:
-                    self._data.shape = (1, len(self._data))
-            except ValueError:
-                # no data saved yet
-                # this error is raised by numpy <=1.2
-                self._data = np.array([[]])
-            except IOError:
-                # no data saved yet
-                # this error is raised by numpy 1.3
-                self.file.seek(0)
-                self._data = np.array([[]])
-            self._timeout_call = self.reactor.callLater(DATA_TIMEOUT, self._on_timeout)
-        else:
-            self._timeout_call.reset(DATA_TIMEOUT)
-        return self._data
-
-    def _set_data(self, data):
-        self._data = data
-
-    data = property(_get_data, _set_data)
+            self._data = np.empty((0, 0))
+            self._rows = 0
+            self._datapos = 0  # byte offset of the first unparsed line
+        self._data_timeout.reset()
+        self._read_tail()
+        if self._rows == 0:
+            return np.array([[]])
+        return self._data[: self._rows]
+
+    data = property(_get_data)
+
+    def _read_tail(self):
+        """
+        Parse complete lines appended to the file since it was last read.
+        """
+        if self._file.size() <= self._datapos:
+            return
+        # read in binary so that the offset is exact regardless of line endings
+        with open(self.filename, "rb") as f:
+            f.seek(self._datapos)
+            chunk = f.read()
+        # a partially written last line is left for the next read
+        end = chunk.rfind(b"\n") + 1
+        if end == 0:
+            return
+        lines = chunk[:end]
+        self._datapos += end
+        if not lines.strip():
+            return
+        self._append_rows(np.loadtxt(io.BytesIO(lines), delimiter=",", ndmin=2))
+
+    def _append_rows(self, rows):
+        """
+        Copy rows into the in-memory array, doubling its capacity when full.
+        """
+        needed = self._rows + len(rows)
+        capacity, cols = self._data.shape
+        if needed > capacity or cols != rows.shape[1]:
+            capacity = max(needed, 2 * capacity)
+            data = np.empty((capacity, rows.shape[1]))
+            if self._rows:
+                data[: self._rows] = self._data[: self._rows]
+            self._data = data
+        self._data[self._rows : needed] = rows
+        self._rows = needed
 
     def _on_timeout(self):
         del self._data
-        del self._timeout_call
+        del self._rows
+        del self._datapos
 
     def _save_data(self, data):
         f = self.file
@@ -491,14 +890,13 @@ class CsvNumpyData(CsvListData):
 
         # Ordinarily, we are using record arrays, but for numpy savetxt we want a 2-D array
         record_data = util.from_record_array(data)
-        # append data to in-memory data
-        if self.data.size > 0:
-            self.data = np.vstack((self.data, record_data))
-        else:
-            self.data = record_data
+        # bring the in-memory data up to date with the file before appending to both
+        self.data
+        self._append_rows(record_data)
 
-        # append data to file
-        self._save_data(data)
+        # append data to file; the rows are already in memory, so skip past them
+        self._save_data(record_data)
+        self._datapos = self._file.size()
 
     def get_data(self, limit, start, transpose, simple_only):
         if transpose:
@@ -514,6 +912,10 @@ class CsvNumpyData(CsvListData):
         nrows = len(data) if data.size > 0 else 0
         return data, start + nrows
 
+    def __len__(self):
+        data = self.data
+        return len(data) if data.size > 0 else 0
+
     def has_more(self, pos):
         # cheesy hack: if pos == 0, we only need to check whether
         # the filesize is nonzero
@@ -540,6 +942,15 @@ class HDF5MetaData(object):
         ("User", h5py.special_dtype(vlen=str)),
         ("Comment", h5py.special_dtype(vlen=str)),
     ]
+    # parameter values are stored as data urls (see labrad_urlencode)
+    parameter_type = [
+        ("Name", h5py.special_dtype(vlen=str)),
+        ("Value", h5py.special_dtype(vlen=str)),
+    ]
+    # access time and (name, data url) parameter entries that have not been
+    # written to the file yet
+    _accessed = None
+    _unsaved_params = ()
 
     def load(self):
         """
@@ -553,6 +964,29 @@ class HDF5MetaData(object):
         """
         pass
 
+    def save_metadata(self):
+        """
+        Write the parameters added and the access time recorded since the last save.
+        """
+        if self._unsaved_params or (self._accessed is not None):
+            self._writing_metadata()
+            self._write_metadata(self.dataset.attrs)
+
+    def _write_metadata(self, attrs):
+        """
+        Write pending parameters and access time to attrs, rewriting the
+        'Parameters' attribute once however many parameters were added.
+        """
+        params, self._unsaved_params = self._unsaved_params, ()
+        if params:
+            entries = np.array(params, dtype=self.parameter_type)
+            if PARAMETERS_ATTR in attrs:
+                entries = np.hstack((attrs[PARAMETERS_ATTR], entries))
+            attrs.create(PARAMETERS_ATTR, entries, dtype=self.parameter_type)
+        accessed, self._accessed = self._accessed, None
+        if accessed is not None:
+            attrs["Access Time"] = accessed
+
     @property
     def dtype(self):
         return self.dataset.dtype
@@ -588,8 +1022,17 @@ class HDF5MetaData(object):
             attrs[prefix + "datatype"] = d.datatype
             attrs[prefix + "unit"] = d.unit
 
+    def _writing_metadata(self):
+        """
+        Called before attributes are written to an existing dataset.
+        """
+        pass
+
     def access(self):
-        self.dataset.attrs["Access Time"] = time()
+        """
+        Record the time of access, to be written by save_metadata.
+        """
+        self._accessed = time()
 
     def get_independents(self):
         attrs = self.dataset.attrs
@@ -664,35 +1107,78 @@ class HDF5MetaData(object):
         type_tag = "({})".format(",".join(column_type))
         return type_tag
 
+    def _get_params(self):
+        """
+        Get all parameters as a {name: value} dict, in the order they were added.
+
+        Parameters are stored together in the 'Parameters' attribute as
+        (name, data url) entries. Older files have one 'Param.<name>' attribute
+        per parameter instead, which are read as well. The parameters are only
+        read and decoded once per open dataset.
+        """
+        if getattr(self, "_params", None) is None:
+            attrs = self.dataset.attrs
+            params = {}
+            for k in attrs:
+                if k.startswith("Param."):
+                    params[str(k[6:])] = labrad_urldecode(attrs[k])
+            if PARAMETERS_ATTR in attrs:
+                for name, value in attrs[PARAMETERS_ATTR]:
+                    params[decode_str(name)] = labrad_urldecode(decode_str(value))
+            self._params = params
+        return self._params
+
     def add_param(self, name, data):
-        keyname = "Param.{}".format(name)
-        if keyname in self.dataset.attrs:
-            raise errors.ParameterInUseError(name)
-        value = labrad_urlencode(data)
-        self.dataset.attrs[keyname] = value
+        self.add_params([(name, data)])
+
+    def add_params(self, params):
+        """
+        Add several (name, data) parameters. No parameter is added if any name
+        is in use.
+
+        The parameters are written to the file by the next save_metadata, so
+        that adding them one at a time does not rewrite the 'Parameters'
+        attribute each time.
+        """
+        existing = self._get_params()
+        new_params = {}
+        for name, data in params:
+            if (name in existing) or (name in new_params):
+                raise errors.ParameterInUseError(name)
+            new_params[name] = data
+        if not new_params:
+            return
+        if not self._unsaved_params:
+            self._unsaved_params = []
+        self._unsaved_params.extend(
+            (name, labrad_urlencode(data)) for name, data in new_params.items()
+        )
+        existing.update(new_params)
 
     def get_parameter(self, name, case_sensitive=True):
         """
         Get a parameter from the dataset.
         """
-        keyname = "Param.{}".format(name)
-        if case_sensitive:
-            if keyname in self.dataset.attrs:
-                return labrad_urldecode(self.dataset.attrs[keyname])
-        else:
-            for k in self.dataset.attrs:
-                if k.lower() == keyname.lower():
-                    return labrad_urldecode(self.dataset.attrs[k])
+        params = self._get_params()
+        if name in params:
+            return params[name]
+        if not case_sensitive:
+            for k, value in params.items():
+                if k.lower() == name.lower():
+                    return value
         raise errors.BadParameterError(name)
 
     def get_param_names(self):
         """
         Get the names of all dataset parameters.
+        """
+        return list(self._get_params())
 
-        Parameter names in the HDF5 file are prefixed with 'Param.' to avoid
-        conflicts with the other metadata.
+    def get_parameters(self):
+        """
+        Get all parameters as a list of (name, value) pairs.
         """
-        return [str(k[6:]) for k in self.dataset.attrs if k.startswith("Param.")]
+        return list(self._get_params().items())
 
     def add_comment(self, user, comment):
         """
@@ -702,6 +1188,7 @@ class HDF5MetaData(object):
         new_comment = np.array([(t, user, comment)], dtype=self.comment_type)
         old_comments = self.dataset.attrs["Comments"]
         data = np.hstack((old_comments, new_comment))
+        self._writing_metadata()
         self.dataset.attrs.create("Comments", data, dtype=self.comment_type)
 
     def get_comments(self, limit, start):
@@ -713,7 +1200,7 @@ class HDF5MetaData(object):
         else:
             raw_comments = self.dataset.attrs["Comments"][start : start + limit]
         comments = [
-            (datetime.datetime.fromtimestamp(c[0]), str(c[1]), str(c[2]))
+            (datetime.datetime.fromtimestamp(c[0]), decode_str(c[1]), decode_str(c[2]))
             for c in raw_comments
         ]
         return comments, start + len(comments)
@@ -722,21 +1209,382 @@ class HDF5MetaData(object):
         return len(self.dataset.attrs["Comments"])
 
 
-class ExtendedHDF5Data(HDF5MetaData):
+# data objects with an append buffer, keyed by absolute filename, so that
+# other readers of the same file can have the buffered rows written first
+_buffered_files = WeakValueDictionary()
+
+
+def flush_buffered_rows(filename):
     """
-    Dataset backed by HDF5 file.
+    Write out rows buffered by a data vault writer of the given file, if there is one.
+    """
+    data = _buffered_files.get(os.path.abspath(filename))
+    if data is not None:
+        data.flush_buffer()
 
-    This supports the extended dataset format which allows each column
-    to have a different type and to be arrays themselves.
+
+def _copy_attrs(src, dst):
+    for name in src.attrs:
+        if name == SWMR_ATTR:
+            continue
+        # the attribute's own dtype keeps the vlen string information
+        dtype = src.attrs.get_id(name).dtype
+        dst.attrs.create(name, src.attrs[name], dtype=dtype)
+
+
+def repack_hdf5_file(src, tmp_file, create_dataset, keep_length=True):
     """
+    Copy an open HDF5 dataset file into a new file with a different layout.
 
-    def __init__(self, fh):
+    The attributes and other groups of the file are copied as they are, except
+    for the SWMR flag, since the new file is not written in the latest format.
+    create_dataset(h5file, dtype, rows) creates the new /DataVault dataset with
+    room for the rows. The Length attribute is set to the number of rows, or
+    removed if keep_length is False. Returns the number of rows copied.
+    """
+    dataset = src["DataVault"]
+    rows = int(dataset.attrs.get("Length", dataset.shape[0]))
+    with h5py.File(tmp_file, "w") as dst:
+        _copy_attrs(src, dst)
+        for name in src:
+            if name != "DataVault":
+                src.copy(src[name], dst, name)
+        copy = create_dataset(dst, dataset.dtype, rows)
+        _copy_attrs(dataset, copy)
+        if "Length" in copy.attrs:
+            if keep_length:
+                copy.attrs["Length"] = rows
+            else:
+                del copy.attrs["Length"]
+        for start in range(0, rows, REPACK_COPY_ROWS):
+            stop = min(start + REPACK_COPY_ROWS, rows)
+            copy[start:stop] = dataset[start:stop]
+    return rows
+
+
+def _create_contiguous_dataset(h5file, dtype, rows):
+    return h5file.create_dataset("DataVault", (rows,), dtype=dtype)
+
+
+def finalize_hdf5_file(filename):
+    """
+    Rewrite a finished HDF5 dataset with its rows stored contiguously.
+
+    The rows are no longer chunked or compressed, so readers can map them
+    straight from the file, and no more rows can be added. The new file is
+    written next to the old one and renamed into place, so the file must not
+    be open for writing. Returns False if the dataset was already contiguous.
+    """
+    flush_buffered_rows(filename)
+    tmp_file = filename + ".finalize"
+    with h5py.File(filename, "r") as src:
+        dataset = src["DataVault"]
+        if dataset.chunks is None:
+            return False
+        try:
+            repack_hdf5_file(
+                src, tmp_file, _create_contiguous_dataset, keep_length=False
+            )
+        except Exception:
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+            raise
+    os.replace(tmp_file, filename)
+    return True
+
+
+class AppendableHDF5Data(HDF5MetaData):
+    """
+    Base class for HDF5 datasets that the data vault appends to.
+
+    Rows passed to add_data are held in an AppendBuffer and written to the
+    /DataVault dataset in batches. The dataset on disk grows geometrically, so
+    it is usually longer than the number of valid rows, which is stored in the
+    'Length' attribute. The dataset is trimmed to its valid rows when the file
+    is closed.
+
+    Files created with swmr=True are written in single-writer/multiple-reader
+    mode, so that other processes can open them with swmr=True and read rows
+    while they are appended. No attributes can be written in SWMR mode, so
+    these files grow by exactly the rows written and have no 'Length'
+    attribute, and writing metadata closes the file so that it is reopened
+    normally; the next append switches SWMR mode back on.
+
+    Once a dataset is finished, finalize() rewrites it with its rows stored
+    contiguously. Reads of a finalized dataset with fixed size columns are then
+    served from a numpy.memmap of the file rather than copied out by h5py.
+    """
+
+    default_version = None
+
+    def __init__(self, fh, swmr=False):
         self._file = fh
         if "Version" not in self.file.attrs:
-            self.file.attrs["Version"] = np.asarray([3, 0, 0], dtype=np.int32)
+            self.file.attrs["Version"] = np.asarray(self.default_version, np.int32)
+        if swmr:
+            self.file.attrs[SWMR_ATTR] = True
+        self.swmr = bool(self.file.attrs.get(SWMR_ATTR, False))
         self.version = np.asarray(self.file.attrs["Version"], np.int32)
+        self._dtype = None
+        self._rows_written = None
+        self._finalized = None
+        # numpy.memmap of the rows of a finalized dataset; False if they can't be mapped
+        self._memmap = None
+        self._buffer = AppendBuffer(self.flush_buffer, reactor=fh.reactor, lock=fh.lock)
+        fh.on_close(self._on_file_close)
+        if fh.open_args:
+            _buffered_files[os.path.abspath(fh.open_args[0])] = self
 
     def initialize_info(self, title, indep, dep):
+        HDF5MetaData.initialize_info(self, title, indep, dep)
+        if not self.swmr:
+            self.dataset.attrs["Length"] = 0
+        self._rows_written = 0
+
+    def start_swmr(self):
+        """
+        Switch the file to SWMR writing if this is an SWMR dataset.
+        """
+        f = self.file
+        if self.swmr and not f.swmr_mode:
+            f.swmr_mode = True
+
+    def _in_swmr_mode(self):
+        return self.swmr and self._file.is_open() and self._file._file.swmr_mode
+
+    def _writing_metadata(self):
+        # attributes can't be written in SWMR mode
+        with self._file.lock:
+            if self._in_swmr_mode():
+                self._file.close()
+
+    def save_metadata(self):
+        """
+        Write pending metadata, see HDF5MetaData.save_metadata.
+
+        A file in SWMR mode is not closed just to write the access time, which
+        is left pending until other metadata is written, the file is reopened
+        normally, or the dataset is finalized.
+        """
+        with self._file.lock:
+            if not self._unsaved_params and self._in_swmr_mode():
+                return
+            HDF5MetaData.save_metadata(self)
+
+    @property
+    def file(self):
+        return self._file()
+
+    @property
+    def dataset(self):
+        return self.file["DataVault"]
+
+    @property
+    def dtype(self):
+        if self._dtype is None:
+            self._dtype = self.dataset.dtype
+        return self._dtype
+
+    @property
+    def finalized(self):
+        """
+        Whether the rows are stored contiguously, so that no more can be added.
+        """
+        if self._finalized is None:
+            self._finalized = self.dataset.chunks is None
+        return self._finalized
+
+    def finalize(self):
+        """
+        Rewrite the file with the rows stored contiguously, see finalize_hdf5_file.
+        Returns False if the dataset was already finalized.
+        """
+        with self._file.lock:
+            HDF5MetaData.save_metadata(self)
+            # writes buffered rows and trims the dataset
+            self._file.close()
+            finalized = finalize_hdf5_file(self._file.open_args[0])
+            self.swmr = False
+            self._rows_written = None
+            self._finalized = True
+            return finalized
+
+    def _get_memmap(self):
+        """
+        Map the rows of a finalized dataset straight from the file.
+        Returns None unless the dataset is contiguous and has fixed size columns.
+        """
+        if self._memmap is None and self.finalized:
+            dataset = self.dataset
+            offset = dataset.id.get_offset()
+            dtype = dataset.dtype
+            if (
+                offset is None
+                or dtype.hasobject
+                or dataset.id.get_type().get_size() != dtype.itemsize
+            ):
+                self._memmap = False
+            else:
+                self._memmap = np.memmap(
+                    self.file.filename, dtype, "r", offset, dataset.shape
+                )
+        return self._memmap if self._memmap is not False else None
+
+    def save(self):
+        """
+        Write any buffered rows to the file.
+        """
+        self.flush_buffer()
+
+    def flush(self):
+        """
+        Write any buffered rows and flush the file to disk if it is open.
+        """
+        self.flush_buffer()
+        if self._file.is_open():
+            self.file.flush()
+
+    def flush_buffer(self):
+        # waits for an I/O thread appending to or reading this file
+        with self._file.lock:
+            if len(self._buffer):
+                self.start_swmr()
+                self._write_buffer(self.dataset)
+
+    def _get_rows_written(self, dataset=None):
+        if self._rows_written is None:
+            if dataset is None:
+                dataset = self.dataset
+            self._rows_written = int(dataset.attrs.get("Length", dataset.shape[0]))
+        return self._rows_written
+
+    def _write_buffer(self, dataset):
+        data = self._buffer.take()
+        start = self._get_rows_written(dataset)
+        stop = start + len(data)
+        if self.swmr:
+            # SWMR readers take the dataset shape as the number of rows
+            dataset.resize((stop,))
+        elif stop > dataset.shape[0]:
+            # grow geometrically so that appends don't resize the dataset every time
+            dataset.resize((max(stop, 2 * dataset.shape[0]),))
+        dataset[start:stop] = data
+        if self.swmr:
+            # make the new rows visible to readers
+            dataset.flush()
+        else:
+            dataset.attrs["Length"] = stop
+        self._rows_written = stop
+
+    def _on_file_close(self, fh):
+        """
+        Write buffered rows and pending metadata, and trim the dataset to its
+        valid rows before the file closes.
+        """
+        self._memmap = None
+        h5file = fh._file
+        if "DataVault" not in h5file:
+            return
+        dataset = h5file["DataVault"]
+        if len(self._buffer):
+            self._write_buffer(dataset)
+        if not h5file.swmr_mode:
+            self._write_metadata(dataset.attrs)
+        if (self._rows_written is not None) and (dataset.shape[0] > self._rows_written):
+            dataset.resize((self._rows_written,))
+
+    def add_data(self, data):
+        """
+        Adds one or more rows of data from a numpy struct array.
+
+        The rows are buffered and written to the file in batches.
+        """
+        if not len(data):
+            return
+        if self.finalized:
+            raise errors.FinalizedError()
+        rows = np.empty((len(data),), dtype=self.dtype)
+        rows[...] = data
+        self._buffer.append(rows)
+
+    def _get_data(self, limit, start):
+        """
+        Get up to limit rows as a struct array, including rows that are still buffered.
+        Rows of finalized datasets are returned as a view of the memory mapped file.
+        """
+        mapped = self._get_memmap()
+        if mapped is not None:
+            stop = len(mapped) if limit is None else min(start + limit, len(mapped))
+            struct_data = mapped[start : max(start, stop)]
+            return struct_data, start + struct_data.shape[0]
+        written = self._get_rows_written()
+        total = written + len(self._buffer)
+        stop = total if limit is None else min(start + limit, total)
+        parts = []
+        if start < min(stop, written):
+            parts.append(self.dataset[start : min(stop, written)])
+        if stop > max(start, written):
+            parts.append(
+                self._buffer.read(max(start, written) - written, stop - written)
+            )
+        if not parts:
+            struct_data = np.zeros((0,), dtype=self.dtype)
+        elif len(parts) == 1:
+            struct_data = parts[0]
+        else:
+            struct_data = np.concatenate(parts)
+        return struct_data, start + struct_data.shape[0]
+
+    def __len__(self):
+        return self._get_rows_written() + len(self._buffer)
+
+    def load_column_index(self, column):
+        """
+        Get the range query index of a column stored in the file.
+        Returns:
+            rangeindex.ColumnIndex: the index, or None if the column has none.
+        """
+        group = self.file.get(INDEX_GROUP)
+        if group is None or str(column) not in group:
+            return None
+        index = group[str(column)]
+        return rangeindex.ColumnIndex(column, index[...], index.attrs["Block Rows"])
+
+    def save_column_index(self, index):
+        """
+        Store the range query index of a column in the file.
+        The index is only kept in memory for SWMR files, which can't have new
+        objects added.
+        """
+        if self.swmr:
+            return
+        group = self.file.require_group(INDEX_GROUP)
+        name = str(index.column)
+        if name in group:
+            del group[name]
+        dataset = group.create_dataset(name, data=index.blocks)
+        dataset.attrs["Block Rows"] = index.block_rows
+
+    def has_more(self, pos):
+        return pos < len(self)
+
+    def shape(self):
+        cols = len(self.get_independents() + self.get_dependents())
+        rows = len(self)
+        return rows, cols
+
+
+class ExtendedHDF5Data(AppendableHDF5Data):
+    """
+    Dataset backed by HDF5 file.
+
+    This supports the extended dataset format which allows each column
+    to have a different type and to be arrays themselves.
+    """
+
+    default_version = [3, 0, 0]
+
+    def initialize_info(self, title, indep, dep, profile=None):
         """
         Initialize the columns when creating a new dataset.
         """
@@ -771,25 +1619,8 @@ class ExtendedHDF5Data(HDF5MetaData):
             else:
                 raise RuntimeError("Invalid type tag {}".format(ttag))
 
-        self.file.create_dataset("DataVault", (0,), dtype=dtype, maxshape=(None,))
-        HDF5MetaData.initialize_info(self, title, indep, dep)
-
-    @property
-    def file(self):
-        return self._file()
-
-    @property
-    def dataset(self):
-        return self.file["DataVault"]
-
-    def add_data(self, data):
-        """
-        Adds one or more rows or data from a numpy struct array.
-        """
-        new_rows = len(data)
-        old_rows = self.dataset.shape[0]
-        self.dataset.resize((old_rows + new_rows,))
-        self.dataset[old_rows : (old_rows + new_rows)] = data
+        create_data_vault_dataset(self.file, dtype, profile)
+        AppendableHDF5Data.initialize_info(self, title, indep, dep)
 
     def get_data(self, limit, start, transpose, simple_only):
         """
@@ -803,55 +1634,47 @@ class ExtendedHDF5Data(HDF5MetaData):
         if transpose:
             return self.get_data_transpose(limit, start)
 
-        data, new_pos = self._get_data(limit, start)
-        row_data = [tuple(row) for row in data]
-        return row_data, new_pos
+        # Rows are zipped together from whole columns, which is much faster
+        # than converting the struct array one row at a time.
+        columns, new_pos = self.get_data_transpose(limit, start)
+        columns = [col if isinstance(col, list) else col.tolist() for col in columns]
+        return list(zip(*columns)), new_pos
 
     def get_data_transpose(self, limit, start):
         struct_data, new_pos = self._get_data(limit, start)
+        string_columns = self._string_columns()
         columns = []
-        for idx in range(len(struct_data.dtype)):
-            col = struct_data["f{}".format(idx)]
-            # Strings are stored as hdf5 vlen objects.  Numpy can't do
-            # variable length strings, so they get encoded as object
-            # arrays by hdf5.  we don't know how to flatten object
-            # arrays so we special case vlen types here and convert
-            # them to lists.  Also, h5py has a bug where when you
-            # index a dataset with a compound type, it loses the
-            # special dtype information, so we pull it directly from
-            # self.dataset.dtype rather than the data returned by
-            # _getData
-            if self.dataset.dtype[idx] == np.object:
-                base_type = h5py.check_dtype(vlen=self.dataset.dtype[idx])
-                if not base_type or not issubclass(base_type, str):
-                    raise RuntimeError(
-                        "Found object type array, but not vlen str.  Not supported.  This shouldn't happen"
-                    )
-                col = [base_type(x) for x in col]
+        for name in struct_data.dtype.names:
+            col = struct_data[name]
+            if name in string_columns:
+                col = decode_vlen_strings(col)
             columns.append(col)
-        columns = tuple(columns)
-        return columns, new_pos
-
-    def _get_data(self, limit, start):
-        if limit is None:
-            struct_data = self.dataset[start:]
-        else:
-            struct_data = self.dataset[start : start + limit]
-        return struct_data, start + struct_data.shape[0]
+        return tuple(columns), new_pos
 
-    def __len__(self):
-        return self.dataset.shape[0]
-
-    def has_more(self, pos):
-        return pos < len(self)
+    def _string_columns(self):
+        """
+        Get the names of the vlen string columns.
 
-    def shape(self):
-        cols = len(self.get_independents() + self.get_dependents())
-        rows = self.dataset.shape[0]
-        return rows, cols
+        Strings are stored as hdf5 vlen objects, which numpy holds in object
+        arrays.  h5py loses the special dtype information when a compound
+        dataset is indexed, so we pull it directly from self.dataset.dtype
+        rather than from the data returned by _get_data.
+        """
+        dtype = self.dataset.dtype
+        names = []
+        for name in dtype.names:
+            if dtype[name].kind != "O":
+                continue
+            base_type = h5py.check_dtype(vlen=dtype[name])
+            if not base_type or not issubclass(base_type, (str, bytes)):
+                raise RuntimeError(
+                    "Found object type array, but not vlen str.  Not supported.  This shouldn't happen"
+                )
+            names.append(name)
+        return names
 
 
-class SimpleHDF5Data(HDF5MetaData):
+class SimpleHDF5Data(AppendableHDF5Data):
     """
     Basic dataset backed by HDF5 file.
 
@@ -861,42 +1684,14 @@ class SimpleHDF5Data(HDF5MetaData):
     is stored in /DataVault within the HDF5 file.
     """
 
-    def __init__(self, fh):
-        self._file = fh
-        if "Version" not in self.file.attrs:
-            self.file.attrs["Version"] = np.asarray([2, 0, 0], dtype=np.int32)
-        self.version = np.asarray(self.file.attrs["Version"], dtype=np.int32)
+    default_version = [2, 0, 0]
 
-    def initialize_info(self, title, indep, dep):
+    def initialize_info(self, title, indep, dep, profile=None):
         ncol = len(indep) + len(dep)
         dtype = [("f{}".format(idx), np.float64) for idx in range(ncol)]
         if "DataVault" not in self.file:
-            self.file.create_dataset("DataVault", (0,), dtype=dtype, maxshape=(None,))
-        HDF5MetaData.initialize_info(self, title, indep, dep)
-
-    @property
-    def file(self):
-        return self._file()
-
-    @property
-    def dataset(self):
-        return self.file["DataVault"]
-
-    def add_data(self, data):
-        """
-        Adds one or more rows or data from a 2D array of floats.
-        """
-        new_rows = data.shape[0]
-        old_rows = self.dataset.shape[0]
-        # if data.shape[1] != len(self.dataset.dtype):
-        #    raise errors.BadDataError(len(self.dataset.dtype), data.shape[1])
-
-        self.dataset.resize((old_rows + new_rows,))
-        # new_data = np.zeros((new_rows,), dtype=self.dataset.dtype)
-        # for col in range(data.shape[1]):
-        #    field = "f%d" % (col,)
-        #    new_data[field] = data[:,col]
-        self.dataset[old_rows : (old_rows + new_rows)] = data
+            create_data_vault_dataset(self.file, dtype, profile)
+        AppendableHDF5Data.initialize_info(self, title, indep, dep)
 
     def get_data(self, limit, start, transpose, simple_only):
         """
@@ -906,27 +1701,10 @@ class SimpleHDF5Data(HDF5MetaData):
             raise RuntimeError(
                 "Transpose specified for simple data format: not supported"
             )
-        if limit is None:
-            struct_data = self.dataset[start:]
-        else:
-            struct_data = self.dataset[start : start + limit]
-        columns = []
-        for idx in range(len(struct_data.dtype)):
-            columns.append(struct_data["f{}".format(idx)])
-        data = np.column_stack(columns)
-        return data, start + data.shape[0]
-
-    def __len__(self):
-        return self.dataset.shape[0]
-
-    def has_more(self, pos):
-        return pos < len(self)
-
-    def shape(self):
-        # todo: maybe better way of doing this? isn't cols just self.dataset.shape[1]?
-        cols = len(self.get_independents() + self.get_dependents())
-        rows = self.dataset.shape[0]
-        return rows, cols
+        struct_data, new_pos = self._get_data(limit, start)
+        # a view of the rows where the columns allow it, e.g. of a memmap
+        data = recfunctions.structured_to_unstructured(struct_data)
+        return data, new_pos
 
 
 class ARTIQHDF5Data(HDF5MetaData):
@@ -1129,6 +1907,65 @@ class MultipleHDF5Data(HDF5MetaData):
         return rows, cols
 
 
+# read-only handles of multi-dataset files: filename -> [SelfClosingFile, references]
+_shared_files = {}
+_shared_files_lock = threading.Lock()
+# names in the 'datasets' group of multi-dataset files: filename -> ((mtime, size), names)
+_dataset_names = {}
+
+
+def acquire_shared_file(filename):
+    """
+    Get the read-only SelfClosingFile shared by all users of a multi-dataset file.
+    Each call must be matched by a call to release_shared_file.
+    """
+    key = os.path.abspath(filename)
+    with _shared_files_lock:
+        entry = _shared_files.get(key)
+        if entry is None:
+            fh = SelfClosingFile(h5py.File, open_args=(filename, "r"), touch=False)
+            entry = _shared_files[key] = [fh, 0]
+        entry[1] += 1
+        return entry[0]
+
+
+def release_shared_file(filename):
+    """
+    Drop a reference to a shared file, closing it once it has no users left.
+    """
+    key = os.path.abspath(filename)
+    with _shared_files_lock:
+        entry = _shared_files.get(key)
+        if entry is None:
+            return
+        entry[1] -= 1
+        if entry[1] > 0:
+            return
+        del _shared_files[key]
+    entry[0].close()
+
+
+def hdf5_dataset_names(filename):
+    """
+    Get the sorted names of the datasets in a multi-dataset HDF5 file.
+    The names are cached until the size or modification time of the file changes.
+    """
+    stat = os.stat(filename)
+    key = os.path.abspath(filename)
+    stamp = (stat.st_mtime_ns, stat.st_size)
+    cached = _dataset_names.get(key)
+    if cached is None or cached[0] != stamp:
+        fh = acquire_shared_file(filename)
+        try:
+            with fh.lock:
+                group = fh().get("datasets")
+                names = sorted(map(str, group.keys())) if group is not None else []
+        finally:
+            release_shared_file(filename)
+        cached = _dataset_names[key] = (stamp, names)
+    return list(cached[1])
+
+
 # FILE BACKEND CREATION
 def open_hdf5_file(filename, dataset_name=None):
     """
@@ -1141,8 +1978,15 @@ def open_hdf5_file(filename, dataset_name=None):
     # selection of a specific dataset name means we have multiple datasets in the file
     # and we have to use MultipleHDF5Data
     if dataset_name is not None:
-        fh = SelfClosingFile(h5py.File, open_args=(filename, "r"))
-        return MultipleHDF5Data(fh, dataset_name)
+        # all datasets of the file share one read-only handle
+        fh = acquire_shared_file(filename)
+        try:
+            data = MultipleHDF5Data(fh, dataset_name)
+        except Exception:
+            release_shared_file(filename)
+            raise
+        finalize(data, release_shared_file, filename)
+        return data
 
     # instantiate the file
     fh = SelfClosingFile(h5py.File, open_args=(filename, "a"))
@@ -1151,6 +1995,11 @@ def open_hdf5_file(filename, dataset_name=None):
     if "artiq_version" in fh().keys():
         return ARTIQHDF5Data(fh)
 
+    # SWMR files have to be opened with the latest file format to switch SWMR on
+    if fh().attrs.get(SWMR_ATTR, False):
+        fh.close()
+        fh.open_kw["libver"] = "latest"
+
     # instantiate correct data object using versioning
     try:
         version = fh().attrs["Version"]
@@ -1162,17 +2011,54 @@ def open_hdf5_file(filename, dataset_name=None):
         print("Error:", e)
 
 
-def create_backend(filename, title, indep, dep, extended):
+def create_backend(filename, title, indep, dep, extended, profile=None, swmr=False):
     """
     Create a data object for a new dataset.
+
+    profile selects the chunk shape, compression filter and chunk cache size
+    of the new file (see STORAGE_PROFILES). The chunk cache size only applies
+    while the file stays open in this session; reopened files use the h5py default.
+
+    With swmr=True the file is written in single-writer/multiple-reader mode
+    once its metadata has been initialized (see AppendableHDF5Data).
     """
+    profile = get_storage_profile(profile)
     hdf5_file = filename + ".hdf5"
-    fh = SelfClosingFile(h5py.File, open_args=(hdf5_file, "a"))
-    data = ExtendedHDF5Data(fh) if extended else SimpleHDF5Data(fh)
-    data.initialize_info(title, indep, dep)
+    open_kw = dict()
+    if profile.cache_bytes:
+        open_kw["rdcc_nbytes"] = profile.cache_bytes
+    if swmr:
+        # SWMR needs the latest file format
+        open_kw["libver"] = "latest"
+    fh = SelfClosingFile(h5py.File, open_args=(hdf5_file, "a"), open_kw=open_kw)
+    data = ExtendedHDF5Data(fh, swmr) if extended else SimpleHDF5Data(fh, swmr)
+    data.initialize_info(title, indep, dep, profile)
+    data.start_swmr()
     return data
 
 
+def migrated_from_csv(hdf5_file, csv_file):
+    """
+    Check whether an HDF5 file is a complete migration of the current CSV file.
+
+    Migrated files record the size and modification time of the CSV file they
+    were converted from, so a CSV file that was appended to afterwards no
+    longer matches.
+    """
+    if not os.path.exists(hdf5_file):
+        return False
+    try:
+        stat = os.stat(csv_file)
+        with h5py.File(hdf5_file, "r") as f:
+            attrs = f.attrs
+            return (
+                attrs.get(CSV_SOURCE_SIZE) == stat.st_size
+                and attrs.get(CSV_SOURCE_MTIME) == stat.st_mtime
+            )
+    except (OSError, KeyError):
+        return False
+
+
 def open_backend(filename, dataset_name=None):
     """
     Make a data object that manages in-memory and on-disk storage for a dataset.
@@ -1180,6 +2066,7 @@ def open_backend(filename, dataset_name=None):
     filename should be specified without a file extension. If there is an existing
     file in csv format, we create a backend of the appropriate type. If
     no file exists, we create a new backend to store data in binary form.
+    CSV datasets that have been migrated to HDF5 are opened from the HDF5 file.
     """
     csv_file = filename + ".csv"
     hdf5_file = filename + ".hdf5"
@@ -1187,9 +2074,13 @@ def open_backend(filename, dataset_name=None):
 
     # check to see whether the CSV file exists
     if os.path.exists(csv_file):
+        if migrated_from_csv(hdf5_file, csv_file):
+            flush_buffered_rows(hdf5_file)
+            return open_hdf5_file(hdf5_file, dataset_name)
         return CsvNumpyData(csv_file)
     # check to see whether the HDF5 file exists
     elif os.path.exists(hdf5_file):
+        flush_buffered_rows(hdf5_file)
         return open_hdf5_file(hdf5_file, dataset_name)
     elif os.path.exists(h5_file):
         return open_hdf5_file(h5_file, dataset_name)
@@ -0,0 +1,472 @@
+"""
+SQLite catalog of the datasets in all data vault directories.
+
+Every dataset has a row with its path, number, title, creation time and
+shape, together with its tags and its scalar parameters, so that datasets can
+be found without opening their files. The server updates the catalog as
+datasets are created, tagged and given parameters, and a crawler run in a
+background thread adds datasets that were written before the catalog existed
+or by other programs.
+
+Searches are written as space-separated terms, which must all match:
+
+    word            the title contains word (case-insensitive)
+    tag:name        the dataset has the tag
+    after:date      created on or after the date (YYYY-MM-DD[THH:MM[:SS]])
+    before:date     created before the date
+    name=value      the parameter has the value; numbers compare numerically
+    name<value      also <=, >, >= and != for numeric parameters
+
+Terms containing spaces can be quoted, e.g. '"Center Frequency">=10'.
+Parameters with units compare in the units they were stored with.
+"""
+
+import json
+import os
+import re
+import shlex
+import sqlite3
+import threading
+from datetime import datetime
+
+import h5py
+
+from . import backend, errors, util
+
+CATALOG_FILENAME = "catalog.sqlite"
+SEARCH_LIMIT = 1000  # most datasets returned by a search
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS datasets (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL,
+    name TEXT NOT NULL,
+    number INTEGER,
+    title TEXT,
+    created REAL,
+    rows INTEGER,
+    cols INTEGER,
+    mtime REAL,
+    UNIQUE (path, name)
+);
+CREATE INDEX IF NOT EXISTS datasets_created ON datasets (created);
+CREATE TABLE IF NOT EXISTS tags (
+    dataset_id INTEGER NOT NULL REFERENCES datasets (id) ON DELETE CASCADE,
+    tag TEXT NOT NULL,
+    PRIMARY KEY (dataset_id, tag)
+);
+CREATE INDEX IF NOT EXISTS tags_tag ON tags (tag);
+CREATE TABLE IF NOT EXISTS parameters (
+    dataset_id INTEGER NOT NULL REFERENCES datasets (id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    value TEXT,
+    number REAL,
+    PRIMARY KEY (dataset_id, name)
+);
+CREATE INDEX IF NOT EXISTS parameters_number ON parameters (name, number);
+CREATE INDEX IF NOT EXISTS parameters_value ON parameters (name, value);
+"""
+
+_NUMBER = re.compile(r"^(\d+) - ")
+_COMPARISON = re.compile(r"^(.+?)(<=|>=|!=|=|<|>)(.*)$")
+
+
+def dataset_number(name):
+    match = _NUMBER.match(name)
+    return int(match.group(1)) if match else None
+
+
+def parameter_columns(value):
+    """
+    Get the (value, number) columns a parameter is stored with.
+    Returns:
+        (str, float): the value as text and as a number, or None if it isn't a
+            number; None for parameters that are not catalogued.
+    """
+    if isinstance(value, str):
+        return value, None
+    if isinstance(value, bool):
+        return str(value), float(value)
+    if isinstance(value, (int, float)) or hasattr(value, "dtype"):
+        try:
+            return str(value), float(value)
+        except (TypeError, ValueError):
+            return None
+    if hasattr(value, "unit"):
+        # labrad values with units are compared in their own units
+        try:
+            return str(value), float(value[value.unit])
+        except (TypeError, ValueError):
+            return None
+    return None
+
+
+def _parse_time(text):
+    try:
+        return datetime.fromisoformat(text).timestamp()
+    except ValueError:
+        raise errors.BadQueryError(text, "dates are written YYYY-MM-DD")
+
+
+def _number(text):
+    try:
+        return float(text)
+    except ValueError:
+        return None
+
+
+def parse_query(query):
+    """
+    Translate a search query into an SQL condition on the datasets table.
+    Returns:
+        (str, list): the condition and its arguments.
+    """
+    try:
+        terms = shlex.split(query)
+    except ValueError as e:
+        raise errors.BadQueryError(query, str(e))
+    conditions = []
+    args = []
+    for term in terms:
+        key, sep, value = term.partition(":")
+        if sep and key == "tag":
+            conditions.append("id IN (SELECT dataset_id FROM tags WHERE tag = ?)")
+            args.append(value)
+        elif sep and key == "after":
+            conditions.append("created >= ?")
+            args.append(_parse_time(value))
+        elif sep and key == "before":
+            conditions.append("created < ?")
+            args.append(_parse_time(value))
+        elif _COMPARISON.match(term):
+            name, op, value = _COMPARISON.match(term).groups()
+            number = _number(value)
+            if number is not None:
+                column, arg = "number", number
+            elif op in ("=", "!="):
+                column, arg = "value", value
+            else:
+                raise errors.BadQueryError(term, "only numbers can be ordered")
+            conditions.append(
+                "id IN (SELECT dataset_id FROM parameters"
+                " WHERE name = ? AND {} {} ?)".format(column, op)
+            )
+            args.extend([name, arg])
+        else:
+            escaped = term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            conditions.append("title LIKE ? ESCAPE '\\'")
+            args.append("%" + escaped + "%")
+    return " AND ".join(conditions) or "1", args
+
+
+class _FileMetaData(backend.HDF5MetaData):
+    """
+    Metadata of an HDF5 file opened by the crawler.
+    """
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+
+
+def read_hdf5_info(filename):
+    """
+    Read the catalog entry of an HDF5 dataset file.
+    Returns:
+        dict: the dataset columns and its parameters, or None for files that
+            don't hold a single data vault dataset.
+    """
+    with h5py.File(filename, "r") as f:
+        if "DataVault" not in f:
+            return None
+        meta = _FileMetaData(f["DataVault"])
+        attrs = meta.dataset.attrs
+        return dict(
+            title=backend.decode_str(attrs["Title"]),
+            created=float(attrs["Creation Time"]),
+            rows=int(attrs.get("Length", meta.dataset.shape[0])),
+            cols=len(meta.get_independents()) + len(meta.get_dependents()),
+            params=meta.get_parameters(),
+        )
+
+
+def read_csv_info(csv_file):
+    """
+    Read the catalog entry of a CSV dataset from its INI file.
+    """
+    meta = backend.IniData()
+    meta.infofile = csv_file[:-4] + ".ini"
+    meta.load()
+    rows = 0
+    with open(csv_file, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            rows += chunk.count(b"\n")
+    return dict(
+        title=meta.title,
+        created=meta.created.timestamp(),
+        rows=rows,
+        cols=len(meta.get_independents()) + len(meta.get_dependents()),
+        params=meta.get_parameters(),
+    )
+
+
+def read_dataset_tags(directory):
+    """
+    Get the dataset tags stored in the session.ini file of a directory.
+    """
+    s = util.DVSafeConfigParser()
+    s.read(os.path.join(directory, "session.ini"))
+    if not s.has_section("Tags"):
+        return {}
+    return eval(s.get("Tags", "datasets", raw=True))
+
+
+def _decode(name):
+    # imported here since the package imports this module
+    from . import filename_decode
+
+    return filename_decode(name)
+
+
+class Catalog(object):
+    """
+    The dataset catalog, stored in an SQLite database.
+
+    Paths are session paths, i.e. lists of directory names starting with ''
+    and the name of the data directory. All methods can be called from any
+    thread. The database is opened on first use, and opened again on the next
+    use after close.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.crawling = False
+        self._lock = threading.Lock()
+        self._connection = None
+
+    @property
+    def _db(self):
+        # only used while holding the lock
+        if self._connection is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.filename)), exist_ok=True)
+            db = sqlite3.connect(self.filename, check_same_thread=False)
+            db.execute("PRAGMA journal_mode = WAL")
+            db.execute("PRAGMA synchronous = NORMAL")
+            db.execute("PRAGMA foreign_keys = ON")
+            db.executescript(_SCHEMA)
+            self._connection = db
+        return self._connection
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    def _id(self, path, name):
+        row = self._db.execute(
+            "SELECT id FROM datasets WHERE path = ? AND name = ?",
+            (json.dumps(list(path)), name),
+        ).fetchone()
+        return None if row is None else row[0]
+
+    def _add(self, path, name, title, created, rows, cols, mtime):
+        self._db.execute(
+            "INSERT INTO datasets (path, name, number, title, created, rows, cols, mtime)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+            " ON CONFLICT (path, name) DO UPDATE SET number = excluded.number,"
+            " title = excluded.title, created = excluded.created,"
+            " rows = excluded.rows, cols = excluded.cols, mtime = excluded.mtime",
+            (
+                json.dumps(list(path)),
+                name,
+                dataset_number(name),
+                title,
+                created,
+                rows,
+                cols,
+                mtime,
+            ),
+        )
+        return self._id(path, name)
+
+    def _set_tags(self, dataset_id, tags):
+        self._db.execute("DELETE FROM tags WHERE dataset_id = ?", (dataset_id,))
+        self._db.executemany(
+            "INSERT INTO tags (dataset_id, tag) VALUES (?, ?)",
+            [(dataset_id, tag) for tag in tags],
+        )
+
+    def _add_parameters(self, dataset_id, params):
+        rows = []
+        for name, value in params:
+            columns = parameter_columns(value)
+            if columns is not None:
+                rows.append((dataset_id, name) + columns)
+        self._db.executemany(
+            "INSERT OR REPLACE INTO parameters (dataset_id, name, value, number)"
+            " VALUES (?, ?, ?, ?)",
+            rows,
+        )
+
+    def add_dataset(self, path, name, title, created, rows=0, cols=0, tags=()):
+        """
+        Add a dataset created by the server.
+        """
+        with self._lock, self._db:
+            dataset_id = self._add(path, name, title, created, rows, cols, None)
+            self._set_tags(dataset_id, tags)
+
+    def set_shapes(self, shapes):
+        """
+        Update the number of rows and columns of datasets.
+        Arguments:
+            shapes  (list): (path, name, rows, cols) of each dataset.
+        """
+        with self._lock, self._db:
+            self._db.executemany(
+                "UPDATE datasets SET rows = ?, cols = ? WHERE path = ? AND name = ?",
+                [
+                    (rows, cols, json.dumps(list(path)), name)
+                    for path, name, rows, cols in shapes
+                ],
+            )
+
+    def set_tags(self, path, name, tags):
+        """
+        Replace the tags of a dataset. Unknown datasets are ignored.
+        """
+        with self._lock, self._db:
+            dataset_id = self._id(path, name)
+            if dataset_id is not None:
+                self._set_tags(dataset_id, tags)
+
+    def add_parameters(self, path, name, params):
+        """
+        Add (name, value) parameters of a dataset. Only numbers, strings and
+        values with units are catalogued, and unknown datasets are ignored.
+        """
+        with self._lock, self._db:
+            dataset_id = self._id(path, name)
+            if dataset_id is not None:
+                self._add_parameters(dataset_id, params)
+
+    def search(self, query, limit=SEARCH_LIMIT):
+        """
+        Find datasets matching a query (see the module docstring).
+        Returns:
+            list((list(str), str)): (path, name) of the matching datasets,
+                newest first.
+        """
+        condition, args = parse_query(query)
+        sql = (
+            "SELECT path, name FROM datasets WHERE {}"
+            " ORDER BY created DESC, id DESC LIMIT ?".format(condition)
+        )
+        with self._lock:
+            rows = self._db.execute(sql, args + [limit]).fetchall()
+        return [(json.loads(path), name) for path, name in rows]
+
+    def crawl(self, datadirs):
+        """
+        Bring the catalog up to date with the datasets on disk.
+
+        Files whose modification time is unchanged since they were last
+        catalogued are not opened again. Datasets that no longer exist are
+        removed from the catalog.
+        Arguments:
+            datadirs    (dict): {root name: parent directory}, as SessionStore.datadirs.
+        Returns:
+            int: the number of datasets read.
+        """
+        self.crawling = True
+        try:
+            with self._lock:
+                # datasets added while crawling are kept even if the walk missed them
+                (last_id,) = self._db.execute("SELECT MAX(id) FROM datasets").fetchone()
+            seen = set()
+            read = 0
+            for root, parent in sorted(datadirs.items()):
+                top = os.path.join(parent, root)
+                for dirpath, dirnames, filenames in os.walk(top):
+                    dirnames.sort()
+                    parts = os.path.relpath(dirpath, top).split(os.sep)
+                    path = ["", root] + [_decode(p) for p in parts if p != "."]
+                    read += self._crawl_dir(path, dirpath, filenames, seen)
+            self._remove_missing(datadirs, seen, last_id)
+            return read
+        finally:
+            self.crawling = False
+
+    def _crawl_dir(self, path, directory, filenames, seen):
+        key = json.dumps(path)
+        with self._lock:
+            mtimes = dict(
+                self._db.execute(
+                    "SELECT name, mtime FROM datasets WHERE path = ?", (key,)
+                ).fetchall()
+            )
+        entries = []
+        for filename in sorted(filenames):
+            base, ext = os.path.splitext(filename)
+            filepath = os.path.join(directory, filename)
+            if ext in (".hdf5", ".h5"):
+                reader = read_hdf5_info
+            elif ext == ".csv" and os.path.exists(
+                os.path.join(directory, base + ".ini")
+            ):
+                if backend.migrated_from_csv(
+                    os.path.join(directory, base + ".hdf5"), filepath
+                ):
+                    continue
+                reader = read_csv_info
+            else:
+                continue
+            name = _decode(base)
+            mtime = os.path.getmtime(filepath)
+            seen.add((key, name))
+            if mtimes.get(name) == mtime:
+                continue
+            try:
+                info = reader(filepath)
+            except Exception as e:
+                print("catalog: could not read {}: {}".format(filepath, e))
+                continue
+            if info is not None:
+                entries.append((name, mtime, info))
+        if not entries and not mtimes:
+            return 0
+
+        tags = read_dataset_tags(directory)
+        with self._lock, self._db:
+            for name, mtime, info in entries:
+                dataset_id = self._add(
+                    path,
+                    name,
+                    info["title"],
+                    info["created"],
+                    info["rows"],
+                    info["cols"],
+                    mtime,
+                )
+                self._db.execute(
+                    "DELETE FROM parameters WHERE dataset_id = ?", (dataset_id,)
+                )
+                self._add_parameters(dataset_id, info["params"])
+            for name in set(mtimes) | set(name for name, _, _ in entries):
+                dataset_id = self._id(path, name)
+                if dataset_id is not None:
+                    self._set_tags(dataset_id, sorted(tags.get(name, ())))
+        return len(entries)
+
+    def _remove_missing(self, datadirs, seen, last_id):
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT id, path, name FROM datasets WHERE id <= ?", (last_id or 0,)
+            ).fetchall()
+        missing = [
+            (dataset_id,)
+            for dataset_id, path, name in rows
+            if (path, name) not in seen and json.loads(path)[1] in datadirs
+        ]
+        with self._lock, self._db:
+            self._db.executemany("DELETE FROM datasets WHERE id = ?", missing)
@@ -0,0 +1,361 @@
+"""
+Repacks old HDF5 datasets with a compressed storage profile.
+
+Datasets that have not been touched for a number of days are never written
+again, but keep the chunking and compression they were created with. Each such
+dataset is copied into a new file laid out with the given storage profile
+(archive by default), in a pool of worker processes. The copy is read back and
+its rows, parameters, comments and other attributes compared with the original,
+and only then renamed over it, keeping the original modification time. The
+listing index of the directory is updated with the new file, so the next
+listing does not have to open it again.
+
+On POSIX systems this is safe to run while the data vault is serving, as long
+as HDF5 file locking is left on (the default):
+    - files that another process has open for writing are skipped; HDF5 holds
+      an exclusive lock on them, so a shared lock can't be taken
+    - the original is then read without a lock, so the data vault can still
+      open it while it is copied
+    - a file whose size or modification time changes during the copy, e.g.
+      because the data vault opened it, is left alone and reported as failed
+    - a shared lock is held on the original while it is checked for changes
+      and replaced, so the data vault can't open it for writing in between;
+      a request that tries to in that instant fails and can be retried
+    - session.ini files are not touched, since the data vault keeps them in
+      memory and rewrites them; nothing in them refers to the file layout
+HDF5 does not lock files on Windows, so there the data vault must be stopped.
+
+Finalized (contiguous) datasets, datasets that already use the profile's
+compression, and files without a data vault dataset are skipped.
+
+Usage:
+    python -m data_vault_clayton.compact ROOT [ROOT ...] [--days N] [--workers N] [--profile NAME]
+"""
+
+import argparse
+import contextlib
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import h5py
+import numpy as np
+
+from . import backend, listing
+
+try:
+    import fcntl
+except ImportError:
+    # Windows, where HDF5 doesn't lock files either
+    fcntl = None
+
+# datasets not touched for this many days are compacted
+DEFAULT_AGE_DAYS = 30
+# files repacked at once; kept low since data directories are often on network shares
+DEFAULT_WORKERS = 2
+DEFAULT_PROFILE = "archive"
+_COMPACTING_SUFFIX = ".compacting"
+
+
+class CompactionError(Exception):
+    pass
+
+
+class _InUseError(Exception):
+    pass
+
+
+@contextlib.contextmanager
+def _shared_lock(filename):
+    """
+    Hold the shared lock that HDF5 takes for readers on a file.
+
+    Raises _InUseError if another process has the file open for writing.
+    """
+    if fcntl is None:
+        yield
+        return
+    with open(filename, "rb") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_SH | fcntl.LOCK_NB)
+        except OSError:
+            raise _InUseError(filename)
+        yield
+
+
+def store_roots(session_store):
+    """
+    Get the data directories of a SessionStore.
+    """
+    return [
+        os.path.join(parent, name) for name, parent in session_store.datadirs.items()
+    ]
+
+
+def find_old_datasets(root, age_days=DEFAULT_AGE_DAYS, now=None):
+    """
+    Find HDF5 datasets below a directory that have not been modified for age_days.
+    Arguments:
+        root        (str): the directory to search.
+        age_days    (float): the age in days of the oldest files left alone.
+        now         (float): the current time, for testing.
+    Returns:
+        list(str): paths of the .hdf5 files, in directory order.
+    """
+    cutoff = (time.time() if now is None else now) - age_days * 86400
+    hdf5_files = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if not filename.endswith(".hdf5"):
+                continue
+            path = os.path.join(dirpath, filename)
+            if os.stat(path).st_mtime < cutoff:
+                hdf5_files.append(path)
+    return hdf5_files
+
+
+def _uses_profile(dataset, profile):
+    return dataset.compression == profile.compression and (
+        profile.compression_opts is None
+        or dataset.compression_opts == profile.compression_opts
+    )
+
+
+def _value(value):
+    return value.tolist() if isinstance(value, np.ndarray) else value
+
+
+def _rows_equal(first, second):
+    for name in first.dtype.names:
+        a, b = first[name], second[name]
+        if a.dtype.kind in "fc":
+            equal = np.array_equal(a, b, equal_nan=True)
+        else:
+            equal = _value(a) == _value(b)
+        if not equal:
+            return False
+    return True
+
+
+def _verify(filename, tmp_file):
+    """
+    Check that a repacked file holds the same rows and attributes as the original.
+    """
+    with h5py.File(filename, "r", locking=False) as src, h5py.File(
+        tmp_file, "r"
+    ) as dst:
+        for name in src.attrs:
+            if name == backend.SWMR_ATTR:
+                # not copied, since the new file isn't in the latest format
+                continue
+            if _value(src.attrs[name]) != _value(dst.attrs[name]):
+                raise CompactionError(
+                    "{}: attribute {} does not match".format(filename, name)
+                )
+        old, new = src["DataVault"], dst["DataVault"]
+        rows = int(old.attrs.get("Length", old.shape[0]))
+        if new.shape[0] != rows or new.attrs.get("Length", rows) != rows:
+            raise CompactionError(
+                "{}: expected {} rows, found {}".format(filename, rows, new.shape[0])
+            )
+        for name in old.attrs:
+            if _value(old.attrs[name]) != _value(new.attrs[name]):
+                raise CompactionError(
+                    "{}: attribute {} does not match".format(filename, name)
+                )
+        for start in range(0, rows, backend.REPACK_COPY_ROWS):
+            stop = min(start + backend.REPACK_COPY_ROWS, rows)
+            if not _rows_equal(old[start:stop], new[start:stop]):
+                raise CompactionError("{}: data does not match".format(filename))
+
+
+def compact_dataset(filename, profile=DEFAULT_PROFILE):
+    """
+    Repack one HDF5 dataset with a storage profile and swap it in.
+    Arguments:
+        filename    (str): path of the .hdf5 file.
+        profile     (str): storage profile of the new file.
+    Returns:
+        (int, int): the size of the file before and after, or None if the
+            file was skipped.
+    """
+    layout = backend.get_storage_profile(profile)
+    before = os.stat(filename)
+    try:
+        with _shared_lock(filename):
+            pass
+    except _InUseError:
+        return None
+
+    def create_dataset(h5file, dtype, rows):
+        copy = backend.create_data_vault_dataset(h5file, dtype, layout)
+        copy.resize((rows,))
+        return copy
+
+    tmp_file = filename + _COMPACTING_SUFFIX
+    try:
+        with h5py.File(filename, "r", locking=False) as src:
+            dataset = src.get("DataVault")
+            if not isinstance(dataset, h5py.Dataset) or dataset.chunks is None:
+                return None
+            if _uses_profile(dataset, layout):
+                return None
+            backend.repack_hdf5_file(src, tmp_file, create_dataset)
+        _verify(filename, tmp_file)
+
+        os.utime(tmp_file, ns=(before.st_atime_ns, before.st_mtime_ns))
+        size = os.path.getsize(tmp_file)
+        try:
+            with _shared_lock(filename):
+                after = os.stat(filename)
+                if (after.st_mtime_ns, after.st_size) != (
+                    before.st_mtime_ns,
+                    before.st_size,
+                ):
+                    raise CompactionError(
+                        "{} changed while it was compacted".format(filename)
+                    )
+                os.replace(tmp_file, filename)
+        except _InUseError:
+            return None
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+    return before.st_size, size
+
+
+class Compaction(object):
+    """
+    Repacks a list of HDF5 datasets in a pool of worker processes.
+
+    Progress is available from total, done, skipped, failed and saved (in
+    bytes) while run is in progress. If root directories are given, the old
+    datasets below them are found when the compaction runs.
+    """
+
+    def __init__(
+        self,
+        hdf5_files=(),
+        workers=DEFAULT_WORKERS,
+        profile=DEFAULT_PROFILE,
+        roots=(),
+        age_days=DEFAULT_AGE_DAYS,
+    ):
+        self.hdf5_files = list(hdf5_files)
+        self.workers = workers
+        self.profile = profile
+        self.roots = list(roots)
+        self.age_days = age_days
+        self.done = 0
+        self.skipped = 0
+        self.saved = 0
+        # (hdf5 file, error message)
+        self.failed = []
+        self.running = False
+
+    @property
+    def total(self):
+        return len(self.hdf5_files)
+
+    def run(self, report=None):
+        """
+        Repack all datasets, calling report(hdf5_file, sizes, error) after each one.
+        """
+        self.running = True
+        try:
+            for root in self.roots:
+                self.hdf5_files.extend(find_old_datasets(root, self.age_days))
+            self.roots = []
+            with ProcessPoolExecutor(max_workers=self.workers) as pool:
+                futures = {
+                    pool.submit(compact_dataset, hdf5_file, self.profile): hdf5_file
+                    for hdf5_file in self.hdf5_files
+                }
+                for future in as_completed(futures):
+                    hdf5_file = futures[future]
+                    sizes, error = None, None
+                    try:
+                        sizes = future.result()
+                    except Exception as e:
+                        error = str(e) or type(e).__name__
+                        self.failed.append((hdf5_file, error))
+                    else:
+                        self._compacted(hdf5_file, sizes)
+                    if report is not None:
+                        report(hdf5_file, sizes, error)
+        finally:
+            self.running = False
+        return self
+
+    def _compacted(self, hdf5_file, sizes):
+        if sizes is None:
+            self.skipped += 1
+            return
+        self.done += 1
+        self.saved += sizes[0] - sizes[1]
+        # record the new size so that the next listing doesn't open the file
+        directory, filename = os.path.split(hdf5_file)
+        index = listing.ListingIndex(directory)
+        index.replaced(filename)
+        index.save()
+
+
+def main(argv=sys.argv[1:]):
+    parser = argparse.ArgumentParser(
+        description="Repack old HDF5 datasets below a directory with compression."
+    )
+    parser.add_argument("roots", nargs="+", help="data vault directories to search")
+    parser.add_argument(
+        "--days",
+        type=float,
+        default=DEFAULT_AGE_DAYS,
+        help="only repack datasets not modified for this many days "
+        "(default: %(default)s)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=DEFAULT_WORKERS,
+        help="number of datasets repacked at once (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--profile",
+        default=DEFAULT_PROFILE,
+        choices=sorted(backend.STORAGE_PROFILES),
+        help="storage profile of the new files (default: %(default)s)",
+    )
+    args = parser.parse_args(argv)
+
+    compaction = Compaction(
+        workers=args.workers,
+        profile=args.profile,
+        roots=args.roots,
+        age_days=args.days,
+    )
+
+    def report(hdf5_file, sizes, error):
+        count = compaction.done + compaction.skipped + len(compaction.failed)
+        if error is not None:
+            status = "FAILED: " + error
+        elif sizes is None:
+            status = "skipped"
+        else:
+            status = "{:.2f} MB -> {:.2f} MB".format(sizes[0] / 1e6, sizes[1] / 1e6)
+        print("[{}/{}] {}: {}".format(count, compaction.total, hdf5_file, status))
+
+    compaction.run(report)
+    print(
+        "{} compacted, {} skipped, {} failed, {:.2f} MB saved".format(
+            compaction.done,
+            compaction.skipped,
+            len(compaction.failed),
+            compaction.saved / 1e6,
+        )
+    )
+    return 1 if compaction.failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,143 @@
+"""
+Min/max envelopes of datasets, for plotting large datasets.
+
+The rows to plot are split into bins of consecutive rows, and each bin is
+replaced by two rows holding the minimum and the maximum of every column in
+the bin. Drawn in order, the envelope has the same outline as the full data,
+but its size only depends on the number of bins.
+
+Datasets are only ever appended to, so the minima and maxima of blocks of rows
+that have been completely written never change. Envelope caches them, so that
+rows are only read from the file once when the bins are larger than a block.
+"""
+
+import numpy as np
+
+BLOCK_ROWS = 4096  # rows per cached block
+READ_ROWS = 65536  # rows read from the file at once
+
+
+def reduce_bins(read, edges, ncols):
+    """
+    Get the column minima and maxima of the rows in each bin.
+    NaNs are ignored, and columns without any other values give NaN.
+    Arguments:
+        read    (callable): read(start, stop) returns rows [start, stop) as a 2-D float array.
+        edges   (array): strictly increasing row numbers; bin i holds rows [edges[i], edges[i+1]).
+        ncols   (int): number of columns.
+    Returns:
+        (array, array): minima and maxima, each of shape (len(edges) - 1, ncols).
+    """
+    edges = np.asarray(edges, dtype=np.int64)
+    nbins = len(edges) - 1
+    mins = np.full((nbins, ncols), np.nan)
+    maxs = np.full((nbins, ncols), np.nan)
+    for pos in range(edges[0], edges[-1], READ_ROWS):
+        chunk = read(pos, min(pos + READ_ROWS, edges[-1]))
+        if not len(chunk):
+            break
+        end = pos + len(chunk)
+        # bins first ... last - 1 have rows in this chunk
+        first = np.searchsorted(edges, pos, "right") - 1
+        last = np.searchsorted(edges, end, "left")
+        starts = np.maximum(edges[first:last], pos) - pos
+        idx = slice(first, last)
+        mins[idx] = np.fmin(mins[idx], np.fmin.reduceat(chunk, starts, axis=0))
+        maxs[idx] = np.fmax(maxs[idx], np.fmax.reduceat(chunk, starts, axis=0))
+    return mins, maxs
+
+
+class Envelope(object):
+    """
+    Computes min/max envelopes of one dataset.
+
+    Bins of at least two blocks are aligned to block boundaries and put
+    together from the cached block minima and maxima; only the rows before the
+    first and after the last whole block are read. Smaller bins are computed
+    from the rows directly.
+    """
+
+    def __init__(self, block_rows=BLOCK_ROWS):
+        self.block_rows = block_rows
+        # minima and maxima of blocks 0 ... len(self._mins) - 1
+        self._mins = None
+        self._maxs = None
+
+    def _blocks(self, read, nblocks, ncols):
+        cached = 0 if self._mins is None else len(self._mins)
+        if nblocks > cached:
+            edges = np.arange(cached, nblocks + 1) * self.block_rows
+            mins, maxs = reduce_bins(read, edges, ncols)
+            if cached:
+                mins = np.concatenate((self._mins, mins))
+                maxs = np.concatenate((self._maxs, maxs))
+            self._mins, self._maxs = mins, maxs
+        return self._mins, self._maxs
+
+    def get(self, read, rows, ncols, max_points, start=0, stop=None):
+        """
+        Get the envelope of rows [start, stop).
+        Arguments:
+            read        (callable): as for reduce_bins.
+            rows        (int): number of rows in the dataset.
+            ncols       (int): number of columns.
+            max_points  (int): largest number of rows to return.
+            start       (int): first row.
+            stop        (int): row after the last one, or None for the end of the dataset.
+        Returns:
+            array: the rows themselves if there are at most max_points of them,
+                otherwise the minimum and maximum row of each bin, in order.
+        """
+        stop = rows if stop is None else min(stop, rows)
+        start = min(start, stop)
+        if stop - start <= max_points:
+            return read(start, stop)
+
+        nbins = max(max_points // 2, 1)
+        edges = np.linspace(start, stop, nbins + 1).round().astype(np.int64)
+        block = self.block_rows
+        if stop - start >= 2 * block * nbins:
+            mins, maxs = self._get_from_blocks(read, edges, ncols)
+        else:
+            mins, maxs = reduce_bins(read, np.unique(edges), ncols)
+
+        envelope = np.empty((2 * len(mins), ncols))
+        envelope[0::2] = mins
+        envelope[1::2] = maxs
+        return envelope
+
+    def _get_from_blocks(self, read, edges, ncols):
+        block = self.block_rows
+        start, stop = edges[0], edges[-1]
+        # move the inner edges to the nearest block boundary
+        inner = np.unique(np.round(edges[1:-1] / block).astype(np.int64) * block)
+        edges = np.concatenate(([start], inner, [stop]))
+
+        # the rows in [start, stop) as segments: a partial block at each end and
+        # whole blocks in between
+        first_block = -(-start // block)
+        last_block = stop // block
+        block_mins, block_maxs = self._blocks(read, last_block, ncols)
+        seg_starts = [np.arange(first_block, last_block) * block]
+        seg_mins = [block_mins[first_block:last_block]]
+        seg_maxs = [block_maxs[first_block:last_block]]
+        if start < first_block * block:
+            head = reduce_bins(read, [start, first_block * block], ncols)
+            seg_starts.insert(0, [start])
+            seg_mins.insert(0, head[0])
+            seg_maxs.insert(0, head[1])
+        if last_block * block < stop:
+            tail = reduce_bins(read, [last_block * block, stop], ncols)
+            seg_starts.append([last_block * block])
+            seg_mins.append(tail[0])
+            seg_maxs.append(tail[1])
+        seg_starts = np.concatenate(seg_starts)
+        seg_mins = np.concatenate(seg_mins)
+        seg_maxs = np.concatenate(seg_maxs)
+
+        # combine the segments of each bin
+        seg_bins = np.searchsorted(edges, seg_starts, "right") - 1
+        firsts = np.flatnonzero(np.diff(seg_bins, prepend=-1))
+        mins = np.fmin.reduceat(seg_mins, firsts, axis=0)
+        maxs = np.fmax.reduceat(seg_maxs, firsts, axis=0)
+        return mins, maxs
@@ -0,0 +1,178 @@
+"""
+Durability policies, which decide when rows added to a dataset are flushed to disk.
+
+A policy is written as one of:
+
+    none                rows are written when the append buffer fills up or the
+                        file is closed, but never flushed on purpose
+    interval(N)         flush at most N seconds after rows were added
+                        ('interval' alone means every 300 s)
+    every_k_rows(K)     flush once K rows have been added since the last flush
+                        ('every_k_rows' alone means every 1000 rows)
+    fsync               flush and fsync the file after every add, before the
+                        add returns
+
+Each server has a default policy, which datasets can override. Flushes for the
+interval and every_k_rows policies are run in the I/O pool by a FlushScheduler,
+which starts at most one every FLUSH_SPACING seconds, so that datasets whose
+flushes fall due together don't all flush in the same reactor tick.
+"""
+
+import re
+import threading
+import time
+from collections import deque, namedtuple
+
+from twisted.internet import reactor
+
+from . import errors
+
+# seconds between rows being added and flushed by 'interval'
+DEFAULT_INTERVAL = 300
+# rows added between flushes by 'every_k_rows'
+DEFAULT_ROWS = 1000
+# shortest time between the starts of two scheduled flushes
+FLUSH_SPACING = 0.05
+
+DurabilityPolicy = namedtuple("DurabilityPolicy", ["kind", "value"])
+DEFAULT_POLICY = DurabilityPolicy("interval", DEFAULT_INTERVAL)
+
+_defaults = {
+    "none": None,
+    "interval": DEFAULT_INTERVAL,
+    "every_k_rows": DEFAULT_ROWS,
+    "fsync": None,
+}
+_policy_re = re.compile(r"^\s*(\w+)\s*(?:\(\s*([0-9.]+)\s*\))?\s*$")
+
+
+def parse_policy(policy):
+    """
+    Parse a policy such as 'interval(60)'.
+    DurabilityPolicy objects are passed through unchanged.
+    """
+    if isinstance(policy, DurabilityPolicy):
+        return policy
+    match = _policy_re.match(policy)
+    if match is None or match.group(1) not in _defaults:
+        raise errors.BadDurabilityPolicyError(policy, sorted(_defaults))
+    kind, value = match.groups()
+    if _defaults[kind] is None:
+        if value is not None:
+            raise errors.BadDurabilityPolicyError(policy, sorted(_defaults))
+        return DurabilityPolicy(kind, None)
+    if value is None:
+        return DurabilityPolicy(kind, _defaults[kind])
+    try:
+        value = float(value) if kind == "interval" else int(value)
+    except ValueError:
+        raise errors.BadDurabilityPolicyError(policy, sorted(_defaults))
+    if value <= 0:
+        raise errors.BadDurabilityPolicyError(policy, sorted(_defaults))
+    return DurabilityPolicy(kind, value)
+
+
+def format_policy(policy):
+    """
+    Write a policy the way parse_policy reads it.
+    """
+    if policy.value is None:
+        return policy.kind
+    return "{}({:g})".format(policy.kind, policy.value)
+
+
+class FlushScheduler(object):
+    """
+    Flushes datasets according to their durability policies, and counts the
+    flushes, the bytes of rows they made durable, and how long they took.
+
+    rows_added is called on the reactor thread once rows have been added to a
+    dataset. Flushes that fall due are queued, and started in the I/O pool one
+    at a time, at least spacing seconds apart. Flushes for the fsync policy are
+    made by the I/O thread that adds the rows, by calling flush directly.
+    """
+
+    def __init__(self, io_pool, spacing=FLUSH_SPACING, reactor=reactor):
+        self.io_pool = io_pool
+        self.spacing = spacing
+        self.reactor = reactor
+        self.flushes = 0
+        self.bytes_written = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self._lock = threading.Lock()
+        # dataset -> delayed call of its interval flush
+        self._timers = {}
+        self._queue = deque()
+        self._next_call = None
+        self._last_start = None
+
+    def rows_added(self, dataset, policy):
+        """
+        Schedule a flush of a dataset that rows were just added to, if its policy needs one.
+        """
+        if policy.kind == "interval":
+            if dataset not in self._timers:
+                self._timers[dataset] = self.reactor.callLater(
+                    policy.value, self._due, dataset
+                )
+        elif policy.kind == "every_k_rows":
+            if dataset.unflushed_rows >= policy.value:
+                self._due(dataset)
+
+    def flush(self, dataset, sync=False):
+        """
+        Flush a dataset now, and record the flush. Blocks; used from I/O threads.
+        """
+        start = time.perf_counter()
+        nbytes = dataset.flush(sync)
+        latency = time.perf_counter() - start
+        with self._lock:
+            self.flushes += 1
+            self.bytes_written += nbytes
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+
+    def mean_latency(self):
+        with self._lock:
+            return self.total_latency / self.flushes if self.flushes else 0.0
+
+    def stop(self):
+        """
+        Cancel all scheduled flushes, e.g. because the datasets are being closed.
+        """
+        for call in self._timers.values():
+            if call.active():
+                call.cancel()
+        self._timers.clear()
+        self._queue.clear()
+        if (self._next_call is not None) and self._next_call.active():
+            self._next_call.cancel()
+        self._next_call = None
+
+    def _due(self, dataset):
+        call = self._timers.pop(dataset, None)
+        if (call is not None) and call.active():
+            call.cancel()
+        if dataset not in self._queue:
+            self._queue.append(dataset)
+        if self._next_call is None:
+            now = self.reactor.seconds()
+            if self._last_start is None:
+                delay = 0
+            else:
+                delay = max(0, self._last_start + self.spacing - now)
+            self._next_call = self.reactor.callLater(delay, self._start_next)
+
+    def _start_next(self):
+        self._next_call = None
+        if not self._queue:
+            return
+        dataset = self._queue.popleft()
+        self._last_start = self.reactor.seconds()
+        d = dataset.io_lock.run(
+            self.io_pool.run, dataset.call_with_file, self.flush, dataset
+        )
+        d.addErrback(lambda failure: print(failure.getErrorMessage()))
+        if self._queue:
+            self._next_call = self.reactor.callLater(self.spacing, self._start_next)
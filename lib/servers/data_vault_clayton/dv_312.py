@@ -39,6 +39,8 @@ import labrad.util
 import labrad.wrappers
 
 from data_vault_clayton import SessionStore
+from data_vault_clayton.backend import DEFAULT_STORAGE_PROFILE
+from data_vault_clayton.durability import DEFAULT_POLICY, format_policy
 from data_vault_clayton.server import DataVault
 
 # todo: add support for comments
@@ -60,7 +62,7 @@ def load_settings(cxn, name):
     path = ["", "Servers", name, "Repository"]
     reg = cxn.registry
     yield reg.cd(path, True)
-    (dirs, keys) = yield reg.dir()
+    dirs, keys = yield reg.dir()
 
     # look for node-specific directory
     if nodename in keys:
@@ -97,6 +99,42 @@ def load_settings(cxn, name):
     returnValue(datadir)
 
 
+@inlineCallbacks
+def load_storage_profile(cxn, name):
+    """
+    Load the default storage profile for new datasets from the registry.
+
+    The profile is read from the "Storage Profile" key in the server's registry
+    directory. If the key does not exist, the backend default is used.
+    """
+    reg = cxn.registry
+    yield reg.cd(["", "Servers", name], True)
+    dirs, keys = yield reg.dir()
+    if "Storage Profile" in keys:
+        profile = yield reg.get("Storage Profile")
+    else:
+        profile = DEFAULT_STORAGE_PROFILE
+    returnValue(profile)
+
+
+@inlineCallbacks
+def load_durability_policy(cxn, name):
+    """
+    Load the default durability policy of datasets from the registry.
+
+    The policy, e.g. "interval(300)", is read from the "Durability" key in the
+    server's registry directory. If the key does not exist, the default is used.
+    """
+    reg = cxn.registry
+    yield reg.cd(["", "Servers", name], True)
+    dirs, keys = yield reg.dir()
+    if "Durability" in keys:
+        policy = yield reg.get("Durability")
+    else:
+        policy = format_policy(DEFAULT_POLICY)
+    returnValue(policy)
+
+
 def main(argv=sys.argv):
     from twisted.internet import reactor
 
@@ -108,12 +146,18 @@ def main(argv=sys.argv):
             host=opts["host"], port=int(opts["port"]), password=opts["password"]
         )
         datadir = yield load_settings(cxn, opts["name"])
+        storage_profile = yield load_storage_profile(cxn, opts["name"])
+        durability_policy = yield load_durability_policy(cxn, opts["name"])
         yield cxn.disconnect()
 
         # create SessionStore
         # if use_virtual_session is set to True, any number of datadirs can be specified in a list
         session_store = SessionStore(datadir, hub=None, use_virtual_session=False)
-        server = DataVault(session_store)
+        server = DataVault(
+            session_store,
+            storage_profile=storage_profile,
+            durability_policy=durability_policy,
+        )
         session_store.hub = server
 
         # Run the server. We do not need to start the reactor, but we will
@@ -79,3 +79,49 @@ class VirtualSessionError(T.Error):
 
     def __init__(self, command):
         self.msg = "Invalid command: {}.".format(command)
+
+
+class BadStorageProfileError(T.Error):
+    code = 13
+
+    def __init__(self, name, choices):
+        self.msg = "Unknown storage profile '{0}'. Choose from: {1}.".format(
+            name, ", ".join(choices)
+        )
+
+
+class MigrationInProgressError(T.Error):
+    """A CSV migration is already running."""
+
+    code = 14
+
+
+class BadColumnError(T.Error):
+    code = 15
+
+    def __init__(self, column, ncols):
+        self.msg = "Column {} does not exist. The dataset has {} columns.".format(
+            column, ncols
+        )
+
+
+class BadQueryError(T.Error):
+    code = 16
+
+    def __init__(self, term, reason):
+        self.msg = "Bad search term '{}': {}.".format(term, reason)
+
+
+class FinalizedError(T.Error):
+    """Rows can't be added to a finalized dataset."""
+
+    code = 17
+
+
+class BadDurabilityPolicyError(T.Error):
+    code = 18
+
+    def __init__(self, policy, kinds):
+        self.msg = "Bad durability policy '{0}'. Use one of: {1}.".format(
+            policy, ", ".join(kinds)
+        )
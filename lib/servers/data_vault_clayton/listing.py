@@ -0,0 +1,223 @@
+"""
+Persistent index of the contents of a session directory.
+
+Listing a session means classifying every entry in its directory, and telling
+single-dataset HDF5 files apart from multi-dataset files (which are shown as
+directories) requires opening each file. The index remembers each entry's
+classification, along with the mtime and size of HDF5 files, in a JSON file
+next to session.ini so that only files that changed since the last listing
+have to be opened again.
+"""
+
+import json
+import os
+import time
+
+import h5py
+
+LISTING_FILENAME = "listing.json"
+LISTING_VERSION = 1
+
+# entry kinds
+DIR = "dir"
+DATASET = "dataset"
+MULTIPLE = "multiple"  # hdf5 file with several datasets, listed as a directory
+IGNORED = None
+
+# directory mtimes this close to the time of the listing are not trusted, since
+# coarse filesystem timestamps may hide entries added in the same interval
+MTIME_SLACK_SEC = 2.0
+
+_HDF5_SUFFIXES = (".hdf5", ".h5")
+_DATASET_SUFFIXES = (".ini",) + _HDF5_SUFFIXES
+_SKIPPED = ("session.ini", LISTING_FILENAME)
+
+
+def check_if_multiple_datasets(filename):
+    """
+    Check if hdf5 or h5 file has multiple datasets.
+    Arguments:
+        filename    (str): the name of the file to check
+    Returns:
+                    (bool): whether the file has multiple datasets.
+    """
+    # open file
+    num_datasets = 0
+    with h5py.File(filename, "r") as file_tmp:
+        # todo: more general way of checking; check # of datasets of all groups
+        try:
+            num_datasets = len(file_tmp["datasets"])
+        except:
+            return False
+
+    # get number of datasets
+    if num_datasets > 1:
+        return True
+    else:
+        return False
+
+
+def _is_hdf5(filename):
+    return filename.endswith(_HDF5_SUFFIXES)
+
+
+class ListingIndex:
+    """
+    Cached classification of the entries in one session directory.
+
+    The cached list of names is trusted as long as the directory mtime is
+    unchanged. HDF5 files are additionally checked against their own mtime
+    and size, and are only opened when either has changed.
+    """
+
+    def __init__(self, directory):
+        self.dir = directory
+        self.filename = os.path.join(directory, LISTING_FILENAME)
+        self._dir_mtime = None
+        self._listed_at = 0.0
+        # filename -> [kind, mtime, size]; mtime and size are only kept for hdf5 files
+        self._entries = {}
+        self._dirty = False
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.filename) as f:
+                state = json.load(f)
+            if state.get("version") != LISTING_VERSION:
+                return
+            self._dir_mtime = state["dir_mtime"]
+            self._listed_at = state["listed_at"]
+            self._entries = state["entries"]
+        except (OSError, ValueError, KeyError, TypeError):
+            # missing or unreadable index; it is rebuilt on the next listing
+            self._dir_mtime = None
+            self._entries = {}
+
+    def save(self):
+        """
+        Write the index to disk if it has changed.
+        """
+        if not self._dirty:
+            return
+        state = {
+            "version": LISTING_VERSION,
+            "dir_mtime": self._dir_mtime,
+            "listed_at": self._listed_at,
+            "entries": self._entries,
+        }
+        # written in place rather than renamed over, which would change the
+        # directory mtime and invalidate the listing it describes
+        try:
+            with open(self.filename, "w") as f:
+                json.dump(state, f)
+        except OSError:
+            # the index is only a cache; a read-only directory still lists fine
+            return
+        self._dirty = False
+
+    def _classify(self, filename):
+        """
+        Get the entry for a file, opening hdf5 files to count their datasets.
+        """
+        path = os.path.join(self.dir, filename)
+        if filename in _SKIPPED:
+            return [IGNORED, None, None]
+        if os.path.isdir(path):
+            return [DIR, None, None]
+        if _is_hdf5(filename):
+            stat = os.stat(path)
+            kind = MULTIPLE if check_if_multiple_datasets(path) else DATASET
+            return [kind, stat.st_mtime, stat.st_size]
+        if filename.endswith(_DATASET_SUFFIXES):
+            return [DATASET, None, None]
+        return [IGNORED, None, None]
+
+    def _revalidate(self):
+        """
+        Bring the entries up to date with the directory.
+        """
+        dir_mtime = os.stat(self.dir).st_mtime
+        trusted = (
+            dir_mtime == self._dir_mtime
+            and dir_mtime < self._listed_at - MTIME_SLACK_SEC
+        )
+        if not trusted:
+            listed_at = time.time()
+            names = set(os.listdir(self.dir))
+            for filename in list(self._entries):
+                if filename not in names:
+                    del self._entries[filename]
+                    self._dirty = True
+            for filename in names - set(self._entries):
+                self._entries[filename] = self._classify(filename)
+                self._dirty = True
+            if (dir_mtime, listed_at) != (self._dir_mtime, self._listed_at):
+                self._dir_mtime, self._listed_at = dir_mtime, listed_at
+                self._dirty = True
+
+        # hdf5 files can gain datasets without the directory changing
+        for filename, (kind, mtime, size) in list(self._entries.items()):
+            if kind not in (DATASET, MULTIPLE) or not _is_hdf5(filename):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.dir, filename))
+            except OSError:
+                del self._entries[filename]
+                self._dirty = True
+                continue
+            if (stat.st_mtime, stat.st_size) != (mtime, size):
+                self._entries[filename] = self._classify(filename)
+                self._dirty = True
+
+    def contents(self):
+        """
+        Get the entries of the directory.
+        Returns:
+            list(str), list(str): unsorted file names of the entries listed as
+                directories and as datasets, respectively.
+        """
+        self._revalidate()
+        self.save()
+        dirs, datasets = [], []
+        for filename, (kind, _, _) in self._entries.items():
+            if kind in (DIR, MULTIPLE):
+                dirs.append(filename)
+            elif kind == DATASET:
+                datasets.append(filename)
+        return dirs, datasets
+
+    def replaced(self, filename):
+        """
+        Record that an HDF5 file was rewritten in place, keeping its kind.
+
+        Does nothing if the file is not in the index.
+        Arguments:
+            filename    (str): the name of the rewritten file.
+        """
+        entry = self._entries.get(filename)
+        if entry is None or not _is_hdf5(filename):
+            return
+        self.add(filename, entry[0])
+
+    def add(self, filename, kind=None):
+        """
+        Record a new entry created by this server.
+
+        The stored directory mtime is left alone, so the next listing still
+        picks up anything else that was added to the directory, but without
+        opening the new entry again. The index is only written by the next
+        listing or call to save.
+        Arguments:
+            filename    (str): the name of the new file or directory.
+            kind        (str): the kind of entry, or None to classify it.
+        """
+        if kind is None:
+            entry = self._classify(filename)
+        elif kind != DIR and _is_hdf5(filename):
+            stat = os.stat(os.path.join(self.dir, filename))
+            entry = [kind, stat.st_mtime, stat.st_size]
+        else:
+            entry = [kind, None, None]
+        self._entries[filename] = entry
+        self._dirty = True
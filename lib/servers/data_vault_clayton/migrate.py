@@ -0,0 +1,237 @@
+"""
+Converts legacy CSV datasets to the extended HDF5 format.
+
+Each .csv/.ini pair is converted into an .hdf5 file with the same name, so the
+dataset keeps its number and title. Parameters, comments and timestamps are
+copied over. The conversion is written to a temporary file, read back and
+compared against the CSV data, and only then renamed into place, so open_backend
+never sees a partial file. The original CSV and INI files are left alone.
+
+Migrated files record the size and modification time of their CSV file, and
+open_backend only prefers the HDF5 file while these still match. Running the
+migration again skips datasets that are already migrated, so an interrupted
+migration can simply be restarted.
+
+Usage:
+    python -m data_vault_clayton.migrate ROOT [--workers N] [--profile NAME]
+"""
+
+import argparse
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import h5py
+import numpy as np
+from numpy.lib import recfunctions
+
+from . import backend
+
+# conversions running at once; kept low since data directories are often on network shares
+DEFAULT_WORKERS = 2
+
+_MIGRATING_SUFFIX = ".migrating"
+
+
+class MigrationError(Exception):
+    pass
+
+
+def find_csv_datasets(root):
+    """
+    Find CSV datasets below a directory that have not been migrated yet.
+    Arguments:
+        root    (str): the directory to search.
+    Returns:
+        list(str): paths of the .csv files, in directory order.
+    """
+    csv_files = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if not filename.endswith(".csv"):
+                continue
+            csv_file = os.path.join(dirpath, filename)
+            base = csv_file[:-4]
+            if not os.path.exists(base + ".ini"):
+                continue
+            if backend.migrated_from_csv(base + ".hdf5", csv_file):
+                continue
+            csv_files.append(csv_file)
+    return csv_files
+
+
+def _read_csv(csv_file, cols):
+    if os.path.getsize(csv_file) == 0:
+        return np.empty((0, cols))
+    return np.loadtxt(csv_file, delimiter=",", ndmin=2)
+
+
+def _verify(filename, rows, meta):
+    """
+    Check that a converted file holds the same data and metadata as its source.
+    """
+    with h5py.File(filename, "r") as f:
+        dataset = f["DataVault"]
+        length = dataset.attrs.get("Length", dataset.shape[0])
+        if length != len(rows) or dataset.shape[0] != len(rows):
+            raise MigrationError(
+                "{}: expected {} rows, found {}".format(filename, len(rows), length)
+            )
+        if len(rows):
+            data = recfunctions.structured_to_unstructured(dataset[:length])
+            if not np.array_equal(data, rows, equal_nan=True):
+                raise MigrationError("{}: data does not match".format(filename))
+        params = dataset.attrs.get(backend.PARAMETERS_ATTR, [])
+        if len(params) != len(meta.parameters):
+            raise MigrationError("{}: parameters do not match".format(filename))
+        if len(dataset.attrs["Comments"]) != len(meta.comments):
+            raise MigrationError("{}: comments do not match".format(filename))
+
+
+def migrate_dataset(csv_file, profile=None):
+    """
+    Convert one CSV dataset to an extended HDF5 file next to it.
+    Arguments:
+        csv_file    (str): path of the .csv file.
+        profile     (str): storage profile of the new file.
+    Returns:
+        str: path of the .hdf5 file.
+    """
+    base = csv_file[:-4]
+    hdf5_file = base + ".hdf5"
+    if backend.migrated_from_csv(hdf5_file, csv_file):
+        return hdf5_file
+    if os.path.exists(hdf5_file):
+        with h5py.File(hdf5_file, "r") as f:
+            if backend.CSV_SOURCE_SIZE not in f.attrs:
+                raise MigrationError(
+                    "{} exists and was not migrated from CSV".format(hdf5_file)
+                )
+
+    stat = os.stat(csv_file)
+    meta = backend.IniData()
+    meta.infofile = base + ".ini"
+    meta.load()
+    rows = _read_csv(csv_file, meta.cols)
+
+    tmp_file = hdf5_file + _MIGRATING_SUFFIX
+    fh = backend.SelfClosingFile(h5py.File, open_args=(tmp_file, "w"))
+    try:
+        data = backend.ExtendedHDF5Data(fh)
+        data.initialize_info(meta.title, meta.independents, meta.dependents, profile)
+        attrs = data.dataset.attrs
+        attrs["Creation Time"] = meta.created.timestamp()
+        attrs["Access Time"] = meta.accessed.timestamp()
+        attrs["Modification Time"] = meta.modified.timestamp()
+        data.add_params([(p["label"], p["data"]) for p in meta.parameters])
+        comments = np.array(
+            [(t.timestamp(), user, comment) for t, user, comment in meta.comments],
+            dtype=data.comment_type,
+        )
+        attrs.create("Comments", comments, dtype=data.comment_type)
+        if len(rows):
+            data.add_data(np.core.records.fromarrays(rows.T, dtype=data.dtype))
+        fh().attrs[backend.CSV_SOURCE_SIZE] = stat.st_size
+        fh().attrs[backend.CSV_SOURCE_MTIME] = stat.st_mtime
+    finally:
+        # writes out the append buffer and the parameters
+        fh.close()
+
+    try:
+        _verify(tmp_file, rows, meta)
+        os.replace(tmp_file, hdf5_file)
+    finally:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+    return hdf5_file
+
+
+class Migration(object):
+    """
+    Converts a list of CSV datasets in a pool of worker processes.
+
+    Progress is available from total, done and failed while run is in progress,
+    so the migration can be run in a thread and polled. If a root directory is
+    given, the datasets below it are found when the migration runs.
+    """
+
+    def __init__(self, csv_files=(), workers=DEFAULT_WORKERS, profile=None, root=None):
+        self.csv_files = list(csv_files)
+        self.workers = workers
+        self.profile = profile
+        self.root = root
+        self.done = 0
+        # (csv file, error message)
+        self.failed = []
+        self.running = False
+
+    @property
+    def total(self):
+        return len(self.csv_files)
+
+    def run(self, report=None):
+        """
+        Convert all datasets, calling report(csv_file, error) after each one.
+        """
+        self.running = True
+        try:
+            if self.root is not None:
+                self.csv_files.extend(find_csv_datasets(self.root))
+                self.root = None
+            with ProcessPoolExecutor(max_workers=self.workers) as pool:
+                futures = {
+                    pool.submit(migrate_dataset, csv_file, self.profile): csv_file
+                    for csv_file in self.csv_files
+                }
+                for future in as_completed(futures):
+                    csv_file = futures[future]
+                    try:
+                        future.result()
+                    except Exception as e:
+                        error = str(e) or type(e).__name__
+                        self.failed.append((csv_file, error))
+                    else:
+                        error = None
+                        self.done += 1
+                    if report is not None:
+                        report(csv_file, error)
+        finally:
+            self.running = False
+        return self
+
+
+def main(argv=sys.argv[1:]):
+    parser = argparse.ArgumentParser(
+        description="Convert CSV datasets below a directory to HDF5."
+    )
+    parser.add_argument("root", help="data vault directory to search")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=DEFAULT_WORKERS,
+        help="number of datasets converted at once (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--profile",
+        default=None,
+        choices=sorted(backend.STORAGE_PROFILES),
+        help="storage profile of the new files",
+    )
+    args = parser.parse_args(argv)
+
+    migration = Migration(find_csv_datasets(args.root), args.workers, args.profile)
+    print("{} datasets to migrate".format(migration.total))
+
+    def report(csv_file, error):
+        count = migration.done + len(migration.failed)
+        status = "ok" if error is None else "FAILED: " + error
+        print("[{}/{}] {}: {}".format(count, migration.total, csv_file, status))
+
+    migration.run(report)
+    print("{} migrated, {} failed".format(migration.done, len(migration.failed)))
+    return 1 if migration.failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,132 @@
+"""
+Range queries on one column of a dataset.
+
+A column is indexed in blocks of INDEX_BLOCK_ROWS rows. For every completely
+written block the index holds the minimum and maximum of the column and whether
+the block is sorted. Datasets are only appended to, so these never change once
+the block is full.
+
+If the whole column is nondecreasing, as time and scan axes usually are, the
+blocks holding the first and last matching rows are found by binary search and
+everything between them is read in one go. Otherwise only the blocks whose
+minimum and maximum overlap the range are read. Rows after the last complete
+block are always read and filtered.
+"""
+
+import numpy as np
+
+INDEX_BLOCK_ROWS = 4096
+READ_BLOCKS = 16  # blocks read at once while building an index
+
+index_dtype = np.dtype([("min", np.float64), ("max", np.float64), ("sorted", bool)])
+
+
+def index_blocks(values):
+    """
+    Get the index entries of whole blocks of column values.
+    Arguments:
+        values  (array): 2-D array with one block of the column per row.
+    Returns:
+        array: one index_dtype entry per block.
+    """
+    blocks = np.empty(len(values), dtype=index_dtype)
+    blocks["min"] = np.fmin.reduce(values, axis=1)
+    blocks["max"] = np.fmax.reduce(values, axis=1)
+    # NaNs compare false, so blocks with NaNs are never sorted
+    blocks["sorted"] = np.all(np.diff(values, axis=1) >= 0, axis=1)
+    return blocks
+
+
+class ColumnIndex(object):
+    """
+    Block index of one column of a dataset.
+    """
+
+    def __init__(self, column, blocks=None, block_rows=INDEX_BLOCK_ROWS):
+        self.column = column
+        self.block_rows = block_rows
+        if blocks is None:
+            blocks = np.empty(0, dtype=index_dtype)
+        self.blocks = blocks
+
+    @property
+    def rows(self):
+        """
+        Number of rows covered by the index.
+        """
+        return len(self.blocks) * self.block_rows
+
+    def is_monotonic(self):
+        blocks = self.blocks
+        return bool(
+            np.all(blocks["sorted"]) and np.all(blocks["max"][:-1] <= blocks["min"][1:])
+        )
+
+    def update(self, read, rows):
+        """
+        Index the blocks completed since the last update.
+        Arguments:
+            read    (callable): read(start, stop) returns rows [start, stop) as a 2-D float array.
+            rows    (int): number of rows in the dataset.
+        Returns:
+            bool: whether any blocks were added.
+        """
+        start = len(self.blocks)
+        stop = rows // self.block_rows
+        if stop <= start:
+            return False
+        new_blocks = []
+        for first in range(start, stop, READ_BLOCKS):
+            last = min(first + READ_BLOCKS, stop)
+            values = read(first * self.block_rows, last * self.block_rows)
+            values = values[:, self.column].reshape(last - first, self.block_rows)
+            new_blocks.append(index_blocks(values))
+        self.blocks = np.concatenate([self.blocks] + new_blocks)
+        return True
+
+    def spans(self, lo, hi, rows):
+        """
+        Get the row spans that can hold values in [lo, hi].
+        Arguments:
+            lo, hi  (float): the range of values.
+            rows    (int): number of rows in the dataset.
+        Returns:
+            list((int, int)): (start, stop) of each span, in order.
+        """
+        blocks = self.blocks
+        if self.is_monotonic():
+            first = np.searchsorted(blocks["max"], lo, "left")
+            last = np.searchsorted(blocks["min"], hi, "right")
+            spans = [(first, last)] if first < last else []
+        else:
+            match = (blocks["max"] >= lo) & (blocks["min"] <= hi)
+            # runs of consecutive matching blocks
+            edges = np.flatnonzero(np.diff(np.concatenate(([0], match, [0]))))
+            spans = list(zip(edges[0::2], edges[1::2]))
+        spans = [(a * self.block_rows, b * self.block_rows) for a, b in spans]
+        # rows that are not indexed yet
+        if self.rows < rows:
+            if spans and spans[-1][1] == self.rows:
+                spans[-1] = (spans[-1][0], rows)
+            else:
+                spans.append((self.rows, rows))
+        return spans
+
+    def get_range(self, read, rows, lo, hi):
+        """
+        Get the rows whose value in the column is in [lo, hi], in order.
+        Arguments:
+            read    (callable): as for update.
+            rows    (int): number of rows in the dataset.
+            lo, hi  (float): the range of values.
+        Returns:
+            array: the matching rows as a 2-D float array.
+        """
+        parts = []
+        for start, stop in self.spans(lo, hi, rows):
+            data = read(start, stop)
+            values = data[:, self.column]
+            parts.append(data[(values >= lo) & (values <= hi)])
+        if not parts:
+            return read(0, 0)
+        return np.concatenate(parts)
@@ -1,5 +1,6 @@
 from __future__ import absolute_import
 
+from twisted.internet import threads
 from twisted.internet.task import LoopingCall
 from twisted.internet.defer import inlineCallbacks
 from labrad.server import LabradServer, Signal, setting
@@ -10,7 +11,7 @@ except ImportError:
     win32api = False
     print("Win32 API missing. If you're running on windows, this is a problem")
 import numpy as np
-from . import errors
+from . import backend, catalog, durability, errors, migrate, util
 from os import remove
 
 # todo: implement ability to delete things
@@ -28,9 +29,25 @@ class DataVault(LabradServer):
 
     # SETUP
 
-    def __init__(self, session_store):
+    def __init__(
+        self,
+        session_store,
+        storage_profile=backend.DEFAULT_STORAGE_PROFILE,
+        durability_policy=durability.DEFAULT_POLICY,
+    ):
         LabradServer.__init__(self)
         self.session_store = session_store
+        # server-wide storage profile for new datasets
+        backend.get_storage_profile(storage_profile)
+        self.storage_profile = storage_profile
+        # server-wide durability policy, for datasets that don't set their own
+        self.durability = durability.parse_policy(durability_policy)
+        # whether new datasets are written in SWMR mode
+        self.swmr = False
+        # background CSV to HDF5 migration, if one has been started
+        self._migration = None
+        # whether this server has registered with the session store
+        self._store_open = False
 
         # session signals
         self.onNewDir = Signal(543617, "signal: new dir", "s")
@@ -38,45 +55,55 @@ class DataVault(LabradServer):
         self.onTagsUpdated = Signal(543622, "signal: tags updated", "*(s*s)*(s*s)")
         # dataset signals
         self.onDataAvailable = Signal(543619, "signal: data available", "")
+        # sent along with data available, carrying the number of rows in the dataset
+        self.onNewRows = Signal(543623, "signal: new rows", "w")
         self.onNewParameter = Signal(543620, "signal: new parameter", "")
         self.onCommentsAvailable = Signal(543621, "signal: comments available", "")
 
     def initServer(self):
+        # the session store may be shared with other server instances
+        self.session_store.open()
+        self._store_open = True
         # create root session
         _root = self.session_store.get([""])
         # close all datasets on program shutdown
         if win32api:
             win32api.SetConsoleCtrlHandler(self._close_all_datasets, True)
-        # create LoopingCall to save routinely save datasets in background
-        # todo: make save interval customizable
+        # routinely save metadata and update the catalog in the background;
+        # dataset rows are flushed according to the durability policies
         self.saveDatasetTimer = LoopingCall(self._save_all_datasets)
         self.saveDatasetTimer.start(300)
-
-    def _save_all_datasets(self):
-        """
-        Save all datasets routinely.
-        Prevents data from being corrupted due to unforeseen/uninterruptible events.
+        # bring the dataset catalog up to date in the background; the session
+        # store is shared by all server instances, so only one crawls at a time
+        dataset_catalog = self.session_store.catalog
+        if not dataset_catalog.crawling:
+            dataset_catalog.crawling = True
+            d = threads.deferToThread(
+                dataset_catalog.crawl, self.session_store.datadirs
+            )
+            d.addErrback(lambda failure: print(failure.getErrorMessage()))
+
+    def _save_all_datasets(self, flush_data=False):
+        """
+        Save metadata and the shapes of open datasets routinely.
+        With flush_data, also flush all open datasets now, whatever their
+        durability policy.
         """
-        # get all datasets across all sessions
         all_sessions = list(self.session_store.get_all())
-        all_datasets = [session.datasets.values() for session in all_sessions]
-        # flatten list of datasets
-        all_containers = set(
-            [
-                dataset.data
-                for session_datasets in all_datasets
-                for dataset in session_datasets
-            ]
-        )
+        self._flush_metadata()
+        self._update_catalog(all_sessions)
+        if not flush_data:
+            return
 
-        # flush (i.e. save) all file data
-        for container in all_containers:
+        # get all datasets across all sessions
+        all_datasets = set(
+            dataset
+            for session in all_sessions
+            for dataset in list(session.datasets.values())
+        )
+        for dataset in all_datasets:
             try:
-                # container is Data object (e.g. SimpleHDF5Data)
-                # container._file is SelfClosingFile
-                # container._file._file is actual data file object
-                if hasattr(container._file, "_file"):
-                    container._file._file.flush()
+                self.session_store.flusher.flush(dataset)
             except Exception as e:
                 print(e)
 
@@ -97,18 +124,110 @@ class DataVault(LabradServer):
             ]
         )
 
-        # close all the files
+        # write pending metadata while the files are still open
+        self._flush_metadata()
+        self._update_catalog(all_sessions)
+
+        # close all the files; this waits for I/O threads still using them
         for container in all_containers:
-            datafile = container._file
-            # cancel the timeout poll loop if it exists
-            if hasattr(datafile, "_fileTimeoutCall"):
-                datafile._fileTimeoutCall.cancel()
-            # close the file
             try:
-                datafile._file_timeout()
+                # write out buffered rows, even if the file has already timed out
+                if hasattr(container, "flush_buffer"):
+                    container.flush_buffer()
+                # close the file and remove it from the file pool
+                container._file.close()
             except Exception as e:
                 print(e)
 
+    def _flush_metadata(self):
+        """
+        Write out session.ini files and dataset metadata with pending changes.
+        """
+        try:
+            self.session_store.metadata_writer.flush()
+        except Exception as e:
+            print(e)
+
+    def _update_catalog(self, sessions):
+        """
+        Record the current number of rows and columns of open datasets in the catalog.
+        """
+        shapes = []
+        for session in sessions:
+            for dataset in list(session.datasets.values()):
+                try:
+                    rows = len(dataset.data)
+                    cols = len(dataset.get_independents()) + len(
+                        dataset.get_dependents()
+                    )
+                    shapes.append((session.path, dataset.name, rows, cols))
+                except Exception as e:
+                    print(e)
+        try:
+            self.session_store.catalog.set_shapes(shapes)
+        except Exception as e:
+            print(e)
+
+    def stopServer(self):
+        if not self._store_open:
+            return
+        self._store_open = False
+        # other server instances sharing the session store keep using its
+        # datasets, I/O threads and catalog
+        if self.session_store.owners <= 1:
+            self.session_store.flusher.stop()
+            self._close_all_datasets(None)
+        self.session_store.close()
+
+    def _run_io(self, dataset, f, done):
+        """
+        Run a blocking backend call in the I/O pool.
+        Calls for the same dataset run one at a time in the order they were made,
+        and done(result) runs on the reactor thread before the next one starts,
+        so that notifications go out in the same order as the file I/O.
+        Returns:
+            Deferred: fires with the result of done.
+        """
+
+        def run():
+            d = self.session_store.io_pool.run(dataset.call_with_file, f)
+            d.addCallback(done)
+            return d
+
+        return dataset.io_lock.run(run)
+
+    def _add_data(self, dataset, rec_data):
+        policy = dataset.durability or self.durability
+        flusher = self.session_store.flusher
+
+        def add():
+            dataset.write_rows(rec_data)
+            if policy.kind == "fsync":
+                flusher.flush(dataset, sync=True)
+
+        def done(_):
+            dataset.notify_data_available()
+            flusher.rows_added(dataset, policy)
+
+        return self._run_io(dataset, add, done)
+
+    def _get_data(self, c, limit, start_over, **kw):
+        dataset = self.get_dataset(c)
+        key = self.context_key(c)
+        start = 0 if start_over else c["filepos"]
+
+        def read():
+            data, pos = dataset.get_data(limit, start, **kw)
+            dataset.count_rows()
+            return data, pos, dataset.data.has_more(pos)
+
+        def done(result):
+            data, c["filepos"], has_more = result
+            dataset.keep_streaming(key, c["filepos"], has_more)
+            return data
+
+        return self._run_io(dataset, read, done)
+
     # CONTEXT MANAGEMENT
 
     def context_key(self, c):
@@ -138,6 +257,7 @@ class DataVault(LabradServer):
             removeFromList(session.listeners)
             for dataset in session.datasets.values():
                 removeFromList(dataset.listeners)
+                dataset.data_notifier.discard(key)
                 removeFromList(dataset.param_listeners)
                 removeFromList(dataset.comment_listeners)
 
@@ -278,9 +398,10 @@ class DataVault(LabradServer):
         name="s",
         independents=["*s", "*(ss)"],
         dependents=["*s", "*(sss)"],
+        profile="s",
         returns="(*s{path}, s{name})",
     )
-    def new(self, c, name, independents, dependents):
+    def new(self, c, name, independents, dependents, profile=None):
         """
         Create a new Dataset.
 
@@ -291,14 +412,24 @@ class DataVault(LabradServer):
         or 'label (legend) [units]'.  Label is meant to be an
         axis label that can be shared among traces, while legend is
         a legend entry that should be unique for each trace.
+        The optional profile selects the storage profile of the new file
+        (see 'storage profiles'); the server default is used otherwise.
         Returns the path and name for this dataset.
         """
         # ensure valid filename
         if "." in name:
             raise Exception("Error: invalid title (contains periods).")
+        profile = profile or self.storage_profile
+        backend.get_storage_profile(profile)
 
         session = self.get_session(c)
-        dataset = session.new_dataset(name or "untitled", independents, dependents)
+        dataset = session.new_dataset(
+            name or "untitled",
+            independents,
+            dependents,
+            profile=profile,
+            swmr=self.swmr,
+        )
         c["dataset"] = dataset.name  # not the same as name; has number prefixed
         c["datasetObj"] = dataset
         c["filepos"] = 0  # start at the beginning
@@ -307,9 +438,14 @@ class DataVault(LabradServer):
         return c["path"], c["dataset"]
 
     @setting(
-        1009, name="s", independents="*(s*iss)", dependents="*(ss*iss)", returns=["*ss"]
+        1009,
+        name="s",
+        independents="*(s*iss)",
+        dependents="*(ss*iss)",
+        profile="s",
+        returns=["*ss"],
     )
-    def new_ex(self, c, name, independents, dependents):
+    def new_ex(self, c, name, independents, dependents, profile=None):
         """
         Create a new extended dataset.
 
@@ -336,13 +472,25 @@ class DataVault(LabradServer):
         code.  The name and parameters will be there, but no actual data.
 
         The legacy format requires each column be a scalar v[unit] type.
+
+        The optional profile selects the storage profile of the new file,
+        as in new().
         """
         # ensure valid filename
         if "." in name:
             raise Exception("Error: invalid title (contains periods).")
+        profile = profile or self.storage_profile
+        backend.get_storage_profile(profile)
 
         session = self.get_session(c)
-        dataset = session.new_dataset(name, independents, dependents, extended=True)
+        dataset = session.new_dataset(
+            name,
+            independents,
+            dependents,
+            extended=True,
+            profile=profile,
+            swmr=self.swmr,
+        )
         c["dataset"] = dataset.name  # not the same as name; has number prefixed
         c["datasetObj"] = dataset
         c["filepos"] = 0  # start at the beginning
@@ -387,30 +535,221 @@ class DataVault(LabradServer):
         dataset = session.open_dataset(name)
 
         # todo tmp remove
-        # get all datasets across all sessions
-        all_sessions = list(self.session_store.get_all())
-        all_datasets = [session.datasets.values() for session in all_sessions]
-        # flatten list of datasets
-        all_containers = set(
-            [
-                dataset.data
-                for session_datasets in all_datasets
-                for dataset in session_datasets
-            ]
-        )
-
         # flush (i.e. save) all file data
-        for container in all_containers:
-            try:
-                # container is Data object (e.g. SimpleHDF5Data)
-                # container._file is SelfClosingFile
-                # container._file._file is actual data file object
-                if hasattr(container._file, "_file"):
-                    container._file._file.flush()
-            except Exception as e:
-                print(e)
+        self._save_all_datasets(flush_data=True)
         return False
 
+    @setting(1030, "storage profile", name="s", returns="s")
+    def storage_profile_setting(self, c, name=None):
+        """
+        Get or set the default storage profile used for new datasets.
+
+        The profile sets the chunk size, compression filter and chunk cache
+        size of new HDF5 files. Returns the current default profile.
+        """
+        if name is not None:
+            backend.get_storage_profile(name)
+            self.storage_profile = name
+        return self.storage_profile
+
+    @setting(1031, "storage profiles", returns="*(swswb)")
+    def storage_profiles(self, c):
+        """
+        List the available storage profiles.
+
+        Returns a list of (name, chunk rows, compression, compression level,
+        shuffle) clusters. A chunk size of 0 means h5py chooses the chunk shape.
+        """
+        rv = []
+        for name, profile in sorted(backend.STORAGE_PROFILES.items()):
+            rv.append(
+                (
+                    name,
+                    profile.chunk_rows or 0,
+                    profile.compression or "",
+                    profile.compression_opts or 0,
+                    profile.shuffle,
+                )
+            )
+        return rv
+
+    @setting(1032, "metadata save interval", interval="v", returns="v")
+    def metadata_save_interval(self, c, interval=None):
+        """
+        Get or set the interval in seconds between metadata writes.
+
+        Changes to session.ini files and dataset metadata are collected and
+        written together once per interval. An interval of 0 writes each change
+        immediately. Returns the current interval.
+        """
+        writer = self.session_store.metadata_writer
+        if interval is not None:
+            writer.interval = interval
+            if interval <= 0:
+                writer.flush()
+        return writer.interval
+
+    @setting(1033, "migrate csv", workers="w", returns="")
+    def migrate_csv(self, c, workers=migrate.DEFAULT_WORKERS):
+        """
+        Convert CSV datasets in and below the current directory to HDF5.
+
+        The conversion runs in the background in a pool of worker processes,
+        with at most the given number of datasets converted at once. CSV
+        datasets are opened from their HDF5 file once it has been converted
+        and verified. Datasets that were already converted are skipped, so an
+        interrupted migration can be started again. Use 'migration status' to
+        follow its progress.
+        """
+        if self._migration is not None and self._migration.running:
+            raise errors.MigrationInProgressError()
+        directory = getattr(self.get_session(c), "dir", None)
+        if directory is None:
+            raise errors.VirtualSessionError("migrate csv")
+
+        migration = migrate.Migration(
+            workers=workers, profile=self.storage_profile, root=directory
+        )
+        # mark it running now so a second request is refused while the thread starts
+        migration.running = True
+        self._migration = migration
+        d = threads.deferToThread(migration.run)
+        d.addErrback(lambda failure: print(failure.getErrorMessage()))
+
+    @setting(1034, "migration status", returns="(wwwb)")
+    def migration_status(self, c):
+        """
+        Get the progress of the last CSV migration.
+
+        Returns (datasets found, converted, failed, still running).
+        """
+        migration = self._migration
+        if migration is None:
+            return 0, 0, 0, False
+        return migration.total, migration.done, len(migration.failed), migration.running
+
+    @setting(1035, "swmr", enable="b", returns="b")
+    def swmr_setting(self, c, enable=None):
+        """
+        Get or set whether new datasets are written in SWMR mode.
+
+        SWMR (single-writer/multiple-reader) files can be opened by other
+        processes with h5py.File(filename, "r", libver="latest", swmr=True)
+        and read while data is added; call refresh() on the dataset to see
+        new rows. Returns the current setting.
+        """
+        if enable is not None:
+            self.swmr = enable
+        return self.swmr
+
+    @setting(
+        1036,
+        "file pool",
+        max_open="w",
+        idle_timeout="v",
+        returns="(w{open}, w{max open}, v{idle timeout}, w{hits}, w{misses})",
+    )
+    def file_pool(self, c, max_open=None, idle_timeout=None):
+        """
+        Get or set the limits on open dataset files.
+
+        At most max_open files are kept open; opening another one closes the
+        least recently used file. Files are also closed once they have not been
+        used for idle_timeout seconds. Returns the number of open files, the
+        limits, and the number of accesses that found the file open (hits) or
+        had to open it (misses).
+        """
+        pool = backend.get_file_pool()
+        pool.set_limits(max_open, idle_timeout)
+        return len(pool), pool.max_open, pool.idle_timeout, pool.hits, pool.misses
+
+    @setting(
+        1037,
+        "notify interval",
+        min_interval="v",
+        max_latency="v",
+        returns="(v{min interval}, v{max latency})",
+    )
+    def notify_interval(self, c, min_interval=None, max_latency=None):
+        """
+        Get or set the rate limit of data available signals about the current
+        dataset, in seconds.
+
+        Signals about the dataset are sent at most once per min_interval;
+        contexts notified in the meantime get one signal together at the end of
+        the interval, or max_latency after their notification if that is
+        sooner. A min_interval of 0 sends every signal at once. The limit lasts
+        while the dataset is open. Clients that connect to 'signal: new rows'
+        get the number of rows in the dataset with each signal, so they can
+        read exactly the new rows.
+        """
+        notifier = self.get_dataset(c).data_notifier
+        notifier.set_intervals(min_interval, max_latency)
+        return notifier.min_interval, notifier.max_latency
+
+    @setting(1038, "finalize", returns="b")
+    def finalize(self, c):
+        """
+        Rewrite the current dataset with its rows stored contiguously.
+
+        Call this once a dataset is finished. Reads of a finalized dataset are
+        mapped straight from the file instead of being copied out by HDF5, and
+        no more rows can be added to it. Returns False if the dataset was
+        already finalized or is not an HDF5 dataset written by the data vault.
+        """
+        dataset = self.get_dataset(c)
+        # the file is rewritten, so pending metadata has to be in it first
+        dataset.flush_metadata()
+        return self._run_io(dataset, dataset.finalize, lambda finalized: finalized)
+
+    @setting(1039, "durability", policy="s", returns="s")
+    def durability_setting(self, c, policy=None):
+        """
+        Get or set the durability policy of the current dataset.
+
+        The policy decides when rows added to the dataset are flushed to disk:
+            none:               only when the append buffer fills up or the
+                                file is closed
+            interval(N):        at most N seconds after rows were added
+            every_k_rows(K):    once K rows have been added since the last flush
+            fsync:              flush and fsync after every add, before it returns
+        An empty string makes the dataset use the server's default policy again.
+        The policy is kept while the dataset is open. Returns the policy in use.
+        """
+        dataset = self.get_dataset(c)
+        if policy is not None:
+            dataset.durability = durability.parse_policy(policy) if policy else None
+        return durability.format_policy(dataset.durability or self.durability)
+
+    @setting(1040, "default durability", policy="s", returns="s")
+    def default_durability(self, c, policy=None):
+        """
+        Get or set the durability policy of datasets that don't set their own.
+
+        See 'durability' for the policies. The default is interval(300).
+        """
+        if policy is not None:
+            self.durability = durability.parse_policy(policy)
+        return durability.format_policy(self.durability)
+
+    @setting(
+        1041,
+        "durability stats",
+        returns="(w{flushes}, w{bytes written}, v{mean latency}, v{max latency})",
+    )
+    def durability_stats(self, c):
+        """
+        Get the number of flushes made for durability policies, the bytes of
+        rows they wrote to disk, and their mean and largest latency in seconds.
+        """
+        flusher = self.session_store.flusher
+        return (
+            flusher.flushes,
+            flusher.bytes_written,
+            flusher.mean_latency(),
+            flusher.max_latency,
+        )
+
     # GET DATA
 
     @setting(1010, returns="s")
@@ -446,7 +785,7 @@ class DataVault(LabradServer):
         # fromarrays is faster than fromrecords, and when we have a simple 2-D array
         # we can just transpose the array.
         rec_data = np.core.records.fromarrays(data.T, dtype=dataset.data.dtype)
-        dataset.add_data(rec_data)
+        return self._add_data(dataset, rec_data)
 
     @setting(1020, data="?", returns="")
     def add_ex(self, c, data):
@@ -464,9 +803,8 @@ class DataVault(LabradServer):
         if not c["writing"]:
             raise errors.ReadOnlyError()
         list_data = [tuple(row) for row in data]
-        dataset.add_data(
-            np.core.records.fromrecords(list_data, dtype=dataset.data.dtype)
-        )
+        rec_data = np.core.records.fromrecords(list_data, dtype=dataset.data.dtype)
+        return self._add_data(dataset, rec_data)
 
     @setting(2020, data="?", returns="")
     def add_ex_t(self, c, data):
@@ -480,7 +818,8 @@ class DataVault(LabradServer):
         dataset = self.get_dataset(c)
         if not c["writing"]:
             raise errors.ReadOnlyError()
-        dataset.add_data(np.core.records.fromarrays(data, dtype=dataset.data.dtype))
+        rec_data = np.core.records.fromarrays(data, dtype=dataset.data.dtype)
+        return self._add_data(dataset, rec_data)
 
     @setting(21, limit="w", start_over="b", returns="*2v")
     def get(self, c, limit=None, start_over=False):
@@ -493,12 +832,7 @@ class DataVault(LabradServer):
         of the dataset.  By default, only new data that has not been seen
         in this context is returned.
         """
-        dataset = self.get_dataset(c)
-        c["filepos"] = 0 if start_over else c["filepos"]
-        data, c["filepos"] = dataset.get_data(limit, c["filepos"], simple_only=True)
-        key = self.context_key(c)
-        dataset.keep_streaming(key, c["filepos"])
-        return data
+        return self._get_data(c, limit, start_over, simple_only=True)
 
     @setting(1021, limit="w", start_over="b", returns="?")
     def get_ex(self, c, limit=None, start_over=False):
@@ -510,12 +844,7 @@ class DataVault(LabradServer):
         unflattening cluster arrays, consider using get_ex_t for
         performance.
         """
-        dataset = self.get_dataset(c)
-        c["filepos"] = 0 if start_over else c["filepos"]
-        data, c["filepos"] = dataset.get_data(limit, c["filepos"], transpose=False)
-        ctx = self.context_key(c)
-        dataset.keep_streaming(ctx, c["filepos"])
-        return data
+        return self._get_data(c, limit, start_over, transpose=False)
 
     @setting(2021, limit="w", start_over="b", returns="?")
     def get_ex_t(self, c, limit=None, start_over=False):
@@ -529,12 +858,46 @@ class DataVault(LabradServer):
         format, but is more efficient for pylabrad flatten/unflatten
         code.
         """
+        return self._get_data(c, limit, start_over, transpose=True)
+
+    @setting(22, max_points="w", start="w", stop="w", returns="*2v")
+    def get_decimated(self, c, max_points, start=0, stop=None):
+        """
+        Get a reduced view of rows [start, stop) of the current dataset for plotting.
+
+        If there are more than max_points rows, they are split into max_points/2
+        bins of consecutive rows, and each bin is returned as two rows holding
+        the minimum and the maximum of every column in the bin. Otherwise the
+        rows are returned unchanged. The default range is the whole dataset.
+        Only datasets whose columns are all scalar numbers can be decimated.
+        This does not change the position used by get.
+        """
         dataset = self.get_dataset(c)
-        c["filepos"] = 0 if start_over else c["filepos"]
-        data, c["filepos"] = dataset.get_data(limit, c["filepos"], transpose=True)
-        ctx = self.context_key(c)
-        dataset.keep_streaming(ctx, c["filepos"])
-        return data
+        return self._run_io(
+            dataset,
+            lambda: dataset.get_decimated(max_points, start, stop),
+            lambda data: data,
+        )
+
+    @setting(23, column="w", lo="v", hi="v", returns="*2v")
+    def get_range(self, c, column, lo, hi):
+        """
+        Get the rows of the current dataset whose value in the given column
+        (counting from 0) lies between lo and hi, inclusive.
+
+        Completed blocks of rows are indexed by the minimum and maximum of the
+        column, so that only the blocks that can match are read. For sorted
+        columns, such as time or scan axes, the matching rows are found by
+        binary search. Indexes are stored in HDF5 files, so they only have to
+        be built once. Only datasets whose columns are all scalar numbers can
+        be searched. This does not change the position used by get.
+        """
+        dataset = self.get_dataset(c)
+        return self._run_io(
+            dataset,
+            lambda: dataset.get_range(column, lo, hi),
+            lambda data: data,
+        )
 
     # VARIABLES
 
@@ -619,7 +982,10 @@ class DataVault(LabradServer):
     @setting(124, "add parameters", params="?{((s?)(s?)...)}", returns="")
     def add_parameters(self, c, params):
         """
-        Add a new parameter to the current dataset.
+        Add new parameters to the current dataset.
+
+        All parameters are written at once. If any of the names is already
+        in use, none of them are added.
         """
         dataset = self.get_dataset(c)
         dataset.add_parameters(params)
@@ -651,8 +1017,7 @@ class DataVault(LabradServer):
         are not allowed).
         """
         dataset = self.get_dataset(c)
-        names = dataset.get_param_names()
-        params = tuple((name, dataset.get_parameter(name)) for name in names)
+        params = tuple(dataset.get_parameters())
         key = self.context_key(c)
         dataset.param_listeners.add(key)  # send a message when new parameters are added
         if len(params):
@@ -708,7 +1073,7 @@ class DataVault(LabradServer):
         if isinstance(dirs, str):
             dirs = [dirs]
         if datasets is None:
-            datasets = [self.get_dataset(c)]
+            datasets = [self.get_dataset(c).name]
         elif isinstance(datasets, str):
             datasets = [datasets]
         sess = self.get_session(c)
@@ -728,6 +1093,25 @@ class DataVault(LabradServer):
             datasets = [datasets]
         return sess.get_tags(dirs, datasets)
 
+    @setting(302, "search", query="s", limit="w", returns="*(*ss)")
+    def search(self, c, query, limit=catalog.SEARCH_LIMIT):
+        """
+        Find datasets in all data directories, newest first.
+
+        Returns (path, name) for each matching dataset. The query is a list of
+        terms which must all match:
+            word            the title contains word
+            tag:name        the dataset has the tag
+            after:date      created on or after the date (YYYY-MM-DD)
+            before:date     created before the date
+            name=value      the parameter has the value
+            name<value      also <=, >, >= and != for numeric parameters
+        Terms with spaces can be quoted. Searches use the dataset catalog, which
+        is brought up to date with datasets written by other programs when the
+        server starts.
+        """
+        return self.session_store.search(query, limit)
+
 
 class DataVaultMultiHead(DataVault):
     """
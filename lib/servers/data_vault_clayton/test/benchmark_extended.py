@@ -0,0 +1,98 @@
+"""
+Benchmark the conversion done by get_ex and get_ex_t for extended datasets.
+
+Usage:
+    python benchmark_extended.py [rows]
+
+An extended (3.x) dataset with a time, two float columns and a vlen string
+column is written and read back with the row (get_ex) and transposed (get_ex_t)
+conversions. Each is compared with the previous conversion, which built a
+tuple per row and decoded strings one element at a time. Both times include
+reading the rows from the file, which is also reported on its own.
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from datavault import backend
+
+_INDEPENDENTS = [backend.Independent("Time", (1,), "v", "s")]
+_DEPENDENTS = [
+    backend.Dependent("Counts", "PMT", (1,), "v", ""),
+    backend.Dependent("Counts", "Reference", (1,), "v", ""),
+    backend.Dependent("State", "", (1,), "s", ""),
+]
+
+
+def _make_rows(rows, dtype):
+    records = np.empty((rows,), dtype=dtype)
+    records["f0"] = np.arange(rows) * 0.05
+    records["f1"] = np.random.RandomState(0).poisson(100, size=rows)
+    records["f2"] = np.random.RandomState(1).poisson(100, size=rows)
+    records["f3"] = ["bright", "dark", "dark", "bright"] * (rows // 4) + ["dark"] * (
+        rows % 4
+    )
+    return records
+
+
+def old_rows(struct_data):
+    return [tuple(row) for row in struct_data]
+
+
+def old_columns(struct_data):
+    columns = []
+    for name in struct_data.dtype.names:
+        col = struct_data[name]
+        if col.dtype == object:
+            col = [backend.decode_str(x) for x in col]
+        columns.append(col)
+    return tuple(columns)
+
+
+def _timed(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def main(argv=sys.argv):
+    rows = int(argv[1]) if len(argv) > 1 else 1000000
+    directory = tempfile.mkdtemp(prefix="dvbench_")
+    try:
+        filename = os.path.join(directory, "extended")
+        data = backend.create_backend(
+            filename, "extended", _INDEPENDENTS, _DEPENDENTS, True
+        )
+        data.add_data(_make_rows(rows, data.dtype))
+        data.flush()
+
+        read_time = _timed(data._get_data, None, 0)
+        print("{} rows, read from file in {:.3f} s".format(rows, read_time))
+        print(
+            "{:<10}{:>12}{:>12}{:>10}".format(
+                "setting", "old (s)", "new (s)", "speedup"
+            )
+        )
+        for setting, old, transpose in [
+            ("get_ex", old_rows, False),
+            ("get_ex_t", old_columns, True),
+        ]:
+            old_time = _timed(lambda: old(data._get_data(None, 0)[0]))
+            new_time = _timed(data.get_data, None, 0, transpose, False)
+            print(
+                "{:<10}{:>12.3f}{:>12.3f}{:>10.1f}".format(
+                    setting, old_time, new_time, old_time / new_time
+                )
+            )
+        data.file.close()
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
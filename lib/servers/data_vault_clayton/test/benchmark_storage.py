@@ -0,0 +1,86 @@
+"""
+Benchmark append and read throughput for each HDF5 storage profile.
+
+Usage:
+    python benchmark_storage.py [rows] [rows_per_add]
+
+Each profile gets a fresh simple (2.x) dataset with three float columns. Rows
+are appended in small batches, the way the PMT flow servers write, and then
+read back in one go. The file size on disk is reported alongside.
+
+Rows are buffered by the backend, so small batches are written in larger blocks;
+compressed profiles still pay for recompressing partial chunks at each flush.
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+from datavault import backend
+
+_INDEPENDENTS = [backend.Independent("Time", (1,), "v", "s")]
+_DEPENDENTS = [
+    backend.Dependent("Counts", "PMT", (1,), "v", ""),
+    backend.Dependent("Counts", "Reference", (1,), "v", ""),
+]
+
+
+def _make_rows(rows, dtype):
+    data = np.random.RandomState(0).poisson(100, size=(rows, 3)).astype(np.float64)
+    data[:, 0] = np.arange(rows) * 0.05
+    return np.core.records.fromarrays(data.T, dtype=dtype)
+
+
+def benchmark_profile(directory, name, rows, rows_per_add):
+    filename = os.path.join(directory, name)
+    data = backend.create_backend(
+        filename, name, _INDEPENDENTS, _DEPENDENTS, False, name
+    )
+    records = _make_rows(rows, data.dtype)
+
+    start = time.perf_counter()
+    for idx in range(0, rows, rows_per_add):
+        data.add_data(records[idx : idx + rows_per_add])
+    data.flush()
+    append_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    read_data, _ = data.get_data(None, 0, False, None)
+    read_time = time.perf_counter() - start
+    assert read_data.shape == (rows, 3)
+
+    data.file.close()
+    size = os.path.getsize(filename + ".hdf5")
+    return append_time, read_time, size
+
+
+def main(argv=sys.argv):
+    rows = int(argv[1]) if len(argv) > 1 else 50000
+    rows_per_add = int(argv[2]) if len(argv) > 2 else 10
+    directory = tempfile.mkdtemp(prefix="dvbench_")
+    try:
+        print("{} rows, {} rows per add".format(rows, rows_per_add))
+        print(
+            "{:<10}{:>16}{:>16}{:>12}".format(
+                "profile", "append rows/s", "read rows/s", "size (MB)"
+            )
+        )
+        for name in sorted(backend.STORAGE_PROFILES):
+            append_time, read_time, size = benchmark_profile(
+                directory, name, rows, rows_per_add
+            )
+            print(
+                "{:<10}{:>16.0f}{:>16.0f}{:>12.2f}".format(
+                    name, rows / append_time, rows / read_time, size / 1e6
+                )
+            )
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,7 @@
 import datetime
+import gc
 import h5py
+import mock
 import numpy as np
 import os
 import pytest
@@ -7,6 +9,7 @@ import random
 import string
 import time
 import tempfile
+import threading
 import unittest
 
 from labrad import types as T
@@ -138,6 +141,98 @@ class SelfClosingFileTest(_TestCase):
             self.close_callback_called, msg="Registered callback not called!"
         )
 
+    def test_not_closed_while_in_use(self):
+        # an I/O thread holds the lock while it uses the file
+        holding, done = threading.Event(), threading.Event()
+
+        def use_file():
+            with self.file.lock:
+                holding.set()
+                done.wait()
+
+        thread = threading.Thread(target=use_file)
+        thread.start()
+        holding.wait()
+        self.clock.advance(self.close_timeout_sec)
+        self.assertTrue(self.opener.file.is_open, msg="File closed while in use")
+        done.set()
+        thread.join()
+        self.clock.advance(self.close_timeout_sec)
+        self.assertFalse(self.opener.file.is_open, msg="File not closed after use")
+
+
+class FilePoolTest(_TestCase):
+    """Tests for the FilePool shared by SelfClosingFiles."""
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.pool = backend.FilePool(max_open=2, idle_timeout=10, reactor=self.clock)
+        self.closed = []
+        self.openers = [_MockFileOpener() for _ in range(3)]
+        self.files = []
+        for opener in self.openers:
+            fh = backend.SelfClosingFile(
+                opener=opener, touch=False, reactor=self.clock, pool=self.pool
+            )
+            fh.on_close(self.closed.append)
+            self.files.append(fh)
+
+    def test_least_recently_used_file_evicted(self):
+        a, b, c = self.files
+        a()
+        b()
+        a()
+        c()
+        self.assertEqual([b], self.closed)
+        self.assertFalse(self.openers[1].file.is_open)
+        self.assertEqual(2, len(self.pool))
+        self.assertEqual((1, 3), (self.pool.hits, self.pool.misses))
+        # reopened on the next access
+        b()
+        self.assertEqual([b, a], self.closed)
+        self.assertTrue(b.is_open())
+
+    def test_idle_files_closed_by_one_timer(self):
+        a, b, _ = self.files
+        a()
+        self.clock.advance(5)
+        b()
+        for _ in range(100):
+            b()
+        self.assertEqual(1, len(self.clock.getDelayedCalls()))
+        self.clock.advance(5)
+        self.assertEqual([a], self.closed)
+        self.clock.advance(5)
+        self.assertEqual([a, b], self.closed)
+        self.assertEqual([], self.clock.getDelayedCalls())
+
+    def test_file_in_use_not_evicted(self):
+        a, b, c = self.files
+        a()
+        b()
+        holding, done = threading.Event(), threading.Event()
+
+        def use_file():
+            with a.lock:
+                holding.set()
+                done.wait()
+
+        thread = threading.Thread(target=use_file)
+        thread.start()
+        holding.wait()
+        c()
+        done.set()
+        thread.join()
+        self.assertEqual([b], self.closed)
+
+    def test_set_limits(self):
+        for fh in self.files[:2]:
+            fh()
+        self.pool.set_limits(max_open=1, idle_timeout=1)
+        self.assertEqual([self.files[0]], self.closed)
+        self.clock.advance(1)
+        self.assertEqual(self.files[:2], self.closed)
+
 
 # Dependent and Independent variables used for testing IniData and HDF5MetaData.
 _INDEPENDENTS = [
@@ -572,6 +667,30 @@ class CsvNumpyDataTest(_BackendDataTest):
         self.assertRaises(errors.BadDataError, self.data.add_data, [(1, 2)])
         self.assertRaises(errors.BadDataError, self.data.add_data, [(1, 2, 3, 4)])
 
+    def test_capacity_doubles(self):
+        row = np.recarray((1,), dtype=[("f0", "<f8"), ("f1", "<f8"), ("f2", "<f8")])
+        for i in range(5):
+            row[0] = (i, i, i)
+            self.data.add_data(row)
+        self.assertEqual((5, 3), self.data.data.shape)
+        self.assertEqual(8, len(self.data._data))
+        self.assert_arrays_equal(np.arange(5), self.data.data[:, 0])
+
+    def test_only_new_lines_parsed(self):
+        with open(self.filename, "w") as f:
+            f.write("1,2,3\r\n4,5,6\r\n")
+        self.assert_arrays_equal([[1, 2, 3], [4, 5, 6]], self.data.data)
+
+        # a line that is still being written is not read yet
+        with open(self.filename, "a") as f:
+            f.write("7,8,9\r\n10,11")
+        with mock.patch.object(np, "loadtxt", wraps=np.loadtxt) as loadtxt:
+            self.assertEqual(3, len(self.data.data))
+            self.assertEqual(b"7,8,9\r\n", loadtxt.call_args[0][0].getvalue())
+        with open(self.filename, "a") as f:
+            f.write(",12\r\n")
+        self.assert_arrays_equal([10, 11, 12], self.data.data[3])
+
 
 class ExtendedHDF5DataTest(_BackendDataTest):
 
@@ -717,6 +836,30 @@ class ExtendedHDF5DataTest(_BackendDataTest):
         added_data, _ = data.get_data(None, 0, False, None)
         self.assertEqual(added_data[0][0], "{'a': 0}")
 
+    def test_read_string_column(self):
+        data = self.get_backend_data(_unique_filename())
+        data.initialize_info(
+            "Foo",
+            [backend.Independent("Time", (1,), "v", "s")],
+            [backend.Dependent("Note", "", (1,), "s", "")],
+        )
+        data_entry = np.recarray((2,), dtype=[("f0", "<f8"), ("f1", "O")])
+        data_entry[0] = (1.0, "café")
+        data_entry[1] = (2.0, "plain")
+        data.add_data(data_entry)
+        data.flush()
+        data_entry[1] = (3.0, "buffered")
+        data.add_data(data_entry[1:])
+
+        rows, next_pos = data.get_data(None, 0, False, None)
+        self.assertEqual(next_pos, 3)
+        self.assertEqual(rows, [(1.0, "café"), (2.0, "plain"), (3.0, "buffered")])
+        columns, _ = data.get_data(None, 0, True, None)
+        self.assert_arrays_equal(columns[0], [1.0, 2.0, 3.0])
+        self.assertEqual(columns[1], ["café", "plain", "buffered"])
+        columns, _ = data.get_data(1, 0, True, None)
+        self.assertEqual(columns[1], ["café"])
+
     def test_add_string_array_column(self):
         name = _unique_filename()
         data = self.get_backend_data(name)
@@ -755,5 +898,333 @@ class SimpleHDF5DataTest(_BackendDataTest):
         self.assertEqual(read_data.size, 0)
 
 
+class AppendBufferTest(_TestCase):
+    def setUp(self):
+        self.filename = _unique_filename()
+        self.clock = task.Clock()
+        self.fh = backend.SelfClosingFile(
+            h5py.File, open_args=(self.filename, "a"), reactor=self.clock
+        )
+        self.data = backend.SimpleHDF5Data(self.fh)
+        self.data.initialize_info("FooTitle", _INDEPENDENTS, _DEPENDENTS)
+
+    def tearDown(self):
+        self.fh.close()
+        _remove_file_if_exists(self.filename)
+
+    def _rows(self, *rows):
+        data = np.recarray((len(rows),), dtype=self.data.dtype)
+        for i, row in enumerate(rows):
+            data[i] = row
+        return data
+
+    def test_buffered_rows_are_readable(self):
+        self.data.add_data(self._rows((1, 2, 3)))
+        self.data.add_data(self._rows((4, 5, 6)))
+        self.assertEqual(self.data.dataset.attrs["Length"], 0)
+        self.assertEqual(len(self.data), 2)
+        self.assertTrue(self.data.has_more(1))
+        read_data, next_pos = self.data.get_data(None, 1, False, None)
+        self.assertEqual(next_pos, 2)
+        self.assert_arrays_equal(read_data, [[4, 5, 6]])
+
+    def test_buffer_written_after_max_age(self):
+        self.data.add_data(self._rows((1, 2, 3)))
+        self.clock.advance(backend.BUFFER_MAX_AGE_SEC)
+        self.assertEqual(self.data.dataset.attrs["Length"], 1)
+        self.data.add_data(self._rows((4, 5, 6)))
+        read_data, next_pos = self.data.get_data(None, 0, False, None)
+        self.assertEqual(next_pos, 2)
+        self.assert_arrays_equal(read_data, [[1, 2, 3], [4, 5, 6]])
+
+    def test_dataset_grows_geometrically(self):
+        for i in range(5):
+            self.data.add_data(self._rows((i, i, i)))
+            self.data.flush_buffer()
+        self.assertEqual(self.data.dataset.attrs["Length"], 5)
+        self.assertEqual(self.data.dataset.shape, (8,))
+        self.assertEqual(len(self.data), 5)
+
+    def test_close_writes_and_trims(self):
+        for i in range(3):
+            self.data.add_data(self._rows((i, i, i)))
+            self.data.flush_buffer()
+        self.data.add_data(self._rows((3, 3, 3)))
+        self.fh.close()
+        with h5py.File(self.filename, "r") as f:
+            self.assertEqual(f["DataVault"].shape, (4,))
+            self.assertEqual(f["DataVault"].attrs["Length"], 4)
+
+
+class StorageProfileTest(_TestCase):
+    def setUp(self):
+        self.filename = _unique_filename(suffix="")
+
+    def tearDown(self):
+        _remove_file_if_exists(self.filename + ".hdf5")
+
+    def test_default_profile(self):
+        data = backend.create_backend(
+            self.filename, "Foo", _INDEPENDENTS, _DEPENDENTS, False
+        )
+        self.assertIsNone(data.dataset.compression)
+        self.assertEqual(data.dataset.maxshape, (None,))
+
+    def test_compressed_profile(self):
+        data = backend.create_backend(
+            self.filename, "Foo", _INDEPENDENTS, _DEPENDENTS, True, "compact"
+        )
+        profile = backend.STORAGE_PROFILES["compact"]
+        self.assertEqual(data.dataset.chunks, (profile.chunk_rows,))
+        self.assertEqual(data.dataset.compression, "gzip")
+        self.assertEqual(data.dataset.compression_opts, profile.compression_opts)
+        self.assertTrue(data.dataset.shuffle)
+
+        rows = np.recarray((3,), dtype=data.dtype)
+        rows[:] = [(1, 2, 3), (4, 5, 6), (7, 8, 9)]
+        data.add_data(rows)
+        read_data, next_pos = data.get_data(None, 0, False, None)
+        self.assertEqual(next_pos, 3)
+        self.assert_arrays_equal(read_data, [(1, 2, 3), (4, 5, 6), (7, 8, 9)])
+
+    def test_unknown_profile(self):
+        self.assertRaises(
+            errors.BadStorageProfileError,
+            backend.create_backend,
+            self.filename,
+            "Foo",
+            _INDEPENDENTS,
+            _DEPENDENTS,
+            False,
+            "bogus",
+        )
+        self.assertFalse(os.path.exists(self.filename + ".hdf5"))
+
+
+class HDF5ParametersTest(_TestCase):
+    def setUp(self):
+        self.filename = _unique_filename(suffix="")
+        self.data = backend.create_backend(
+            self.filename, "Foo", _INDEPENDENTS, _DEPENDENTS, True
+        )
+
+    def tearDown(self):
+        self.data._file.close()
+        _remove_file_if_exists(self.filename + ".hdf5")
+
+    def _reopen(self):
+        self.data._file.close()
+        self.data = backend.open_backend(self.filename)
+
+    def test_add_params(self):
+        params = [("Param{}".format(i), (i, "x")) for i in range(200)]
+        attrs_class = h5py.AttributeManager
+        with mock.patch.object(
+            attrs_class, "create", autospec=True, side_effect=attrs_class.create
+        ) as create:
+            self.data.add_params(params)
+            self.assertEqual(0, create.call_count)
+            self.data.save_metadata()
+        self.assertEqual(1, create.call_count)
+
+        self._reopen()
+        self.assertEqual([p[0] for p in params], self.data.get_param_names())
+        self.assertEqual(params, self.data.get_parameters())
+        self.assertEqual((5, "x"), self.data.get_parameter("param5", False))
+
+    def test_add_param_writes_once_per_save(self):
+        params = [("Param{}".format(i), i) for i in range(100)]
+        attrs_class = h5py.AttributeManager
+        with mock.patch.object(
+            attrs_class, "create", autospec=True, side_effect=attrs_class.create
+        ) as create:
+            for name, value in params:
+                self.data.add_param(name, value)
+            self.assertEqual(params, self.data.get_parameters())
+            self.data.save_metadata()
+            self.data.add_param("Last", 100)
+            self.data.save_metadata()
+            self.data.save_metadata()
+        self.assertEqual(2, create.call_count)
+
+        self._reopen()
+        self.assertEqual(params + [("Last", 100)], self.data.get_parameters())
+
+    def test_add_params_in_use(self):
+        self.data.add_param("A", 1)
+        self.assertRaises(
+            errors.ParameterInUseError, self.data.add_params, [("B", 2), ("A", 3)]
+        )
+        self.assertRaises(
+            errors.ParameterInUseError, self.data.add_params, [("B", 2), ("B", 3)]
+        )
+        self._reopen()
+        self.assertEqual([("A", 1)], self.data.get_parameters())
+
+    def test_legacy_parameters_readable(self):
+        self.data.dataset.attrs["Param.Old"] = backend.labrad_urlencode(1.5)
+        self._reopen()
+        self.data.add_param("New", 2.5)
+        self.assertEqual([("Old", 1.5), ("New", 2.5)], self.data.get_parameters())
+        self.assertRaises(errors.ParameterInUseError, self.data.add_param, "Old", 0)
+
+
+class SWMRTest(_TestCase):
+    def setUp(self):
+        self.filename = _unique_filename(suffix="")
+        self.data = backend.create_backend(
+            self.filename, "Foo", _INDEPENDENTS, _DEPENDENTS, False, swmr=True
+        )
+
+    def tearDown(self):
+        self.data._file.close()
+        _remove_file_if_exists(self.filename + ".hdf5")
+
+    def _add_rows(self, *rows):
+        data = np.array(list(rows), dtype=self.data.dtype)
+        self.data.add_data(data)
+        self.data.flush_buffer()
+
+    def _read(self):
+        with h5py.File(self.filename + ".hdf5", "r", libver="latest", swmr=True) as f:
+            return f["DataVault"][:].tolist()
+
+    def test_rows_visible_to_readers(self):
+        self.assertTrue(self.data.file.swmr_mode)
+        self._add_rows((1, 2, 3), (4, 5, 6))
+        self.assertEqual([(1, 2, 3), (4, 5, 6)], self._read())
+
+    def test_metadata_written_outside_swmr_mode(self):
+        self._add_rows((1, 2, 3))
+        self.data.add_param("Foo", 1.5)
+        self.data.add_comment("user", "comment")
+        self._add_rows((4, 5, 6))
+        self.assertTrue(self.data.file.swmr_mode)
+        self.assertEqual([(1, 2, 3), (4, 5, 6)], self._read())
+        self.assertEqual(1.5, self.data.get_parameter("Foo"))
+
+    def test_access_time_deferred_in_swmr_mode(self):
+        self._add_rows((1, 2, 3))
+        accessed = self.data.dataset.attrs["Access Time"]
+        self.data.access()
+        pending = self.data._accessed
+        self.data.save_metadata()
+        self.assertTrue(self.data._file.is_open())
+        self.assertTrue(self.data.file.swmr_mode)
+        self.assertEqual(accessed, self.data.dataset.attrs["Access Time"])
+
+        self.data.finalize()
+        self.assertEqual(pending, self.data.dataset.attrs["Access Time"])
+
+    def test_reopened(self):
+        self._add_rows((1, 2, 3))
+        self.data._file.close()
+        self.data = backend.open_backend(self.filename)
+        self.assertTrue(self.data.swmr)
+        self._add_rows((4, 5, 6))
+        self.assertEqual(2, len(self.data))
+        self.assertEqual([(1, 2, 3), (4, 5, 6)], self._read())
+
+
+class FinalizeTest(_TestCase):
+    def setUp(self):
+        self.filename = _unique_filename(suffix="")
+
+    def tearDown(self):
+        self.data._file.close()
+        _remove_file_if_exists(self.filename + ".hdf5")
+
+    def _create(self, indep, dep, extended, **kw):
+        self.data = backend.create_backend(
+            self.filename, "Foo", indep, dep, extended, **kw
+        )
+        self.data.add_param("Foo", 1.5)
+
+    def test_finalize_simple(self):
+        self._create(_INDEPENDENTS, _DEPENDENTS, False, profile="compact")
+        self.data.add_data(np.array([(1, 2, 3), (4, 5, 6)], dtype=self.data.dtype))
+        self.assertTrue(self.data.finalize())
+        self.assertIsNone(self.data.dataset.chunks)
+        self.assertNotIn("Length", self.data.dataset.attrs)
+        self.assertEqual(1.5, self.data.get_parameter("Foo"))
+
+        data, pos = self.data.get_data(None, 0, False, True)
+        self.assertEqual(2, pos)
+        self.assert_arrays_equal(data, [[1, 2, 3], [4, 5, 6]])
+        self.assertIsInstance(data.base, np.memmap)
+        data, pos = self.data.get_data(5, 1, False, True)
+        self.assert_arrays_equal(data, [[4, 5, 6]])
+        self.assertEqual((0, 3), self.data.get_data(1, 2, False, True)[0].shape)
+
+        self.assertRaises(
+            errors.FinalizedError,
+            self.data.add_data,
+            np.array([(7, 8, 9)], dtype=self.data.dtype),
+        )
+        self.assertFalse(self.data.finalize())
+        self.data._file.close()
+        self.data = backend.open_backend(self.filename)
+        self.assertEqual(2, len(self.data))
+        self.assertTrue(self.data.finalized)
+
+    def test_finalize_strings_not_mapped(self):
+        self._create(
+            [backend.Independent("Time", (1,), "v", "s")],
+            [backend.Dependent("Note", "", (1,), "s", "")],
+            True,
+            swmr=True,
+        )
+        self.data.add_data(np.array([(1.0, "a"), (2.0, "b")], dtype=self.data.dtype))
+        self.assertTrue(self.data.finalize())
+        self.assertIsNone(self.data._get_memmap())
+        self.assertFalse(self.data.swmr)
+        self.assertEqual(
+            [(1.0, "a"), (2.0, "b")], self.data.get_data(None, 0, False, False)[0]
+        )
+        self.assertEqual(1.5, self.data.get_parameter("Foo"))
+
+
+class SharedFileTest(_TestCase):
+    def setUp(self):
+        self.base = _unique_filename(suffix="")
+        self.filename = self.base + ".h5"
+        with h5py.File(self.filename, "w") as f:
+            group = f.create_group("datasets")
+            for name in ["b", "a", "c"]:
+                group.create_dataset(name, data=np.ones((4, 2)))
+
+    def tearDown(self):
+        _remove_file_if_exists(self.filename)
+
+    def test_one_handle_per_file(self):
+        datasets = [backend.open_backend(self.base, name) for name in "abc"]
+        fh = datasets[0]._file
+        self.assertTrue(all(data._file is fh for data in datasets))
+        self.assertEqual((4, 2), datasets[2].shape())
+        self.assertTrue(fh.is_open())
+        del datasets[:2]
+        gc.collect()
+        self.assertTrue(fh.is_open())
+        del datasets[:]
+        gc.collect()
+        self.assertFalse(fh.is_open())
+        self.assertNotIn(os.path.abspath(self.filename), backend._shared_files)
+
+    def test_missing_dataset_released(self):
+        self.assertRaises(KeyError, backend.open_backend, self.base, "d")
+        self.assertNotIn(os.path.abspath(self.filename), backend._shared_files)
+
+    def test_dataset_names_cached(self):
+        self.assertEqual(["a", "b", "c"], backend.hdf5_dataset_names(self.filename))
+        with mock.patch("h5py.File", side_effect=AssertionError("file opened")):
+            self.assertEqual(["a", "b", "c"], backend.hdf5_dataset_names(self.filename))
+        with h5py.File(self.filename, "a") as f:
+            f["datasets"].create_dataset("d", data=np.ones((4, 2)))
+        os.utime(self.filename, ns=(0, 0))
+        self.assertEqual(
+            ["a", "b", "c", "d"], backend.hdf5_dataset_names(self.filename)
+        )
+
+
 if __name__ == "__main__":
     pytest.main(["-v", __file__])
@@ -0,0 +1,144 @@
+import mock
+import os
+import pytest
+import shutil
+import tempfile
+import unittest
+
+from datetime import datetime
+from labrad import units as U
+
+from datavault import SessionStore, backend, catalog, errors, util
+
+_INDEPENDENTS = [backend.Independent("Time", (1,), "v", "s")]
+_DEPENDENTS = [backend.Dependent("Counts", "PMT", (1,), "v", "")]
+
+
+class CatalogSearchTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix="dvtest_")
+        self.catalog = catalog.Catalog(os.path.join(self.dir, "catalog.sqlite"))
+        path = ["", "data", "2024"]
+        created = datetime(2024, 5, 1).timestamp()
+        self.catalog.add_dataset(path, "00001 - Rabi Scan", "Rabi Scan", created)
+        self.catalog.add_dataset(path, "00002 - Ramsey", "Ramsey", created + 86400)
+        self.catalog.add_dataset(path, "00003 - rabi flop", "rabi flop", created)
+        self.catalog.set_tags(path, "00002 - Ramsey", ["good"])
+        self.catalog.add_parameters(
+            path,
+            "00001 - Rabi Scan",
+            [("freq", U.Value(10.0, "MHz")), ("ion", "Ca40"), ("shots", 100)],
+        )
+        self.catalog.add_parameters(path, "00003 - rabi flop", [("freq", 12.5)])
+
+    def tearDown(self):
+        self.catalog.close()
+        shutil.rmtree(self.dir)
+
+    def _names(self, query):
+        return sorted(name for path, name in self.catalog.search(query))
+
+    def test_title(self):
+        self.assertEqual(
+            ["00001 - Rabi Scan", "00003 - rabi flop"], self._names("rabi")
+        )
+        self.assertEqual(["00001 - Rabi Scan"], self._names('"rabi scan"'))
+
+    def test_tag_and_date(self):
+        self.assertEqual(["00002 - Ramsey"], self._names("tag:good"))
+        self.assertEqual(["00002 - Ramsey"], self._names("after:2024-05-02"))
+        self.assertEqual(2, len(self._names("before:2024-05-02")))
+
+    def test_parameters(self):
+        self.assertEqual(["00003 - rabi flop"], self._names("freq>10"))
+        self.assertEqual(2, len(self._names("freq>=10 rabi")))
+        self.assertEqual(["00001 - Rabi Scan"], self._names("ion=Ca40 shots=100"))
+        self.assertEqual([], self._names("ion=Sr88"))
+
+    def test_results(self):
+        results = self.catalog.search("", limit=2)
+        self.assertEqual((["", "data", "2024"], "00002 - Ramsey"), results[0])
+        self.assertEqual(2, len(results))
+
+    def test_bad_query(self):
+        with self.assertRaises(errors.BadQueryError):
+            self.catalog.search("ion>Ca")
+        with self.assertRaises(errors.BadQueryError):
+            self.catalog.search("after:May")
+
+
+class CatalogCrawlTest(unittest.TestCase):
+    def setUp(self):
+        self.parent = tempfile.mkdtemp(prefix="dvtest_")
+        self.dir = os.path.join(self.parent, "data", "a%fb")
+        os.makedirs(self.dir)
+        data = backend.create_backend(
+            os.path.join(self.dir, "00001 - Scan"),
+            "Scan",
+            _INDEPENDENTS,
+            _DEPENDENTS,
+            True,
+        )
+        data.add_param("Frequency", 1.5)
+        data._file.close()
+        csv = backend.CsvNumpyData(os.path.join(self.dir, "00002 - Old.csv"))
+        csv.initialize_info("Old", _INDEPENDENTS, _DEPENDENTS)
+        csv.add_param("Frequency", 3.0)
+        csv.save()
+        with open(os.path.join(self.dir, "00002 - Old.csv"), "w") as f:
+            f.write("0,1\r\n1,2\r\n")
+        s = util.DVSafeConfigParser()
+        s.add_section("Tags")
+        s.set("Tags", "sessions", repr({}))
+        s.set("Tags", "datasets", repr({"00002 - Old": {"keep"}}))
+        with open(os.path.join(self.dir, "session.ini"), "w") as f:
+            s.write(f)
+        self.catalog = catalog.Catalog(os.path.join(self.parent, "catalog.sqlite"))
+        self.datadirs = {"data": self.parent}
+
+    def tearDown(self):
+        self.catalog.close()
+        shutil.rmtree(self.parent)
+
+    def test_crawl(self):
+        self.assertEqual(2, self.catalog.crawl(self.datadirs))
+        self.assertFalse(self.catalog.crawling)
+        self.assertEqual(
+            [(["", "data", "a/b"], "00001 - Scan")], self.catalog.search("Frequency<2")
+        )
+        self.assertEqual(
+            [(["", "data", "a/b"], "00002 - Old")], self.catalog.search("tag:keep")
+        )
+
+        # unchanged files are not read again, and deleted ones are removed
+        os.remove(os.path.join(self.dir, "00002 - Old.csv"))
+        self.assertEqual(0, self.catalog.crawl(self.datadirs))
+        self.assertEqual([], self.catalog.search("Old"))
+        self.assertEqual(1, len(self.catalog.search("")))
+
+
+class SessionStoreCatalogTest(unittest.TestCase):
+    def setUp(self):
+        self.parent = tempfile.mkdtemp(prefix="dvtest_")
+        self.store = SessionStore(
+            os.path.join(self.parent, "data"), mock.MagicMock(), io_threads=0
+        )
+
+    def tearDown(self):
+        self.store.catalog.close()
+        shutil.rmtree(self.parent)
+
+    def test_session_updates_catalog(self):
+        session = self.store.get(["", "sub"])
+        dataset = session.new_dataset("Scan", [("x", "ms")], [("y", "E", "eV")])
+        dataset.add_parameter("Power", 2.0)
+        session.update_tags(["good"], [], [dataset.name])
+        self.assertEqual(
+            [(["", "sub"], "00001 - Scan")],
+            self.store.search("Scan tag:good Power=2"),
+        )
+        dataset.data._file.close()
+
+
+if __name__ == "__main__":
+    pytest.main(["-v", __file__])
@@ -0,0 +1,127 @@
+import numpy as np
+import os
+import pytest
+import shutil
+import tempfile
+import time
+import unittest
+
+import h5py
+
+from datavault import backend, compact, listing
+
+_INDEPENDENTS = [backend.Independent("Time", (1,), "v", "s")]
+_DEPENDENTS = [
+    backend.Dependent("Counts", "PMT", (1,), "v", ""),
+    backend.Dependent("Note", "", (1,), "s", ""),
+]
+
+
+class CompactTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix="dvtest_")
+        self.base = os.path.join(self.dir, "00001 - Scan")
+        data = backend.create_backend(
+            self.base, "Scan", _INDEPENDENTS, _DEPENDENTS, True
+        )
+        data.add_param("Frequency", 1.5)
+        data.add_comment("user", "looks good")
+        rows = np.zeros(1000, dtype=data.dtype)
+        rows["f0"] = np.arange(1000.0)
+        rows["f1"] = np.where(np.arange(1000) % 7, 3.0, np.nan)
+        rows["f2"] = ["row {}".format(i % 3) for i in range(1000)]
+        data.add_data(rows)
+        data._file.close()
+        self.hdf5_file = self.base + ".hdf5"
+        self.old = time.time() - 40 * 86400
+        os.utime(self.hdf5_file, (self.old, self.old))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_find_old_datasets(self):
+        self.assertEqual([self.hdf5_file], compact.find_old_datasets(self.dir, 30))
+        self.assertEqual([], compact.find_old_datasets(self.dir, 60))
+
+    def test_compact_dataset(self):
+        before, after = compact.compact_dataset(self.hdf5_file, "archive")
+        self.assertEqual(before - after, before - os.path.getsize(self.hdf5_file))
+        self.assertEqual(self.old, os.stat(self.hdf5_file).st_mtime)
+        self.assertFalse(os.path.exists(self.hdf5_file + ".compacting"))
+        with h5py.File(self.hdf5_file, "r") as f:
+            self.assertEqual("gzip", f["DataVault"].compression)
+
+        data = backend.open_backend(self.base)
+        self.assertEqual(1.5, data.get_parameter("Frequency"))
+        comments, _ = data.get_comments(None, 0)
+        self.assertEqual("looks good", comments[0][2])
+        rows, _ = data.get_data(None, 0, False, None)
+        self.assertEqual(1000, len(rows))
+        self.assertEqual((999.0, 3.0, "row 0"), tuple(rows[999]))
+        data._file.close()
+
+        # already compressed
+        self.assertIsNone(compact.compact_dataset(self.hdf5_file, "archive"))
+
+    def test_changed_while_compacting(self):
+        verify = compact._verify
+
+        def touch_and_verify(filename, tmp_file):
+            verify(filename, tmp_file)
+            os.utime(filename, None)
+
+        compact._verify = touch_and_verify
+        try:
+            with self.assertRaises(compact.CompactionError):
+                compact.compact_dataset(self.hdf5_file, "archive")
+        finally:
+            compact._verify = verify
+        self.assertFalse(os.path.exists(self.hdf5_file + ".compacting"))
+        with h5py.File(self.hdf5_file, "r") as f:
+            self.assertIsNone(f["DataVault"].compression)
+
+    def test_swmr_dataset(self):
+        base = os.path.join(self.dir, "00002 - Live")
+        data = backend.create_backend(
+            base, "Live", _INDEPENDENTS, _DEPENDENTS, True, swmr=True
+        )
+        rows = np.zeros(10, dtype=data.dtype)
+        rows["f0"] = np.arange(10.0)
+        rows["f2"] = "x"
+        data.add_data(rows)
+        data._file.close()
+        self.assertIsNotNone(compact.compact_dataset(base + ".hdf5", "archive"))
+        with h5py.File(base + ".hdf5", "r") as f:
+            self.assertNotIn(backend.SWMR_ATTR, f.attrs)
+
+        # the compacted file is appended to normally
+        data = backend.open_backend(base)
+        data.add_data(rows)
+        data.flush_buffer()
+        self.assertEqual(20, len(data.get_data(None, 0, False, None)[0]))
+        data._file.close()
+
+    def test_file_open_for_writing_skipped(self):
+        with h5py.File(self.hdf5_file, "a"):
+            self.assertIsNone(compact.compact_dataset(self.hdf5_file, "archive"))
+        with h5py.File(self.hdf5_file, "r") as f:
+            self.assertIsNone(f["DataVault"].compression)
+
+    def test_compaction_in_pool(self):
+        listing.ListingIndex(self.dir).contents()
+        compaction = compact.Compaction(workers=1, roots=[self.dir], age_days=30)
+        compaction.run()
+        self.assertEqual(
+            (1, 1, 0, []),
+            (compaction.total, compaction.done, compaction.skipped, compaction.failed),
+        )
+        self.assertGreater(compaction.saved, 0)
+        self.assertFalse(compaction.running)
+        entry = listing.ListingIndex(self.dir)._entries["00001 - Scan.hdf5"]
+        self.assertEqual(
+            [listing.DATASET, self.old, os.path.getsize(self.hdf5_file)], entry
+        )
+
+
+if __name__ == "__main__":
+    pytest.main(["-v", __file__])
@@ -9,7 +9,7 @@ from labrad import types
 
 from twisted.internet import task
 
-from datavault import Session, Dataset, SessionStore
+from datavault import Session, Dataset, SessionStore, backend, errors, util
 
 
 def _unique_dir():
@@ -163,6 +163,73 @@ class SessionTest(_DatavaultTestCase):
         d2 = s2.open_dataset(datasets[0])
         self.assertDatasetsEqual(d1, d2)
 
+    def test_open_dataset_by_number(self):
+        session = self._get_session()
+        session.new_dataset(self._TITLE, self._INDEPENDENTS, self._DEPENDENTS)
+        session.open_dataset(1)
+        session.new_dataset("Bar", self._INDEPENDENTS, self._DEPENDENTS)
+
+        # the lookup table was filled by the first open and updated by new_dataset
+        with mock.patch("os.listdir") as listdir:
+            self.assertEqual("00002 - Bar", session.open_dataset(2).name)
+            self.assertEqual("00001 - Foo", session.open_dataset(1).name)
+            self.assertFalse(listdir.called)
+
+    def test_open_dataset_added_externally(self):
+        s1 = self._get_session()
+        s1.new_dataset(self._TITLE, self._INDEPENDENTS, self._DEPENDENTS)
+        s2 = self._get_session()
+        s2.open_dataset(1)
+        s1.new_dataset("Bar", self._INDEPENDENTS, self._DEPENDENTS)
+
+        self.assertEqual("00002 - Bar", s2.open_dataset(2).name)
+        self.assertEqual("00002 - Bar", s2.open_dataset("00002 - Bar").name)
+        with self.assertRaises(errors.DatasetNotFoundError):
+            s2.open_dataset(3)
+
+    def _saved_counter(self, session):
+        parser = util.DVSafeConfigParser()
+        parser.read(session.infofile)
+        return parser.getint("File System", "Counter")
+
+    def test_metadata_writes_coalesced(self):
+        clock = task.Clock()
+        self.store.metadata_writer = util.MetadataWriter(5.0, reactor=clock)
+        session = self._get_session()
+        self.assertEqual(1, self._saved_counter(session))
+
+        dataset = session.new_dataset(self._TITLE, self._INDEPENDENTS, self._DEPENDENTS)
+        session.open_dataset(1)
+        dataset.add_parameter("foo", 1)
+        # one pending write each for session.ini, the listing index and the dataset
+        writer = self.store.metadata_writer
+        self.assertEqual(3, len(writer))
+        self.assertTrue(writer.is_dirty(session.infofile))
+        self.assertTrue(writer.is_dirty(session.listing.filename))
+        self.assertTrue(writer.is_dirty(dataset._metadata_key))
+        self.assertEqual(1, self._saved_counter(session))
+
+        clock.advance(5.0)
+        self.assertEqual(0, len(self.store.metadata_writer))
+        self.assertEqual(2, self._saved_counter(session))
+
+    def test_counter_recovered_from_datasets(self):
+        clock = task.Clock()
+        self.store.metadata_writer = util.MetadataWriter(5.0, reactor=clock)
+        s1 = self._get_session()
+        s1.new_dataset(self._TITLE, self._INDEPENDENTS, self._DEPENDENTS)
+
+        # the counter was never written, as if the server had stopped
+        self.store.metadata_writer = util.MetadataWriter(5.0, reactor=clock)
+        s2 = self._get_session()
+        self.assertEqual(1, s2.counter)
+        # the directory is only indexed once a dataset is looked up or created
+        self.assertIsNone(s2._dataset_numbers)
+        dataset = s2.new_dataset("Bar", self._INDEPENDENTS, self._DEPENDENTS)
+        self.assertEqual("00002 - Bar", dataset.name)
+        dataset = s2.new_dataset("Baz", self._INDEPENDENTS, self._DEPENDENTS)
+        self.assertEqual("00003 - Baz", dataset.name)
+
     def test_add_new_tags(self):
         session1 = self._get_session()
         dataset1 = session1.new_dataset(
@@ -497,6 +564,30 @@ class DatasetTest(_DatavaultTestCase):
         self.assertEqual("user 1", retreived_comment[0][1])
         self.assertEqual("comment 1", retreived_comment[0][2])
 
+    def test_access_time_written_with_metadata(self):
+        clock = task.Clock()
+        self.session.writer = util.MetadataWriter(5.0, reactor=clock)
+        dataset = Dataset(
+            self.session,
+            "Foo Name",
+            title=self._TITLE,
+            create=True,
+            independents=self._INDEPENDENTS,
+            dependents=self._DEPENDENTS,
+        )
+        clock.advance(5.0)
+        created = dataset.data.dataset.attrs["Access Time"]
+        dataset.add_data(self._get_records_simple([(1, 2, 3)], dataset.data.dtype))
+
+        with mock.patch.object(backend, "time", return_value=created + 10):
+            dataset.access()
+        self.assertEqual(created, dataset.data.dataset.attrs["Access Time"])
+
+        clock.advance(5.0)
+        self.assertEqual(created + 10, dataset.data.dataset.attrs["Access Time"])
+        # buffered rows are left to the durability policy
+        self.assertEqual(1, len(dataset.data._buffer))
+
     def test_keep_streaming(self):
         dataset = Dataset(
             self.session,
@@ -507,6 +598,8 @@ class DatasetTest(_DatavaultTestCase):
             dependents=self._DEPENDENTS,
         )
 
+        # send every signal at once; batching is tested below
+        dataset.data_notifier.set_intervals(min_interval=0)
         data = self._get_records_simple([(1, 2, 3)], dataset.data.dtype)
 
         dataset.add_data(data)
@@ -524,6 +617,70 @@ class DatasetTest(_DatavaultTestCase):
         # Trigger the listener again.
         self.hub.onDataAvailable.assert_called_with(None, set([listener]))
 
+    def test_notifications_batched(self):
+        dataset = Dataset(
+            self.session,
+            "Foo Name",
+            title=self._TITLE,
+            create=True,
+            independents=self._INDEPENDENTS,
+            dependents=self._DEPENDENTS,
+        )
+        clock = task.Clock()
+        clock.advance(100)
+        dataset.data_notifier = util.NotifyBatcher(
+            dataset._send_data_available, 1.0, 0.5, reactor=clock
+        )
+        data = self._get_records_simple([(1, 2, 3)], dataset.data.dtype)
+
+        # the first signal goes out at once
+        dataset.listeners.update(["a", "b"])
+        dataset.add_data(data)
+        self.hub.onDataAvailable.assert_called_once_with(None, {"a", "b"})
+        self.hub.onNewRows.assert_called_once_with(1, {"a", "b"})
+        self.hub.reset_mock()
+
+        # later ones are held back, and readers that caught up are dropped
+        dataset.listeners.update(["a", "b"])
+        dataset.add_data(data)
+        dataset.listeners.add("d")
+        dataset.add_data(data)
+        dataset.keep_streaming("c", 0)
+        dataset.keep_streaming("b", 3)
+        self.hub.onDataAvailable.assert_not_called()
+        clock.advance(0.5)
+        self.hub.onDataAvailable.assert_called_once_with(None, {"a", "c", "d"})
+        self.hub.onNewRows.assert_called_once_with(3, {"a", "c", "d"})
+
+    def test_new_rows_signal_does_not_read_file(self):
+        dataset = Dataset(
+            self.session,
+            "Foo Name",
+            title=self._TITLE,
+            create=True,
+            independents=self._INDEPENDENTS,
+            dependents=self._DEPENDENTS,
+        )
+        data = self._get_records_simple([(1, 2, 3), (2, 3, 4)], dataset.data.dtype)
+        dataset.write_rows(data)
+        # the count is taken by the I/O call, not when the signal is sent
+        dataset.data = mock.MagicMock()
+        dataset.data.__len__.side_effect = AssertionError("file read")
+        dataset._send_data_available({"a"})
+        self.hub.onNewRows.assert_called_once_with(2, {"a"})
+
+    def test_notify_intervals_per_dataset(self):
+        clock = task.Clock()
+        first = util.NotifyBatcher(mock.Mock(), reactor=clock)
+        second = util.NotifyBatcher(mock.Mock(), reactor=clock)
+        self.assertGreater(first.min_interval, 0)
+        first.set_intervals(1.0, 0.25)
+        self.assertEqual((1.0, 0.25), (first.min_interval, first.max_latency))
+        self.assertEqual(
+            (util.NOTIFY_MIN_INTERVAL, util.NOTIFY_MAX_LATENCY),
+            (second.min_interval, second.max_latency),
+        )
+
 
 if __name__ == "__main__":
     pytest.main(["-v", "-s", __file__])
@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+import unittest
+
+from datavault import decimate
+
+
+class _Reader(object):
+    """Reads rows from an array, recording the rows read."""
+
+    def __init__(self, data):
+        self.data = data
+        self.rows_read = 0
+
+    def __call__(self, start, stop):
+        rows = self.data[start:stop]
+        self.rows_read += len(rows)
+        return rows
+
+
+class ReduceBinsTest(unittest.TestCase):
+    def test_matches_per_bin_reduction(self):
+        data = np.random.RandomState(0).normal(size=(1000, 3))
+        data[5, 1] = np.nan
+        edges = [3, 10, 400, 401, 999]
+        old_read_rows = decimate.READ_ROWS
+        decimate.READ_ROWS = 64
+        try:
+            mins, maxs = decimate.reduce_bins(_Reader(data), edges, 3)
+        finally:
+            decimate.READ_ROWS = old_read_rows
+        for i in range(len(edges) - 1):
+            rows = data[edges[i] : edges[i + 1]]
+            np.testing.assert_array_equal(np.nanmin(rows, axis=0), mins[i])
+            np.testing.assert_array_equal(np.nanmax(rows, axis=0), maxs[i])
+
+
+class EnvelopeTest(unittest.TestCase):
+    def setUp(self):
+        self.data = np.random.RandomState(1).normal(size=(512, 2))
+        self.read = _Reader(self.data)
+        self.envelope = decimate.Envelope(block_rows=8)
+
+    def test_small_range_returned_unchanged(self):
+        rows = self.envelope.get(self.read, 512, 2, 100, 10, 50)
+        np.testing.assert_array_equal(self.data[10:50], rows)
+
+    def test_envelope_of_aligned_bins(self):
+        rows = self.envelope.get(self.read, 512, 2, 16)
+        bins = self.data.reshape(8, 64, 2)
+        np.testing.assert_array_equal(bins.min(axis=1), rows[0::2])
+        np.testing.assert_array_equal(bins.max(axis=1), rows[1::2])
+
+    def test_unaligned_range(self):
+        for max_points in (10, 16, 40, 100):
+            rows = self.envelope.get(self.read, 512, 2, max_points, 3, 501)
+            self.assertLessEqual(len(rows), max_points)
+            np.testing.assert_array_equal(self.data[3:501].min(axis=0), rows.min(0))
+            np.testing.assert_array_equal(self.data[3:501].max(axis=0), rows.max(0))
+
+    def test_blocks_cached(self):
+        self.envelope.get(self.read, 256, 2, 8)
+        self.assertEqual(256, self.read.rows_read)
+        self.read.rows_read = 0
+        rows = self.envelope.get(self.read, 512, 2, 16)
+        self.assertEqual(256, self.read.rows_read)
+        np.testing.assert_array_equal(self.data.max(axis=0), rows.max(axis=0))
+
+
+if __name__ == "__main__":
+    pytest.main(["-v", __file__])
@@ -0,0 +1,114 @@
+import pytest
+import unittest
+
+from twisted.internet import task
+from twisted.internet.defer import DeferredLock
+
+from datavault import durability, errors, util
+
+
+class _Dataset(object):
+    """Stands in for a Dataset, recording when it is flushed."""
+
+    def __init__(self, clock, flushed):
+        self.clock = clock
+        self.flushed = flushed
+        self.io_lock = DeferredLock()
+        self.unflushed_rows = 0
+
+    def call_with_file(self, f, *args):
+        return f(*args)
+
+    def add(self, rows):
+        self.unflushed_rows += rows
+
+    def flush(self, sync=False):
+        self.flushed.append((self, self.clock.seconds()))
+        nbytes, self.unflushed_rows = 8 * self.unflushed_rows, 0
+        return nbytes
+
+
+class ParsePolicyTest(unittest.TestCase):
+    def test_parse(self):
+        self.assertEqual(("none", None), durability.parse_policy("none"))
+        self.assertEqual(("fsync", None), durability.parse_policy("fsync"))
+        self.assertEqual(("interval", 300), durability.parse_policy("interval"))
+        self.assertEqual(("interval", 2.5), durability.parse_policy("interval(2.5)"))
+        self.assertEqual(
+            ("every_k_rows", 10), durability.parse_policy(" every_k_rows( 10 ) ")
+        )
+
+    def test_format(self):
+        for policy in ["none", "fsync", "interval(300)", "every_k_rows(10)"]:
+            parsed = durability.parse_policy(policy)
+            self.assertEqual(policy, durability.format_policy(parsed))
+
+    def test_bad_policy(self):
+        for policy in ["sometimes", "fsync(2)", "interval(0)", "every_k_rows(1.5)"]:
+            with self.assertRaises(errors.BadDurabilityPolicyError):
+                durability.parse_policy(policy)
+
+
+class FlushSchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+        self.flusher = durability.FlushScheduler(
+            util.IOPool(0, reactor=self.clock), spacing=0.1, reactor=self.clock
+        )
+        self.flushed = []
+        self.datasets = [_Dataset(self.clock, self.flushed) for _ in range(3)]
+
+    def test_interval_flushes_spread_out(self):
+        policy = durability.parse_policy("interval(10)")
+        for dataset in self.datasets:
+            dataset.add(2)
+            self.flusher.rows_added(dataset, policy)
+        # later rows don't restart the interval
+        self.clock.advance(5)
+        self.flusher.rows_added(self.datasets[0], policy)
+        self.clock.advance(4.9)
+        self.assertEqual([], self.flushed)
+        self.clock.advance(0.1)
+        self.assertEqual(1, len(self.flushed))
+        self.clock.pump([0.1, 0.1])
+        times = [round(t, 6) for _, t in self.flushed]
+        self.assertEqual([10, 10.1, 10.2], times)
+        self.assertEqual(self.datasets, [dataset for dataset, _ in self.flushed])
+        self.assertEqual((3, 48), (self.flusher.flushes, self.flusher.bytes_written))
+
+    def test_due_together_spaced(self):
+        policy = durability.parse_policy("every_k_rows(2)")
+        for dataset in self.datasets:
+            dataset.add(2)
+            self.flusher.rows_added(dataset, policy)
+        self.clock.advance(0)
+        self.assertEqual(1, len(self.flushed))
+        self.clock.advance(0.1)
+        self.assertEqual(2, len(self.flushed))
+        self.clock.advance(0.1)
+        self.assertEqual(self.datasets, [dataset for dataset, _ in self.flushed])
+
+    def test_every_k_rows(self):
+        policy = durability.parse_policy("every_k_rows(5)")
+        dataset = self.datasets[0]
+        dataset.add(3)
+        self.flusher.rows_added(dataset, policy)
+        self.clock.advance(1)
+        self.assertEqual([], self.flushed)
+        dataset.add(3)
+        self.flusher.rows_added(dataset, policy)
+        self.clock.advance(0)
+        self.assertEqual(1, len(self.flushed))
+        self.assertEqual(48, self.flusher.bytes_written)
+
+    def test_none_and_stop(self):
+        self.flusher.rows_added(self.datasets[0], durability.parse_policy("none"))
+        self.flusher.rows_added(self.datasets[1], durability.parse_policy("interval"))
+        self.flusher.stop()
+        self.clock.advance(1000)
+        self.assertEqual([], self.flushed)
+        self.assertEqual([], self.clock.getDelayedCalls())
+
+
+if __name__ == "__main__":
+    pytest.main(["-v", __file__])
@@ -0,0 +1,94 @@
+import h5py
+import mock
+import os
+import pytest
+import shutil
+import tempfile
+import unittest
+
+from datavault import listing
+
+
+def _make_hdf5(filename, num_datasets):
+    with h5py.File(filename, "w") as f:
+        group = f.create_group("datasets")
+        for i in range(num_datasets):
+            group.create_dataset(str(i), data=[1.0, 2.0])
+
+
+class ListingIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix="dvtest_")
+        os.mkdir(os.path.join(self.dir, "child"))
+        open(os.path.join(self.dir, "session.ini"), "w").close()
+        open(os.path.join(self.dir, "00001 - csv.ini"), "w").close()
+        open(os.path.join(self.dir, "00001 - csv.csv"), "w").close()
+        _make_hdf5(os.path.join(self.dir, "00002 - single.hdf5"), 1)
+        _make_hdf5(os.path.join(self.dir, "multi.hdf5"), 2)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _contents(self, index):
+        dirs, datasets = index.contents()
+        return sorted(dirs), sorted(datasets)
+
+    def test_contents(self):
+        index = listing.ListingIndex(self.dir)
+        dirs, datasets = self._contents(index)
+        self.assertEqual(["child", "multi.hdf5"], dirs)
+        self.assertEqual(["00001 - csv.ini", "00002 - single.hdf5"], datasets)
+
+    def test_unchanged_files_not_reopened(self):
+        listing.ListingIndex(self.dir).contents()
+        with mock.patch.object(
+            listing,
+            "check_if_multiple_datasets",
+            wraps=listing.check_if_multiple_datasets,
+        ) as check:
+            # a fresh index is loaded from disk
+            index = listing.ListingIndex(self.dir)
+            first = self._contents(index)
+            self.assertEqual(0, check.call_count)
+
+            _make_hdf5(os.path.join(self.dir, "00002 - single.hdf5"), 3)
+            dirs, datasets = self._contents(index)
+            self.assertEqual(1, check.call_count)
+        self.assertEqual(["child", "multi.hdf5"], first[0])
+        self.assertEqual(["00002 - single.hdf5", "child", "multi.hdf5"], dirs)
+        self.assertEqual(["00001 - csv.ini"], datasets)
+
+    def test_new_and_removed_entries(self):
+        index = listing.ListingIndex(self.dir)
+        index.contents()
+        filename = "00003 - new.hdf5"
+        _make_hdf5(os.path.join(self.dir, filename), 1)
+        with mock.patch.object(listing, "check_if_multiple_datasets") as check:
+            index.add(filename, listing.DATASET)
+            os.remove(os.path.join(self.dir, "multi.hdf5"))
+            dirs, datasets = self._contents(index)
+            self.assertFalse(check.called)
+        self.assertEqual(["child"], dirs)
+        self.assertIn(filename, datasets)
+
+    def test_add_is_saved_by_next_listing(self):
+        index = listing.ListingIndex(self.dir)
+        index.contents()
+        filename = "00003 - new.hdf5"
+        _make_hdf5(os.path.join(self.dir, filename), 1)
+        index.add(filename, listing.DATASET)
+        self.assertNotIn(filename, listing.ListingIndex(self.dir)._entries)
+        index.contents()
+        self.assertIn(filename, listing.ListingIndex(self.dir)._entries)
+
+    def test_corrupt_index_is_rebuilt(self):
+        with open(os.path.join(self.dir, listing.LISTING_FILENAME), "w") as f:
+            f.write("{not json")
+        index = listing.ListingIndex(self.dir)
+        dirs, datasets = self._contents(index)
+        self.assertEqual(["child", "multi.hdf5"], dirs)
+        self.assertEqual(["00001 - csv.ini", "00002 - single.hdf5"], datasets)
+
+
+if __name__ == "__main__":
+    pytest.main(["-v", __file__])
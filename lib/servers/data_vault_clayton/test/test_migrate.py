@@ -0,0 +1,82 @@
+import numpy as np
+import os
+import pytest
+import shutil
+import tempfile
+import unittest
+
+from twisted.internet import task
+
+from datavault import backend, migrate
+
+_INDEPENDENTS = [backend.Independent("Time", (1,), "v", "s")]
+_DEPENDENTS = [backend.Dependent("Counts", "PMT", (1,), "v", "")]
+
+
+class MigrateTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp(prefix="dvtest_")
+        self.base = os.path.join(self.dir, "00001 - Scan")
+        self.clock = task.Clock()
+        data = backend.CsvNumpyData(self.base + ".csv", reactor=self.clock)
+        data.initialize_info("Scan", _INDEPENDENTS, _DEPENDENTS)
+        data.add_param("Frequency", 1.5)
+        data.add_comment("user", "looks good")
+        rows = np.core.records.fromarrays(
+            [np.arange(4.0), np.array([10.0, 11.5, np.nan, 13.0])], dtype=data.dtype
+        )
+        data.add_data(rows)
+        data.save()
+        data._file.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_migrate_dataset(self):
+        hdf5_file = migrate.migrate_dataset(self.base + ".csv")
+        self.assertEqual(self.base + ".hdf5", hdf5_file)
+        self.assertEqual([], migrate.find_csv_datasets(self.dir))
+
+        data = backend.open_backend(self.base)
+        self.assertIsInstance(data, backend.ExtendedHDF5Data)
+        self.assertEqual("Scan", data.dataset.attrs["Title"])
+        self.assertEqual(1.5, data.get_parameter("Frequency"))
+        comments, _ = data.get_comments(None, 0)
+        self.assertEqual("looks good", comments[0][2])
+        rows, _ = data.get_data(None, 0, False, None)
+        self.assertEqual(4, len(rows))
+        self.assertEqual(11.5, rows[1][1])
+        data._file.close()
+
+    def test_csv_changed_after_migration(self):
+        migrate.migrate_dataset(self.base + ".csv")
+        with open(self.base + ".csv", "a") as f:
+            f.write("4,14\r\n")
+        self.assertIsInstance(backend.open_backend(self.base), backend.CsvNumpyData)
+        self.assertEqual([self.base + ".csv"], migrate.find_csv_datasets(self.dir))
+
+        # migrating again replaces the stale file
+        migrate.migrate_dataset(self.base + ".csv")
+        data = backend.open_backend(self.base)
+        self.assertEqual(5, len(data))
+        data._file.close()
+
+    def test_unrelated_hdf5_file_kept(self):
+        backend.create_backend(self.base, "Other", _INDEPENDENTS, _DEPENDENTS, True)
+        with self.assertRaises(migrate.MigrationError):
+            migrate.migrate_dataset(self.base + ".csv")
+
+    def test_migration_in_pool(self):
+        migration = migrate.Migration(workers=1, root=self.dir)
+        migration.run()
+        self.assertEqual(
+            (1, 1, []), (migration.total, migration.done, migration.failed)
+        )
+        self.assertFalse(migration.running)
+        self.assertTrue(
+            backend.migrated_from_csv(self.base + ".hdf5", self.base + ".csv")
+        )
+
+
+if __name__ == "__main__":
+    pytest.main(["-v", __file__])
@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+import unittest
+
+from datavault import rangeindex
+
+
+class _Reader(object):
+    """Reads rows from an array, recording the rows read."""
+
+    def __init__(self, data):
+        self.data = data
+        self.rows_read = 0
+
+    def __call__(self, start, stop):
+        rows = self.data[start:stop]
+        self.rows_read += len(rows)
+        return rows
+
+
+class ColumnIndexTest(unittest.TestCase):
+    def _index(self, data):
+        read = _Reader(data)
+        index = rangeindex.ColumnIndex(0, block_rows=10)
+        index.update(read, len(data))
+        read.rows_read = 0
+        return index, read
+
+    def _expected(self, data, lo, hi):
+        return data[(data[:, 0] >= lo) & (data[:, 0] <= hi)]
+
+    def test_monotonic_column(self):
+        # 105 rows: 10 indexed blocks and 5 rows that are not indexed yet
+        data = np.column_stack((np.arange(105.0), np.arange(105.0) ** 2))
+        index, read = self._index(data)
+        self.assertTrue(index.is_monotonic())
+        # the rows after the last block are always read
+        self.assertEqual([(40, 60), (100, 105)], index.spans(42, 55, len(data)))
+
+        rows = index.get_range(read, len(data), 42, 55)
+        np.testing.assert_array_equal(self._expected(data, 42, 55), rows)
+        self.assertEqual(25, read.rows_read)
+
+        rows = index.get_range(read, len(data), 98, 200)
+        np.testing.assert_array_equal(data[98:], rows)
+
+    def test_unsorted_column(self):
+        values = np.concatenate((np.arange(50.0), np.arange(50.0)[::-1]))
+        data = np.column_stack((values, np.arange(100.0)))
+        index, read = self._index(data)
+        self.assertFalse(index.is_monotonic())
+        self.assertEqual([(0, 10), (90, 100)], index.spans(3, 7, len(data)))
+        rows = index.get_range(read, len(data), 3, 7)
+        np.testing.assert_array_equal(self._expected(data, 3, 7), rows)
+        self.assertEqual(20, read.rows_read)
+
+    def test_no_match(self):
+        data = np.column_stack((np.arange(30.0), np.zeros(30)))
+        index, read = self._index(data)
+        rows = index.get_range(read, len(data), 100, 200)
+        self.assertEqual((0, 2), rows.shape)
+        self.assertEqual(0, read.rows_read)
+
+    def test_update_indexes_new_blocks_only(self):
+        data = np.column_stack((np.arange(40.0), np.zeros(40)))
+        read = _Reader(data)
+        index = rangeindex.ColumnIndex(0, block_rows=10)
+        self.assertTrue(index.update(read, 25))
+        self.assertEqual(20, read.rows_read)
+        self.assertFalse(index.update(read, 29))
+        self.assertTrue(index.update(read, 40))
+        self.assertEqual(40, read.rows_read)
+        self.assertEqual(4, len(index.blocks))
+
+
+if __name__ == "__main__":
+    pytest.main(["-v", __file__])
@@ -6,6 +6,7 @@ import tempfile
 import unittest
 
 from twisted.internet import reactor, task
+from twisted.python.failure import Failure
 
 from labrad.server import LabradServer, Signal, setting
 from labrad import server
@@ -339,5 +340,198 @@ class DataVaultTest(unittest.TestCase):
         )
 
 
+def _result(d):
+    """Get the result of a Deferred that has already fired."""
+    results = []
+    d.addBoth(results.append)
+    assert results, "Deferred has not fired"
+    if isinstance(results[0], Failure):
+        results[0].raiseException()
+    return results[0]
+
+
+class DataVaultIOTest(unittest.TestCase):
+    """Tests for data settings running through the I/O pool."""
+
+    def setUp(self):
+        self.datadir = _unique_dir_name()
+        self.hub = mock.MagicMock()
+        self.store = SessionStore(
+            self.datadir, self.hub, use_virtual_session=False, io_threads=0
+        )
+        self.datavault = server.DataVault(self.store)
+        self.writer = MockContext("writer")
+        self.reader = MockContext("reader")
+        self.datavault.initContext(self.writer)
+        self.datavault.initContext(self.reader)
+        # both contexts work in the same session
+        self.reader["session"] = self.writer["session"]
+
+    def tearDown(self):
+        self.store.flusher.stop()
+        self.datavault._close_all_datasets(None)
+        _empty_and_remove_dir(self.datadir)
+
+    def test_add_and_get(self):
+        self.datavault.new(self.writer, "foo", [("x", "ms")], [("y", "E", "eV")])
+        _result(self.datavault.add(self.writer, [(0.1, 0.2), (0.3, 0.4)]))
+        data = _result(self.datavault.get(self.writer, limit=1))
+        self.assertEqual([[0.1, 0.2]], data.tolist())
+        data = _result(self.datavault.get(self.writer))
+        self.assertEqual([[0.3, 0.4]], data.tolist())
+
+    def test_reader_notified_after_add(self):
+        _, name = self.datavault.new(
+            self.writer, "foo", [("x", "ms")], [("y", "E", "eV")]
+        )
+        self.datavault.open(self.reader, name)
+        # reading to the end subscribes the reader to new data
+        self.assertEqual(0, _result(self.datavault.get(self.reader)).size)
+        self.hub.onDataAvailable.reset_mock()
+
+        _result(self.datavault.add(self.writer, [(0.1, 0.2)]))
+        self.hub.onDataAvailable.assert_called_once_with(None, {"reader"})
+        data = _result(self.datavault.get(self.reader))
+        self.assertEqual([[0.1, 0.2]], data.tolist())
+
+    def test_get_decimated(self):
+        self.datavault.new(self.writer, "foo", [("x", "ms")], [("y", "E", "eV")])
+        x = np.arange(100.0)
+        _result(self.datavault.add(self.writer, np.column_stack((x, np.sin(x)))))
+        data = _result(self.datavault.get_decimated(self.writer, 10))
+        self.assertEqual((10, 2), data.shape)
+        self.assertEqual(0.0, data[0, 0])
+        self.assertEqual(99.0, data[-1, 0])
+        self.assertEqual(np.sin(x).max(), data[:, 1].max())
+        # the position used by get is unchanged
+        self.assertEqual(100, len(_result(self.datavault.get(self.writer))))
+
+    def test_get_range(self):
+        self.datavault.new(self.writer, "foo", [("t", "s")], [("y", "E", "eV")])
+        t = np.arange(10000.0)
+        _result(self.datavault.add(self.writer, np.column_stack((t, -t))))
+        data = _result(self.datavault.get_range(self.writer, 0, 1200, 1300))
+        self.assertEqual(list(range(1200, 1301)), data[:, 0].tolist())
+        data = _result(self.datavault.get_range(self.writer, 1, -5, -3))
+        self.assertEqual([[3.0, -3.0], [4.0, -4.0], [5.0, -5.0]], data.tolist())
+        d = self.datavault.get_range(self.writer, 2, 0, 1)
+        self.assertRaises(errors.BadColumnError, _result, d)
+
+        # the index is kept in the file
+        index = self.writer["datasetObj"].data.load_column_index(0)
+        self.assertEqual(2, len(index.blocks))
+        self.assertTrue(index.is_monotonic())
+
+    def test_search(self):
+        self.datavault.new(self.writer, "Rabi", [("t", "s")], [("y", "E", "eV")])
+        self.datavault.update_tags(self.writer, "good", [])
+        _result(self.datavault.add(self.writer, [(0.0, 1.0), (1.0, 2.0)]))
+        self.datavault._save_all_datasets()
+        self.assertEqual(
+            [([""], "00001 - Rabi")],
+            self.datavault.search(self.writer, "rabi tag:good"),
+        )
+        self.assertEqual([], self.datavault.search(self.writer, "ramsey"))
+        ((rows, cols),) = self.store.catalog._db.execute(
+            "SELECT rows, cols FROM datasets"
+        )
+        self.assertEqual((2, 2), (rows, cols))
+        self.assertRaises(
+            errors.BadQueryError, self.datavault.search, self.writer, "before:now"
+        )
+
+    def test_finalize(self):
+        self.datavault.new(self.writer, "foo", [("t", "s")], [("y", "E", "eV")])
+        _result(self.datavault.add(self.writer, [(0.0, 1.0), (1.0, 2.0)]))
+        self.datavault.add_parameter(self.writer, "Power", 2.0)
+        self.assertTrue(_result(self.datavault.finalize(self.writer)))
+        self.assertFalse(_result(self.datavault.finalize(self.writer)))
+        data = _result(self.datavault.get(self.writer, start_over=True))
+        self.assertEqual([[0.0, 1.0], [1.0, 2.0]], data.tolist())
+        self.assertEqual(2.0, self.datavault.get_parameter(self.writer, "Power"))
+        d = self.datavault.add(self.writer, [(2.0, 3.0)])
+        self.assertRaises(errors.FinalizedError, _result, d)
+
+    def test_durability(self):
+        self.datavault.new(self.writer, "foo", [("t", "s")], [("y", "E", "eV")])
+        self.assertEqual(
+            "interval(300)", self.datavault.durability_setting(self.writer)
+        )
+        self.assertEqual(
+            "fsync", self.datavault.durability_setting(self.writer, "fsync")
+        )
+        _result(self.datavault.add(self.writer, [(0.0, 1.0), (1.0, 2.0)]))
+        flushes, nbytes, mean, worst = self.datavault.durability_stats(self.writer)
+        self.assertEqual((1, 32), (flushes, nbytes))
+        self.assertTrue(0 <= mean <= worst)
+        # the rows are on disk, not only in the append buffer
+        dataset = self.datavault.get_dataset(self.writer)
+        self.assertEqual(0, len(dataset.data._buffer))
+
+        self.datavault.default_durability(self.writer, "none")
+        self.assertEqual("none", self.datavault.durability_setting(self.writer, ""))
+        _result(self.datavault.add(self.writer, [(2.0, 3.0)]))
+        self.assertEqual(1, self.datavault.durability_stats(self.writer)[0])
+        self.assertRaises(
+            errors.BadDurabilityPolicyError,
+            self.datavault.default_durability,
+            self.writer,
+            "sometimes",
+        )
+
+    def test_errors_returned_through_deferred(self):
+        self.datavault.new_ex(
+            self.writer, "foo", [("x", [2], "v", "")], [("y", "E", [1], "i", "")]
+        )
+        _result(self.datavault.add_ex(self.writer, [([0.1, 0.2], 3)]))
+        d = self.datavault.get(self.writer, start_over=True)
+        self.assertRaises(errors.DataVersionMismatchError, _result, d)
+
+
+class SharedSessionStoreTest(unittest.TestCase):
+    """Tests for several servers sharing one session store, as in multi-head mode."""
+
+    def setUp(self):
+        self.datadir = _unique_dir_name()
+        self.store = SessionStore(
+            self.datadir, mock.MagicMock(), use_virtual_session=False, io_threads=0
+        )
+        # no background saves or catalog crawls
+        for name in ("LoopingCall", "threads"):
+            patcher = mock.patch.object(server, name)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.store.catalog.close()
+        _empty_and_remove_dir(self.datadir)
+
+    def test_store_has_no_side_effects(self):
+        self.assertFalse(os.path.exists(self.datadir))
+        self.assertIsNone(self.store.catalog._connection)
+
+    def test_stopping_one_server_keeps_store_open(self):
+        first, second = server.DataVault(self.store), server.DataVault(self.store)
+        first.initServer()
+        second.initServer()
+        c = MockContext()
+        second.initContext(c)
+        second.new(c, "foo", [("x", "ms")], [("y", "E", "eV")])
+        _result(second.add(c, [(0.1, 0.2)]))
+
+        first.stopServer()
+        first.stopServer()
+        self.assertEqual(1, self.store.owners)
+        _result(second.add(c, [(0.3, 0.4)]))
+        self.assertEqual([[0.1, 0.2], [0.3, 0.4]], _result(second.get(c)).tolist())
+        self.assertEqual(1, len(second.search(c, "foo")))
+
+        second.stopServer()
+        self.assertEqual(0, self.store.owners)
+        self.assertIsNone(self.store.catalog._connection)
+        # the catalog opens again for the next server
+        self.assertEqual(1, len(self.store.search("foo")))
+
+
 if __name__ == "__main__":
     pytest.main(["-v", __file__])
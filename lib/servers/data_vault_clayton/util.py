@@ -2,8 +2,27 @@
 Contains utilities used by the data vault server.
 """
 
+import os
+import threading
+from contextlib import contextmanager
+
 import numpy as np
+from numpy.lib import recfunctions
 import configparser as cp
+from twisted.internet import defer, reactor, threads
+from twisted.python.threadpool import ThreadPool
+
+# seconds between coalesced writes of session.ini and dataset metadata
+METADATA_SAVE_INTERVAL = 5.0
+# threads reading and writing dataset files; 0 runs file I/O on the reactor thread
+IO_THREADS = 4
+# shortest time between data-available signals of one dataset; 0 sends every signal at once
+NOTIFY_MIN_INTERVAL = 0.05
+# longest time a data-available signal is held back
+NOTIFY_MAX_LATENCY = 0.5
+
+# marks threads of an IOPool
+_io_thread = threading.local()
 
 
 class DVSafeConfigParser(cp.SafeConfigParser):
@@ -50,7 +69,10 @@ def from_record_array(data):
 
     The records must be homogeneous.
     """
-    return np.vstack([np.array(tuple(row)) for row in data])
+    data = np.asarray(data)
+    if data.dtype.names is None:
+        return np.atleast_2d(data)
+    return recfunctions.structured_to_unstructured(data).reshape(len(data), -1)
 
 
 def braced(s):
@@ -58,3 +80,286 @@ def braced(s):
     Wrap the given string in braces, which is awkward with str.format
     """
     return "{" + s + "}"
+
+
+@contextmanager
+def atomic_write(filename):
+    """
+    Open a file for writing that replaces the given file only once it is complete.
+
+    The contents are written to a temporary file in the same directory, which
+    is renamed over the target when the block exits without an error, so that
+    readers never see a partially written file.
+    """
+    tmpname = "{}.{}.tmp".format(filename, os.getpid())
+    try:
+        with open(tmpname, "w") as f:
+            yield f
+        os.replace(tmpname, filename)
+    finally:
+        if os.path.exists(tmpname):
+            os.remove(tmpname)
+
+
+class MetadataWriter(object):
+    """
+    Coalesces metadata saves into one write per interval.
+
+    Callers mark a file as dirty along with the function that saves it. All
+    dirty files are saved together once the interval has passed since the
+    first of them was marked, or when flush is called. Marking a file again
+    before it is saved only replaces its save function.
+    """
+
+    def __init__(self, interval=METADATA_SAVE_INTERVAL, reactor=reactor):
+        self.interval = interval
+        self.reactor = reactor
+        self._pending = {}
+        self._flush_call = None
+
+    def mark(self, key, save):
+        """
+        Schedule a save.
+        Arguments:
+            key:    identifies the file to save, usually its path.
+            save:   (callable) writes the file when called without arguments.
+        """
+        self._pending[key] = save
+        if self.interval <= 0:
+            self.flush()
+        elif self._flush_call is None:
+            self._flush_call = self.reactor.callLater(self.interval, self._on_interval)
+
+    def _on_interval(self):
+        self._flush_call = None
+        self.flush()
+
+    def is_dirty(self, key):
+        return key in self._pending
+
+    def flush(self, key=None):
+        """
+        Save the given file now, or all pending files if no key is given.
+        """
+        if key is not None:
+            save = self._pending.pop(key, None)
+            if save is not None:
+                save()
+            return
+
+        if self._flush_call is not None:
+            self._flush_call.cancel()
+            self._flush_call = None
+        pending, self._pending = self._pending, {}
+        # save everything we can before reporting the first failure
+        error = None
+        for save in pending.values():
+            try:
+                save()
+            except Exception as e:
+                error = error or e
+        if error is not None:
+            raise error
+
+    def __len__(self):
+        return len(self._pending)
+
+
+class NotifyBatcher(object):
+    """
+    Rate-limits the signals sent to the listeners of one dataset.
+
+    The first signal after a quiet period is sent at once. Contexts notified
+    less than min_interval after the last signal are collected and sent one
+    signal together once the interval has passed, but no later than
+    max_latency after the first of them was collected.
+    """
+
+    def __init__(
+        self,
+        send,
+        min_interval=NOTIFY_MIN_INTERVAL,
+        max_latency=NOTIFY_MAX_LATENCY,
+        reactor=reactor,
+    ):
+        self.send = send
+        self.min_interval = min_interval
+        self.max_latency = max_latency
+        self.reactor = reactor
+        self._pending = set()
+        self._last_sent = None
+        self._call = None
+
+    def set_intervals(self, min_interval=None, max_latency=None):
+        """
+        Change the intervals; a batch already scheduled is sent as planned.
+        """
+        if min_interval is not None:
+            self.min_interval = min_interval
+        if max_latency is not None:
+            self.max_latency = max_latency
+
+    def notify(self, contexts):
+        """
+        Send a signal to the given contexts, now or in the next batch.
+        """
+        if not contexts:
+            return
+        now = self.reactor.seconds()
+        if self._call is None:
+            if (self._last_sent is None) or (
+                now >= self._last_sent + self.min_interval
+            ):
+                self._send(contexts)
+                return
+            due = min(self._last_sent + self.min_interval, now + self.max_latency)
+            self._call = self.reactor.callLater(due - now, self.flush)
+        self._pending.update(contexts)
+
+    def discard(self, context):
+        """
+        Drop a context from the next batch, e.g. because it has read the new data.
+        """
+        self._pending.discard(context)
+
+    def flush(self):
+        """
+        Send the pending batch now.
+        """
+        if (self._call is not None) and self._call.active():
+            self._call.cancel()
+        self._call = None
+        contexts, self._pending = self._pending, set()
+        if contexts:
+            self._send(contexts)
+
+    def _send(self, contexts):
+        self._last_sent = self.reactor.seconds()
+        self.send(contexts)
+
+
+def in_io_thread():
+    """
+    Check whether the calling thread belongs to an IOPool.
+    """
+    return getattr(_io_thread, "active", False)
+
+
+def call_in_reactor(reactor, f, *args):
+    """
+    Call f on the reactor thread.
+    From the reactor thread f is called immediately, from an I/O thread
+    it is queued for the reactor in the order of the calls.
+    """
+    if in_io_thread():
+        reactor.callFromThread(f, *args)
+    else:
+        f(*args)
+
+
+class Timeout(object):
+    """
+    Calls a function once a delay has passed without the timeout being reset.
+
+    The timeout may be started, reset and cancelled from I/O threads, but the
+    underlying reactor call is only ever touched on the reactor thread. If a lock
+    is given, the function is only called if the lock can be taken without
+    waiting; otherwise the timeout starts over.
+    """
+
+    def __init__(self, delay, f, lock=None, reactor=reactor):
+        self.delay = delay
+        self.f = f
+        self.lock = lock
+        self.reactor = reactor
+        self._call = None
+
+    def start(self):
+        """
+        Start the timeout if it is not already running.
+        """
+        call_in_reactor(self.reactor, self._start)
+
+    def reset(self):
+        """
+        Start the timeout, or restart it if it is already running.
+        """
+        call_in_reactor(self.reactor, self._reset)
+
+    def cancel(self):
+        call_in_reactor(self.reactor, self._cancel)
+
+    def _active(self):
+        return (self._call is not None) and self._call.active()
+
+    def _start(self):
+        if not self._active():
+            self._call = self.reactor.callLater(self.delay, self._fire)
+
+    def _reset(self):
+        if self._active():
+            self._call.reset(self.delay)
+        else:
+            self._call = self.reactor.callLater(self.delay, self._fire)
+
+    def _cancel(self):
+        if self._active():
+            self._call.cancel()
+        self._call = None
+
+    def _fire(self):
+        self._call = None
+        if self.lock is None:
+            self.f()
+        elif self.lock.acquire(False):
+            try:
+                self.f()
+            finally:
+                self.lock.release()
+        else:
+            # still in use by an I/O thread
+            self._start()
+
+
+def _call_in_io_thread(f, *args, **kw):
+    _io_thread.active = True
+    return f(*args, **kw)
+
+
+class IOPool(object):
+    """
+    Bounded pool of threads for blocking dataset file I/O.
+
+    Calls return Deferreds that fire on the reactor thread. The pool makes no
+    ordering guarantees between calls; callers that need them, such as the
+    appends and reads of one dataset, serialize their calls with a DeferredLock.
+    With max_threads=0 calls are run synchronously on the calling thread.
+    """
+
+    def __init__(self, max_threads=IO_THREADS, reactor=reactor):
+        self.max_threads = max_threads
+        self.reactor = reactor
+        self._pool = None
+
+    def run(self, f, *args, **kw):
+        """
+        Call f(*args, **kw) in the pool.
+        Returns:
+            Deferred: fires with the result of f.
+        """
+        if self.max_threads <= 0:
+            return defer.maybeDeferred(f, *args, **kw)
+        if self._pool is None:
+            self._pool = ThreadPool(0, self.max_threads, "datavault-io")
+            self._pool.start()
+        return threads.deferToThreadPool(
+            self.reactor, self._pool, _call_in_io_thread, f, *args, **kw
+        )
+
+    def stop(self):
+        """
+        Wait for queued calls to finish and stop the threads.
+        """
+        if self._pool is not None:
+            self._pool.stop()
+            self._pool = None
@@ -42,8 +42,9 @@ import sys
 from datetime import datetime
 
 from errors import *
-from dataset import Dataset, Image
+from dataset import Dataset, ImageStore
 from globals import Globals
+from registry_import import RegistryImport
 import helpers
 
 # TODO: tagging
@@ -365,6 +366,7 @@ class DataVault(LabradServer):
         # create root session
         # root = Session([''], self)
         self.root = Session([""], self)
+        self.registry_import = RegistryImport(self.client)
 
     def initContext(self, c):
         # start in the root session
@@ -619,18 +621,64 @@ class DataVault(LabradServer):
         dataset.keep_streaming(c.ID, c["filepos"])
         return data
 
-    # Add in saving camera images as a .npy with the dataset
+    # Add in saving camera images with the dataset
 
     @setting(22, data="*i", image_size="*i", repetitions="i", filename="s", returns="")
     def save_image(self, c, data, image_size, repetitions, filename):
         """
-        Save a CCD image of the open dataest to a .npy file
+        Save a CCD image of the open dataest to an image store.
+
+        Large images are better sent with save_image_raw, which avoids
+        converting the pixels to and from a list of integers.
+        """
+        session = self.get_session(c)
+        x_pixels, y_pixels = image_size
+        data = numpy.reshape(
+            numpy.asarray(data, dtype="<i4"), (repetitions, y_pixels, x_pixels)
+        )
+        ImageStore(session, filename).add_frames(data)
+
+    @setting(
+        23,
+        "save image raw",
+        data="y",
+        image_size="*i",
+        repetitions="i",
+        filename="s",
+        dtype="s",
+        returns="",
+    )
+    def save_image_raw(self, c, data, image_size, repetitions, filename, dtype="<i4"):
+        """
+        Save CCD images given as the raw bytes of their pixels.
+
+        dtype is the numpy type of the pixels, e.g. '<u2' for 16 bit cameras.
+        Pixels must fit in a 32 bit signed integer, so that get_image can
+        return them.
         """
         session = self.get_session(c)
+        dtype = numpy.dtype(dtype)
+        if not numpy.can_cast(dtype, numpy.int32):
+            raise BadImageTypeError(dtype)
         x_pixels, y_pixels = image_size
-        data = numpy.reshape(data, (repetitions, y_pixels, x_pixels))
-        image = Image(session, filename)
-        image.add_data(data)
+        data = numpy.frombuffer(data, dtype).reshape((repetitions, y_pixels, x_pixels))
+        ImageStore(session, filename).add_frames(data)
+
+    @setting(24, "get image", filename="s", frame="w", returns="*2i")
+    def get_image(self, c, filename, frame):
+        """Get one frame of an image saved in the current directory."""
+        session = self.get_session(c)
+        frames = ImageStore(session, filename).get_frames(frame, frame + 1)
+        return frames[0].astype("<i4")
+
+    @setting(25, "get image range", filename="s", start="w", stop="w", returns="*3i")
+    def get_image_range(self, c, filename, start=0, stop=None):
+        """Get frames start to stop (exclusive, default all) of an image.
+
+        The frames must all have the same size.
+        """
+        session = self.get_session(c)
+        return ImageStore(session, filename).get_frames(start, stop).astype("<i4")
 
     @setting(100, returns="(*(ss){independents}, *(sss){dependents})")
     def variables(self, c):
@@ -682,44 +730,6 @@ class DataVault(LabradServer):
         if len(params):
             return params
 
-    @inlineCallbacks
-    def read_pars_int(self, c, ctx, dataset, curdirs, subdirs=None):
-        p = self.client.registry.packet(context=ctx)
-        todo = []
-        for curdir, curcontent in curdirs:
-            if len(curdir) > 0:
-                p.cd(curdir)
-            for key in curcontent[1]:
-                p.get(key, key=(False, tuple(curdir + [key])))
-            if subdirs is not None:
-                if isinstance(subdirs, list):
-                    for folder in curcontent[0]:
-                        if folder in subdirs:
-                            p.cd(folder)
-                            p.dir(key=(True, tuple(curdir + [folder])))
-                            p.cd(1)
-                elif subdirs != 0:
-                    for folder in curcontent[0]:
-                        p.cd(folder)
-                        p.dir(key=(True, tuple(curdir + [folder])))
-                        p.cd(1)
-            if len(curdir) > 0:
-                p.cd(len(curdir))
-        ans = yield p.send()
-        if isinstance(subdirs, list):
-            subdirs = -1
-        else:
-            if (subdirs is not None) and (subdirs > 0):
-                subdirs -= 1
-        for key in sorted(ans.settings.keys()):
-            item = ans[key]
-            if isinstance(key, tuple):
-                if key[0]:
-                    curdirs = [(list(key[1]), item)]
-                    yield self.read_pars_int(c, ctx, dataset, curdirs, subdirs)
-                else:
-                    dataset.add_parameter(" -> ".join(key[1]), item, save_now=False)
-
     @setting(
         125,
         "import parameters",
@@ -734,16 +744,11 @@ class DataVault(LabradServer):
         """Reads all entries from the current registry directory, optionally
         including subdirectories, as parameters into the current dataset."""
         dataset = self.get_dataset(c)
-        ctx = self.client.context()
-        p = self.client.registry.packet(context=ctx)
-        p.duplicate_context(c.ID)
-        p.dir()
-        ans = yield p.send()
-        curdirs = [([], ans.dir)]
         if subdirs == 0:
             subdirs = -1
-        yield self.read_pars_int(c, ctx, dataset, curdirs, subdirs)
-        dataset.save()  # make sure the new parameters get saved
+        params = yield self.registry_import.read(c.ID, subdirs)
+        # add them all at once, so the ini file is written once
+        dataset.add_parameters(params)
 
     @setting(126, "add parameter over write", name="s", returns="")
     def add_parameter_over_write(self, c, name, data):
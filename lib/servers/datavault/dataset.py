@@ -1,4 +1,5 @@
 import os
+import struct
 from datetime import datetime
 from configparser import ConfigParser as SafeConfigParser
 
@@ -18,17 +19,236 @@ except ImportError:
     useNumpy = False
 
 
-class Image(object):
+# one record per frame in an image index: offset in the frames file, shape, pixel type
+_FRAME_INDEX_DTYPE = [
+    ("offset", "<i8"),
+    ("rows", "<i4"),
+    ("cols", "<i4"),
+    ("dtype", "S4"),
+]
+
+
+class ImageStore(object):
+    """Frames of camera images saved next to the datasets of a session.
+
+    The pixels of each frame are stored back to back in <name>.frames, and
+    <name>.frames.idx holds one record per frame with its offset, shape and
+    pixel type, so any frame is read with one memory map instead of parsing
+    all the frames before it. Images saved as concatenated numpy records in
+    <name>.npy by earlier versions are still read, and are copied into the
+    store the first time frames are added to it.
+    """
+
     def __init__(self, session, filename):
         """
         session.dir is the dataset number to which this image should be attached
         """
-        self.filename = os.path.join(session.dir, filename + ".npy")
+        base = os.path.join(session.dir, filename)
+        self.name = filename
+        self.filename = base + ".frames"
+        self.indexfile = self.filename + ".idx"
+        self.legacyfile = base + ".npy"
+
+    def _index(self):
+        dtype = numpy.dtype(_FRAME_INDEX_DTYPE)
+        try:
+            count = os.path.getsize(self.indexfile) // dtype.itemsize
+        except OSError:
+            return numpy.zeros(0, dtype)
+        # a partly written record at the end is ignored, and overwritten next time
+        return numpy.fromfile(self.indexfile, dtype, count)
+
+    def _legacy_frames(self):
+        frames = []
+        with open(self.legacyfile, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            while f.tell() < size:
+                data = numpy.load(f)
+                frames.extend(data.reshape((-1,) + data.shape[-2:]))
+        return frames
+
+    def __len__(self):
+        if not os.path.exists(self.indexfile) and os.path.exists(self.legacyfile):
+            return len(self._legacy_frames())
+        return len(self._index())
+
+    def add_frames(self, data):
+        """Append frames, given as a (frames, rows, cols) or (rows, cols) array."""
+        data = numpy.ascontiguousarray(data)
+        data = data.reshape((-1,) + data.shape[-2:])
+        if not os.path.exists(self.indexfile) and os.path.exists(self.legacyfile):
+            for frame in self._legacy_frames():
+                self._append(frame[numpy.newaxis])
+        self._append(data)
+
+    def _append(self, data):
+        index = self._index()
+        offset = 0
+        if len(index):
+            last = index[-1]
+            offset = int(last["offset"]) + int(last["rows"]) * int(last["cols"]) * (
+                numpy.dtype(last["dtype"].decode()).itemsize
+            )
+        frame_bytes = data[0].nbytes if len(data) else 0
+        records = numpy.zeros(len(data), numpy.dtype(_FRAME_INDEX_DTYPE))
+        records["offset"] = offset + frame_bytes * numpy.arange(len(data))
+        records["rows"], records["cols"] = data.shape[1:]
+        records["dtype"] = data.dtype.str
+        # the frames are written before the index records, so the index never
+        # refers to frames that are missing
+        mode = "r+b" if os.path.exists(self.filename) else "wb"
+        with open(self.filename, mode) as f:
+            f.seek(offset)
+            f.write(data.tobytes())
+        mode = "r+b" if os.path.exists(self.indexfile) else "wb"
+        with open(self.indexfile, mode) as f:
+            f.seek(len(index) * records.dtype.itemsize)
+            f.write(records.tobytes())
+
+    def _check_range(self, start, stop, count):
+        if not 0 <= start < stop <= count:
+            raise BadImageError(self.name, start, stop, count)
+
+    def _check_layouts(self, start, layouts):
+        """Check that frames, given as (rows, cols, pixel type), are all alike."""
+        for i, layout in enumerate(layouts):
+            if layout != layouts[0]:
+                raise ImageShapeError(self.name, start, layouts[0], start + i, layout)
+
+    def get_frames(self, start, stop=None):
+        """Get frames start to stop (exclusive) as a (frames, rows, cols) array."""
+        if not os.path.exists(self.indexfile) and os.path.exists(self.legacyfile):
+            frames = self._legacy_frames()
+            if stop is None:
+                stop = len(frames)
+            self._check_range(start, stop, len(frames))
+            frames = frames[start:stop]
+            self._check_layouts(
+                start, [frame.shape + (frame.dtype.str,) for frame in frames]
+            )
+            return numpy.array(frames)
+        index = self._index()
+        if stop is None:
+            stop = len(index)
+        self._check_range(start, stop, len(index))
+        records = index[start:stop]
+        layouts = [
+            (int(rows), int(cols), dtype.decode())
+            for rows, cols, dtype in zip(
+                records["rows"], records["cols"], records["dtype"]
+            )
+        ]
+        self._check_layouts(start, layouts)
+        rows, cols, dtype = layouts[0]
+        # frames are stored back to back, so frames of one shape map as one array
+        frames = numpy.memmap(
+            self.filename,
+            numpy.dtype(dtype),
+            "r",
+            int(records["offset"][0]),
+            (len(records), rows, cols),
+        )
+        return numpy.array(frames)
 
-    def add_data(self, data):
-        fi = open(self.filename, "ab")
-        numpy.save(fi, data)
-        fi.close()
+
+def _as_written(data):
+    """Round float rows to the values that are read back from the CSV file."""
+    return numpy.char.mod(Globals.DATA_FORMAT, data).astype(float)
+
+
+class DataCache(object):
+    """Binary copy of the data of a float dataset, kept next to its CSV file.
+
+    The rows are stored in <datafile>.npy, which can be memory-mapped instead
+    of parsing the CSV file. The header is padded to a fixed size, so rows can
+    be appended and the shape updated in place. The size and mtime of the CSV
+    file that the cache matches are kept in <datafile>.stamp; a cache whose
+    stamp does not match the CSV file is stale, and is ignored.
+    """
+
+    HEADER_SIZE = 128
+
+    def __init__(self, datafile):
+        self.filename = datafile + ".npy"
+        self.stampfile = datafile + ".stamp"
+
+    @staticmethod
+    def _stamp(stat):
+        return "%d %d" % (stat.st_size, stat.st_mtime_ns)
+
+    def _header(self, rows, cols):
+        header = "{'descr': '<f8', 'fortran_order': False, 'shape': (%d, %d), }" % (
+            rows,
+            cols,
+        )
+        header = header.ljust(self.HEADER_SIZE - 11) + "\n"
+        return (
+            numpy.lib.format.magic(1, 0)
+            + struct.pack("<H", len(header))
+            + header.encode("latin1")
+        )
+
+    def matches(self, stat):
+        """Check whether the cache holds the data of a CSV file with the given stat."""
+        try:
+            with open(self.stampfile) as f:
+                return f.read() == self._stamp(stat)
+        except IOError:
+            return False
+
+    def _set_stamp(self, stat):
+        tmp = self.stampfile + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(self._stamp(stat))
+        os.replace(tmp, self.stampfile)
+
+    def invalidate(self):
+        try:
+            os.remove(self.stampfile)
+        except OSError:
+            pass
+
+    def load(self, stat):
+        """Memory-map the cached rows, or return None if the cache is stale."""
+        if not self.matches(stat):
+            return None
+        try:
+            return numpy.load(self.filename, mmap_mode="r")
+        except (IOError, ValueError):
+            return None
+
+    def write(self, data, stat):
+        """Replace the cache with the rows of a CSV file with the given stat."""
+        data = numpy.asarray(data, dtype="<f8")
+        self.invalidate()
+        with open(self.filename, "wb") as f:
+            f.write(self._header(*data.shape))
+            f.write(data.tobytes())
+        self._set_stamp(stat)
+
+    def append(self, data, before, after):
+        """Append rows written to a CSV file, whose stat was before and is now after.
+
+        If the cache did not match the CSV file before, it is left stale, and is
+        rebuilt the next time the data is read from the CSV file.
+        """
+        data = numpy.asarray(data, dtype="<f8")
+        if before.st_size == 0:
+            self.write(data, after)
+            return
+        if not self.matches(before):
+            return
+        self.invalidate()
+        with open(self.filename, "r+b") as f:
+            numpy.lib.format.read_magic(f)
+            (rows, cols), _, _ = numpy.lib.format.read_array_header_1_0(f)
+            if cols != data.shape[1] or f.tell() != self.HEADER_SIZE:
+                return
+            f.seek(0, os.SEEK_END)
+            f.write(data.tobytes())
+            f.seek(0)
+            f.write(self._header(rows + len(data), cols))
+        self._set_stamp(after)
 
 
 class Dataset:
@@ -61,6 +281,7 @@ class Dataset:
             self.matrixrows = []
             self.matrixcolumns = []
             self.additional_headers = {}
+            self._index_parameters()
             self.save()
         else:
             self.load()
@@ -148,6 +369,26 @@ class Dataset:
             self.comments = [get_comment(i) for i in range(count)]
         else:
             self.comments = []
+        self._index_parameters()
+
+    def _index_parameters(self):
+        """Index the parameters and additional headers by label.
+
+        The case-folded indexes, like the linear searches they replace, find
+        the first of several labels that only differ in case.
+        """
+        self._params = {}
+        self._params_folded = {}
+        for p in self.parameters:
+            self._params.setdefault(p["label"], p)
+            self._params_folded.setdefault(p["label"].lower(), p)
+        self._header_labels = {
+            header: set(item["label"] for item in items)
+            for header, items in self.additional_headers.items()
+        }
+        # label -> item over all headers; rebuilt on the next lookup after a change
+        self._headers = None
+        self._headers_folded = None
 
     def save(self):
         s = SafeConfigParser()
@@ -286,38 +527,51 @@ class Dataset:
         self.save()
 
     def add_parameter(self, name, data, save_now=True):
-        for p in self.parameters:
-            if p["label"] == name:
+        return self.add_parameters([(name, data)], save_now)[0]
+
+    def add_parameters(self, params, save_now=True):
+        """Add several parameters, saving and notifying listeners once.
+
+        params is a list of (name, data) pairs. Nothing is added if any of the
+        names is already in use.
+        """
+        names = set()
+        for name, _ in params:
+            if name in self._params or name in names:
                 raise ParameterInUseError(name)
-        d = dict(label=name, data=data)
-        self.parameters.append(d)
+            names.add(name)
+        for name, data in params:
+            d = dict(label=name, data=data)
+            self.parameters.append(d)
+            self._params[name] = d
+            self._params_folded.setdefault(name.lower(), d)
         if save_now:
             self.save()
 
         # notify all listening contexts
         self.parent.onNewParameter(None, self.param_listeners)
-        self.parent.onNewParameterDataset(
-            (
-                int(self.name[0:5]),
-                self.name[8 : len(self.name)],
-                self.session.path,
-                name,
-            ),
-            self.parent.root.listeners,
-        )
+        for name, _ in params:
+            self.parent.onNewParameterDataset(
+                (
+                    int(self.name[0:5]),
+                    self.name[8 : len(self.name)],
+                    self.session.path,
+                    name,
+                ),
+                self.parent.root.listeners,
+            )
         self.param_listeners = set()
-        return name
+        return [name for name, _ in params]
 
     # MK
     def add_parameter_overwrite(self, name, data, save_now=True):
-        done = False
-        for p in self.parameters:
-            if p["label"] == name:
-                p["data"] = data
-                done = True
-        if not done:
+        if name in self._params:
+            self._params[name]["data"] = data
+        else:
             d = dict(label=name, data=data)
             self.parameters.append(d)
+            self._params[name] = d
+            self._params_folded.setdefault(name.lower(), d)
         if save_now:
             self.save()
         if name in self.deferredParameterDict.keys():
@@ -341,14 +595,13 @@ class Dataset:
                 self.deferredParameterDict[name].remove(d_param)
 
     def get_parameter(self, name, case_sensitive=True):
-        for p in self.parameters:
-            if case_sensitive:
-                if p["label"] == name:
-                    return p["data"]
-            else:
-                if p["label"].lower() == name.lower():
-                    return p["data"]
-        raise BadParameterError(name)
+        if case_sensitive:
+            p = self._params.get(name)
+        else:
+            p = self._params_folded.get(name.lower())
+        if p is None:
+            raise BadParameterError(name)
+        return p["data"]
 
     def add_data(self, data):
         varcount = len(self.independents) + len(self.dependents)
@@ -406,11 +659,13 @@ class Dataset:
         header_name = header_name.lower()
         if header_name not in self.additional_headers:
             self.additional_headers[header_name] = []
-        for p in self.additional_headers[header_name]:
-            if p["label"] == name:
-                raise AdditionalHeaderInUseError(header_name, name)
+            self._header_labels[header_name] = set()
+        if name in self._header_labels[header_name]:
+            raise AdditionalHeaderInUseError(header_name, name)
         d = dict(label=name, data=data)
         self.additional_headers[header_name].append(d)
+        self._header_labels[header_name].add(name)
+        self._headers = self._headers_folded = None
         if save_now:
             self.save()
 
@@ -429,64 +684,107 @@ class Dataset:
         return name
 
     def get_additional_header(self, header_name, name, case_sensitive=True):
-        for header in self.additional_headers:
-            for item in self.additional_headers[header]:
-                if case_sensitive:
-                    if item["label"] == name:
-                        return item["data"]
-                else:
-                    if item["label"].lower() == name.lower():
-                        return item["data"]
-        raise BadAdditionalHeaderError(header_name, name)
+        if self._headers is None:
+            self._headers = {}
+            self._headers_folded = {}
+            for header in self.additional_headers:
+                for item in self.additional_headers[header]:
+                    self._headers.setdefault(item["label"], item)
+                    self._headers_folded.setdefault(item["label"].lower(), item)
+        if case_sensitive:
+            item = self._headers.get(name)
+        else:
+            item = self._headers_folded.get(name.lower())
+        if item is None:
+            raise BadAdditionalHeaderError(header_name, name)
+        return item["data"]
 
 
 class NumpyDataset(Dataset):
 
+    @property
+    def _cache(self):
+        return DataCache(self.datafile)
+
+    def _load_data(self):
+        """Read all the data, from the binary cache if it is up to date, or from the CSV file."""
+        if self.dtype == "float":
+            data = self._cache.load(os.fstat(self.file.fileno()))
+            if data is not None:
+                return data
+
+        def _get(f):
+            if self.dtype == "float":
+                return numpy.loadtxt(self.file.name, delimiter=",")
+            if self.dtype == "string":
+                return numpy.loadtxt(self.file.name, delimiter=",", dtype=str)
+
+        try:
+            # if the file is empty, this line can barf in certain versions
+            # of numpy.  Clearly, if the file does not exist on disk, this
+            # will be the case.  Even if the file exists on disk, we must
+            # check its size
+            if self._file_size() > 0:
+                data = _get(self.file.name)
+            else:
+                data = numpy.array([[]])
+            if len(data.shape) == 1:
+                data.shape = (1, len(data))
+        except ValueError:
+            # no data saved yet
+            # this error is raised by numpy <=1.2
+            data = numpy.array([[]])
+        except IOError:
+            # no data saved yet
+            # this error is raised by numpy 1.3
+            self.file.seek(0)
+            data = numpy.array([[]])
+        if self.dtype == "float" and data.size > 0:
+            # rebuild the cache, so the next cold read is a memory map
+            self._cache.write(data, os.fstat(self.file.fileno()))
+        return data
+
     def _get_data(self):
         """Read data from file on demand.
 
         The data is scheduled to be cleared from memory unless accessed."""
         if not hasattr(self, "_data"):
-
-            def _get(f):
-                if self.dtype == "float":
-                    return numpy.loadtxt(self.file.name, delimiter=",")
-                if self.dtype == "string":
-                    return numpy.loadtxt(self.file.name, delimiter=",", dtype=str)
-
-            try:
-                # if the file is empty, this line can barf in certain versions
-                # of numpy.  Clearly, if the file does not exist on disk, this
-                # will be the case.  Even if the file exists on disk, we must
-                # check its size
-                if self._file_size() > 0:
-                    self._data = _get(self.file.name)
-                else:
-                    self._data = numpy.array([[]])
-                if len(self._data.shape) == 1:
-                    self._data.shape = (1, len(self._data))
-            except ValueError:
-                # no data saved yet
-                # this error is raised by numpy <=1.2
-                self._data = numpy.array([[]])
-            except IOError:
-                # no data saved yet
-                # this error is raised by numpy 1.3
-                self.file.seek(0)
-                self._data = numpy.array([[]])
+            self._data = self._load_data()
+            self._rows = len(self._data) if self._data.size > 0 else 0
             self._dataTimeoutCall = reactor.callLater(
                 Globals.DATA_TIMEOUT, self._data_timeout
             )
         else:
             self._dataTimeoutCall.reset(Globals.DATA_TIMEOUT)
-        return self._data
+        if self._rows == 0:
+            return numpy.array([[]])
+        return self._data[: self._rows]
 
     def _set_data(self, data):
         self._data = data
+        self._rows = len(data) if data.size > 0 else 0
 
     # noinspection PyTypeChecker
     data = property(_get_data, _set_data)
 
+    def _append_rows(self, data):
+        """Append rows to the in-memory data, growing its buffer by doubling."""
+        rows = len(self.data) if self.data.size > 0 else 0
+        dtype = numpy.promote_types(self._data.dtype, data.dtype)
+        buf = self._data
+        if (
+            rows == 0
+            or rows + len(data) > len(buf)
+            or buf.dtype != dtype
+            or not buf.flags.writeable
+        ):
+            buf = numpy.empty((max(2 * (rows + len(data)), 16), data.shape[1]), dtype)
+            if rows:
+                buf[:rows] = self._data[:rows]
+        buf[rows : rows + len(data)] = data
+        self._data = buf
+        self._rows = rows + len(data)
+
     def _save_data(self, data):
         def _save(file, dat):
             if self.dtype == "float":
@@ -495,11 +793,15 @@ class NumpyDataset(Dataset):
                 numpy.savetxt(f, data, fmt=Globals.STRING_FORMAT, delimiter=",")
 
         f = self.file
+        before = os.fstat(f.fileno())
         _save(f, data)
         f.flush()
+        if self.dtype == "float":
+            self._cache.append(data, before, os.fstat(f.fileno()))
 
     def _data_timeout(self):
         del self._data
+        del self._rows
         del self._dataTimeoutCall
 
     def add_data(self, data):
@@ -518,11 +820,13 @@ class NumpyDataset(Dataset):
             print(varcount, self.independents, self.dependents)
             raise BadDataError(varcount, data.shape[-1])
 
+        if self.dtype == "float":
+            # keep the values as they are written to the CSV file, so that the
+            # data is the same whether or not it was read back from the file
+            data = _as_written(data)
+
         # append data to in-memory data
-        if self.data.size > 0:
-            self.data = numpy.vstack((self.data, data))
-        else:
-            self.data = data
+        self._append_rows(data)
 
         # append data to file
         self._save_data(data)
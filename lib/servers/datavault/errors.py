@@ -75,3 +75,34 @@ class BadAdditionalHeaderError(types.Error):
 
     def __init__(self, header_name, name):
         self.msg = "'%s' in header '%s' not found." % (name, header_name)
+
+
+class BadImageError(types.Error):
+    code = 13
+
+    def __init__(self, name, start, stop, count):
+        self.msg = "Image '%s' has no frames %d to %d, only %d frames." % (
+            name,
+            start,
+            stop,
+            count,
+        )
+
+
+class BadImageTypeError(types.Error):
+    code = 14
+
+    def __init__(self, dtype):
+        self.msg = "Pixels of type %s do not fit in a 32 bit integer." % dtype
+
+
+class ImageShapeError(types.Error):
+    """Frames read together must have the same size and pixel type."""
+
+    code = 15
+
+    def __init__(self, name, first, first_layout, frame, layout):
+        self.msg = (
+            "Frames of image '%s' differ: frame %d is %dx%d %s, frame %d is %dx%d %s."
+            % ((name, first) + tuple(first_layout) + (frame,) + tuple(layout))
+        )
@@ -6,4 +6,5 @@ class Globals:
     STRING_FORMAT = "%s"
     FILE_TIMEOUT = 60  # how long to keep datafiles open if not accessed
     DATA_TIMEOUT = 300  # how long to keep data in memory if not accessed
+    REGISTRY_CACHE_TIMEOUT = 30  # how long to reuse registry imports
     TIME_FORMAT = "%Y-%m-%d, %H:%M:%S"
@@ -0,0 +1,156 @@
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred, inlineCallbacks, returnValue
+
+from globals import Globals
+
+
+class RegistryImport(object):
+    """Reads registry directories as dataset parameters, and caches recent reads.
+
+    A tree of directories is read breadth first, with one packet per level
+    covering all the directories at that level, instead of one packet per
+    directory. Each tree that is read is kept for Globals.REGISTRY_CACHE_TIMEOUT
+    seconds, so that parameters imported into several datasets in a row are
+    only read once, and reads of a tree that is already being read wait for
+    that read instead of starting another one. The directories of a cached tree are watched with
+    notify_on_change, each in its own context, and the tree is dropped as soon
+    as the registry reports a change in any of them.
+    """
+
+    MESSAGE_ID = 543700
+
+    def __init__(self, client, reactor=reactor):
+        self.client = client
+        self.reactor = reactor
+        # (path, subdirs) -> (params, directories, expiry call)
+        self._snapshots = {}
+        # (path, subdirs) -> Deferreds waiting for the read in progress
+        self._pending = {}
+        # directory -> [context, number of snapshots, listener]
+        self._watchers = {}
+
+    @inlineCallbacks
+    def read(self, context_id, subdirs=None):
+        """Read the registry directory of a context as a list of (name, value).
+
+        subdirs is None for the directory itself, a number of levels of
+        subdirectories to include (-1 for all), or a list of the subdirectories
+        to include, with everything below them. Keys in subdirectories are
+        named 'dir -> key'.
+        """
+        ctx = self.client.context()
+        p = self.client.registry.packet(context=ctx)
+        p.duplicate_context(context_id)
+        p.cd(key="path")
+        p.dir(key="dir")
+        ans = yield p.send()
+        path = tuple(ans["path"])
+        key = (path, tuple(subdirs) if isinstance(subdirs, list) else subdirs)
+        if key in self._snapshots:
+            returnValue(list(self._snapshots[key][0]))
+        if key in self._pending:
+            d = Deferred()
+            self._pending[key].append(d)
+            params = yield d
+            returnValue(list(params))
+        self._pending[key] = []
+        try:
+            params, dirs = yield self._read_tree(ctx, ans["dir"], subdirs)
+        except Exception:
+            for d in self._pending.pop(key):
+                d.errback()
+            raise
+        self._store(key, params, [path + d for d in dirs])
+        for d in self._pending.pop(key):
+            d.callback(params)
+        returnValue(list(params))
+
+    @inlineCallbacks
+    def _read_tree(self, ctx, content, subdirs):
+        params = []
+        dirs = []
+        level = [((), content)]
+        while level:
+            dirs.extend(curdir for curdir, _ in level)
+            p = self.client.registry.packet(context=ctx)
+            for curdir, (folders, keys) in level:
+                if len(curdir) > 0:
+                    p.cd(list(curdir))
+                for key in keys:
+                    p.get(key, key=(False, curdir + (key,)))
+                if isinstance(subdirs, list):
+                    folders = [folder for folder in folders if folder in subdirs]
+                elif subdirs is None or subdirs == 0:
+                    folders = []
+                for folder in folders:
+                    p.cd(folder)
+                    p.dir(key=(True, curdir + (folder,)))
+                    p.cd(1)
+                if len(curdir) > 0:
+                    p.cd(len(curdir))
+            ans = yield p.send()
+            if isinstance(subdirs, list):
+                subdirs = -1
+            elif (subdirs is not None) and (subdirs > 0):
+                subdirs -= 1
+            level = []
+            for key in sorted(ans.settings.keys()):
+                if isinstance(key, tuple):
+                    if key[0]:
+                        level.append((key[1], ans[key]))
+                    else:
+                        params.append((" -> ".join(key[1]), ans[key]))
+        returnValue((params, dirs))
+
+    def _store(self, key, params, dirs):
+        if key in self._snapshots:
+            self._drop(key)
+        for path in dirs:
+            self._watch(path)
+        call = self.reactor.callLater(Globals.REGISTRY_CACHE_TIMEOUT, self._drop, key)
+        self._snapshots[key] = (params, dirs, call)
+
+    def _drop(self, key):
+        snapshot = self._snapshots.pop(key, None)
+        if snapshot is None:
+            return
+        params, dirs, call = snapshot
+        if call.active():
+            call.cancel()
+        for path in dirs:
+            self._unwatch(path)
+
+    def _changed(self, path):
+        for key, (_, dirs, _) in list(self._snapshots.items()):
+            if path in dirs:
+                self._drop(key)
+
+    def _watch(self, path):
+        if path in self._watchers:
+            self._watchers[path][1] += 1
+            return
+        ctx = self.client.context()
+
+        def listener(c, data):
+            self._changed(path)
+
+        self._watchers[path] = [ctx, 1, listener]
+        self.client.registry.addListener(listener, context=ctx, ID=self.MESSAGE_ID)
+        p = self.client.registry.packet(context=ctx)
+        p.cd(list(path))
+        p.notify_on_change(self.MESSAGE_ID, True)
+        d = p.send()
+        # a directory that can't be watched could change unnoticed
+        d.addErrback(lambda failure: self._changed(path))
+
+    def _unwatch(self, path):
+        watcher = self._watchers[path]
+        watcher[1] -= 1
+        if watcher[1] > 0:
+            return
+        del self._watchers[path]
+        ctx, _, listener = watcher
+        self.client.registry.removeListener(listener, context=ctx, ID=self.MESSAGE_ID)
+        p = self.client.registry.packet(context=ctx)
+        p.notify_on_change(self.MESSAGE_ID, False)
+        p.send().addErrback(lambda failure: None)
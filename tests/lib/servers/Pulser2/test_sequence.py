@@ -0,0 +1,99 @@
+"""
+Test the TTL program of the Pulser2 sequence.py module
+"""
+import unittest as _ut
+import unittest.mock as _mock
+from decimal import Decimal
+import common.lib.servers.Pulser2.sequence as _sequence
+from common.lib.config.pulser_config import PulserConfiguration
+
+
+class TestParseTTL(_ut.TestCase):
+
+    def setUp(self):
+        # the configuration doesn't set the number of TTL channels
+        patcher = _mock.patch.object(PulserConfiguration, "ttl_channel_total",
+                                     32, create=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.sequence = _sequence.Sequence(parent=None)
+
+    def _add_pulse(self, channel, start, stop):
+        """
+        Adds a pulse given in time steps.
+        """
+        step = float(Decimal(PulserConfiguration.time_resolution))
+        self.sequence.add_ttl_pulse(channel, start * step, (stop - start) * step)
+
+    def _expected(self, states):
+        """
+        The program for a list of (time step, channel mask), as the FPGA expects it.
+        """
+        program = b""
+        for step, channels in states:
+            program += self.sequence._num_to_hex(step)
+            program += self.sequence._num_to_hex(channels)
+        return program + b"\x00\x00\x00\x00" * 2
+
+    def test_empty_sequence(self):
+        expected = self._expected([(0, 0)])
+        self.assertEqual(expected, self.sequence.parse_ttl())
+
+    def test_overlapping_pulses_on_several_channels(self):
+        self._add_pulse(channel=1, start=10, stop=30)
+        self._add_pulse(channel=2, start=20, stop=40)
+        self._add_pulse(channel=3, start=20, stop=25)
+        expected = self._expected([
+            (0, 0),
+            (10, 0b0010),
+            (20, 0b1110),
+            (25, 0b0110),
+            (30, 0b0100),
+            (40, 0),
+        ])
+        self.assertEqual(expected, self.sequence.parse_ttl())
+
+    def test_back_to_back_pulses(self):
+        self._add_pulse(channel=1, start=10, stop=20)
+        self._add_pulse(channel=1, start=20, stop=30)
+        expected = self._expected([(0, 0), (10, 2), (20, 2), (30, 0)])
+        self.assertEqual(expected, self.sequence.parse_ttl())
+
+    def test_pulse_at_time_zero(self):
+        self._add_pulse(channel=0, start=0, stop=5)
+        expected = self._expected([(0, 1), (5, 0)])
+        self.assertEqual(expected, self.sequence.parse_ttl())
+
+    def test_channel_in_high_word(self):
+        self._add_pulse(channel=17, start=5, stop=15)
+        self._add_pulse(channel=3, start=10, stop=20)
+        expected = self._expected([
+            (0, 0),
+            (5, 1 << 17),
+            (10, 1 << 17 | 1 << 3),
+            (15, 1 << 3),
+            (20, 0),
+        ])
+        program = self.sequence.parse_ttl()
+        self.assertEqual(expected, program)
+        # the high word of the channel mask comes first
+        self.assertEqual(b"\x02\x00\x00\x00", program[12:16])
+
+    def test_high_time_step(self):
+        self._add_pulse(channel=2, start=70000, stop=70001)
+        expected = self._expected([(0, 0), (70000, 4), (70001, 0)])
+        self.assertEqual(expected, self.sequence.parse_ttl())
+
+    def test_switch_off_without_switch_on_raises_exception(self):
+        self._add_pulse(channel=1, start=10, stop=20)
+        self.sequence._add_new_switch(15, 2, -1)
+        self.assertRaises(Exception, self.sequence.parse_ttl)
+
+    def test_switch_off_before_switch_on_raises_exception(self):
+        self.sequence._add_new_switch(10, 4, -1)
+        self.sequence._add_new_switch(20, 4, 1)
+        self.assertRaises(Exception, self.sequence.parse_ttl)
+
+
+if __name__ == '__main__':
+    _ut.main()
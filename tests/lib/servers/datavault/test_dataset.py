@@ -0,0 +1,218 @@
+"""
+Test dataset.py.
+"""
+
+import os as _os
+import shutil as _shutil
+import sys as _sys
+import tempfile as _tempfile
+import unittest as _ut
+import unittest.mock as _mock
+
+import numpy as _n
+from twisted.internet import task as _task
+
+import common.lib.servers.datavault as _datavault
+
+# the data vault runs as a script, and imports its modules from its own directory
+_sys.path.insert(0, _os.path.dirname(_datavault.__file__))
+import dataset as _dataset  # noqa: E402
+import errors as _errors  # noqa: E402
+from globals import Globals as _Globals  # noqa: E402
+
+
+class _Session(object):
+    def __init__(self, directory):
+        self.dir = directory
+        self.path = [""]
+        self.parent = _mock.MagicMock()
+
+
+class TestNumpyDataset(_ut.TestCase):
+
+    def setUp(self):
+        self.dir = _tempfile.mkdtemp()
+        self.addCleanup(_shutil.rmtree, self.dir)
+        # the timeouts that close files and drop data run on a fake clock
+        self.clock = _task.Clock()
+        patcher = _mock.patch.object(_dataset, "reactor", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self._close_files)
+        self.session = _Session(self.dir)
+
+    def _close_files(self):
+        self.clock.advance(max(_Globals.FILE_TIMEOUT, _Globals.DATA_TIMEOUT))
+
+    def _create(self):
+        dataset = _dataset.NumpyDataset(self.session, "Foo", dtype="f",
+                                        title="Foo", create=True)
+        dataset.add_independent(("x", "s"))
+        dataset.add_dependent(("y", "signal", "V"))
+        return dataset
+
+    def _reload(self):
+        return _dataset.NumpyDataset(self.session, "Foo").get_data(None, 0)[0]
+
+    def test_reload_with_and_without_cache(self):
+        dataset = self._create()
+        # values that don't survive the 15 digits of the CSV file unchanged
+        dataset.add_data(_n.array([[0.1 + 0.2, 1 / 3.0], [2 / 3.0, _n.pi]]))
+        dataset.add_data(_n.array([[1e-300 / 3, 12345.678901234567]]))
+        written = _n.array(dataset.get_data(None, 0)[0])
+
+        cache = dataset._cache
+        self.assertTrue(cache.matches(_os.stat(dataset.datafile)))
+        from_cache = self._reload()
+        self.assertIsInstance(from_cache, _n.memmap)
+
+        cache.invalidate()
+        from_csv = self._reload()
+        self.assertNotIsInstance(from_csv, _n.memmap)
+
+        self.assertEqual((3, 2), written.shape)
+        _n.testing.assert_array_equal(from_csv, written)
+        _n.testing.assert_array_equal(from_csv, from_cache)
+        # reading the CSV file rebuilt the cache
+        _n.testing.assert_array_equal(from_csv, self._reload())
+
+    def test_values_rounded_as_written(self):
+        dataset = self._create()
+        dataset.add_data(_n.array([[0.1 + 0.2, 1 / 3.0]]))
+        data = dataset.get_data(None, 0)[0]
+        _n.testing.assert_array_equal([[0.3, 0.333333333333333]], data)
+
+
+
+class TestParameters(_ut.TestCase):
+
+    def setUp(self):
+        self.dir = _tempfile.mkdtemp()
+        self.addCleanup(_shutil.rmtree, self.dir)
+        self.clock = _task.Clock()
+        patcher = _mock.patch.object(_dataset, "reactor", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.clock.advance, _Globals.FILE_TIMEOUT)
+        self.session = _Session(self.dir)
+        self.dataset = _dataset.Dataset(self.session, "00001 - Foo", dtype="f",
+                                        title="Foo", create=True)
+
+    def _reload(self):
+        return _dataset.Dataset(self.session, "00001 - Foo")
+
+    def test_add_parameters_saves_once(self):
+        with _mock.patch.object(self.dataset, "save") as save:
+            names = self.dataset.add_parameters([("a", 1.5), ("b", "text")])
+        self.assertEqual(["a", "b"], names)
+        self.assertEqual(1, save.call_count)
+        self.assertEqual(1.5, self.dataset.get_parameter("a"))
+        self.assertEqual("text", self.dataset.get_parameter("b"))
+
+    def test_duplicate_adds_nothing(self):
+        self.dataset.add_parameter("a", 1)
+        for params in ([("b", 2), ("a", 3)], [("c", 2), ("c", 3)]):
+            self.assertRaises(_errors.ParameterInUseError,
+                              self.dataset.add_parameters, params)
+        self.assertEqual(["a"], [p["label"] for p in self.dataset.parameters])
+        self.assertRaises(_errors.BadParameterError,
+                          self.dataset.get_parameter, "b")
+
+    def test_case_insensitive_lookup_finds_first(self):
+        self.dataset.add_parameters([("Rate", 1), ("rate", 2)])
+        for dataset in (self.dataset, self._reload()):
+            self.assertEqual(2, dataset.get_parameter("rate"))
+            self.assertEqual(1, dataset.get_parameter("RATE", False))
+            self.assertRaises(_errors.BadParameterError,
+                              dataset.get_parameter, "RATE")
+
+    def test_overwrite(self):
+        self.dataset.add_parameter("a", 1)
+        self.dataset.add_parameter_overwrite("a", 2)
+        self.dataset.add_parameter_overwrite("b", 3)
+        dataset = self._reload()
+        self.assertEqual(2, dataset.get_parameter("a"))
+        self.assertEqual(3, dataset.get_parameter("b"))
+        self.assertEqual(2, len(dataset.parameters))
+
+    def test_additional_headers(self):
+        self.dataset.add_additional_header("Fit", "Center", 1.0)
+        self.dataset.add_additional_header("Errors", "center", 2.0)
+        self.assertRaises(_errors.AdditionalHeaderInUseError,
+                          self.dataset.add_additional_header, "FIT", "Center", 3.0)
+        for dataset in (self.dataset, self._reload()):
+            self.assertEqual(1.0, dataset.get_additional_header("fit", "Center"))
+            self.assertEqual(2.0, dataset.get_additional_header("errors", "center"))
+            self.assertEqual(
+                1.0, dataset.get_additional_header("fit", "CENTER", False))
+            self.assertRaises(_errors.BadAdditionalHeaderError,
+                              dataset.get_additional_header, "fit", "Width")
+
+
+class TestImageStore(_ut.TestCase):
+
+    def setUp(self):
+        self.dir = _tempfile.mkdtemp()
+        self.addCleanup(_shutil.rmtree, self.dir)
+        self.store = _dataset.ImageStore(_Session(self.dir), "camera")
+
+    def _frames(self, count, rows=3, cols=4, dtype="<u2"):
+        return _n.arange(count * rows * cols, dtype=dtype).reshape(count, rows, cols)
+
+    def test_frames_read_back(self):
+        first, second = self._frames(3), self._frames(2) + 100
+        self.store.add_frames(first)
+        self.store.add_frames(second[0])
+        self.store.add_frames(second[1:])
+        self.assertEqual(5, len(self.store))
+        _n.testing.assert_array_equal(_n.concatenate([first, second]),
+                                      self.store.get_frames(0))
+        _n.testing.assert_array_equal(second, self.store.get_frames(3, 5))
+        self.assertEqual(_n.dtype("<u2"), self.store.get_frames(0).dtype)
+
+    def test_frames_out_of_range(self):
+        self.store.add_frames(self._frames(2))
+        for start, stop in [(2, 3), (0, 3), (1, 1)]:
+            with self.assertRaises(_errors.BadImageError) as error:
+                self.store.get_frames(start, stop)
+            self.assertIn("only 2 frames", error.exception.msg)
+
+    def test_no_frames(self):
+        self.assertRaises(_errors.BadImageError, self.store.get_frames, 0)
+
+    def test_frames_of_different_shapes(self):
+        self.store.add_frames(self._frames(2))
+        self.store.add_frames(self._frames(1, rows=5))
+        _n.testing.assert_array_equal(self._frames(1, rows=5),
+                                      self.store.get_frames(2, 3))
+        with self.assertRaises(_errors.ImageShapeError) as error:
+            self.store.get_frames(1, 3)
+        self.assertIn("frame 1 is 3x4 <u2, frame 2 is 5x4 <u2",
+                      error.exception.msg)
+
+    def test_frames_of_different_types(self):
+        self.store.add_frames(self._frames(1))
+        self.store.add_frames(self._frames(1, dtype="<i4"))
+        with self.assertRaises(_errors.ImageShapeError) as error:
+            self.store.get_frames(0)
+        self.assertIn("frame 0 is 3x4 <u2, frame 1 is 3x4 <i4",
+                      error.exception.msg)
+
+    def test_legacy_frames_copied(self):
+        legacy = self._frames(3)
+        with open(self.store.legacyfile, "wb") as f:
+            _n.save(f, legacy[:2])
+            _n.save(f, legacy[2])
+        self.assertEqual(3, len(self.store))
+        _n.testing.assert_array_equal(legacy[1:], self.store.get_frames(1))
+        self.assertRaises(_errors.BadImageError, self.store.get_frames, 2, 4)
+
+        self.store.add_frames(self._frames(1) + 100)
+        self.assertTrue(_os.path.exists(self.store.indexfile))
+        _n.testing.assert_array_equal(
+            _n.concatenate([legacy, self._frames(1) + 100]),
+            self.store.get_frames(0))
+
+
+if __name__ == '__main__':
+    _ut.main()
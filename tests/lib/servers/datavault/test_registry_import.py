@@ -0,0 +1,224 @@
+"""
+Test registry_import.py.
+"""
+
+import os as _os
+import sys as _sys
+import unittest as _ut
+
+from twisted.internet import defer as _defer
+from twisted.internet import task as _task
+
+import common.lib.servers.datavault as _datavault
+
+# the data vault runs as a script, and imports its modules from its own directory
+_sys.path.insert(0, _os.path.dirname(_datavault.__file__))
+import registry_import as _registry_import  # noqa: E402
+from globals import Globals as _Globals  # noqa: E402
+
+
+class _Answer(dict):
+    @property
+    def settings(self):
+        return self
+
+
+class _Packet(object):
+    """Records registry requests, and runs them against the tree of the registry."""
+
+    def __init__(self, registry, context):
+        self.registry = registry
+        self.context = context
+        self.requests = []
+
+    def __getattr__(self, name):
+        def request(*args, **kw):
+            self.requests.append((name, args, kw))
+
+        return request
+
+    def send(self):
+        return self.registry.run(self)
+
+
+class _Registry(object):
+    """A registry server holding a tree of dicts, which can hold back its answers."""
+
+    def __init__(self, tree):
+        self.tree = tree
+        self.paths = {}
+        self.listeners = []
+        self.packets = []
+        self.notify = []
+        self.hold = False
+        self.held = []
+
+    def packet(self, context):
+        return _Packet(self, context)
+
+    def addListener(self, listener, **kw):
+        self.listeners.append((listener, kw))
+
+    def removeListener(self, listener, **kw):
+        self.listeners.remove((listener, kw))
+
+    def node(self, path):
+        node = self.tree
+        for name in path:
+            node = node[name]
+        return node
+
+    def run(self, packet):
+        self.packets.append(packet)
+        path = list(self.paths.get(packet.context, []))
+        answer = _Answer()
+        for name, args, kw in packet.requests:
+            if name == "duplicate_context":
+                path = list(self.paths.get(args[0], []))
+            elif name == "cd" and not args:
+                answer[kw["key"]] = [""] + path
+            elif name == "cd" and isinstance(args[0], int):
+                path = path[: -args[0]]
+            elif name == "cd" and isinstance(args[0], list):
+                # paths starting with "" are absolute
+                path = args[0][1:] if args[0][:1] == [""] else path + args[0]
+            elif name == "cd":
+                path.append(args[0])
+            elif name == "dir":
+                node = self.node(path)
+                dirs = sorted(k for k, v in node.items() if isinstance(v, dict))
+                keys = sorted(k for k, v in node.items() if not isinstance(v, dict))
+                answer[kw["key"]] = (dirs, keys)
+            elif name == "get":
+                answer[kw["key"]] = self.node(path)[args[0]]
+            elif name == "notify_on_change":
+                self.notify.append((tuple(path), args[1]))
+        self.paths[packet.context] = path
+        if self.hold:
+            d = _defer.Deferred()
+            self.held.append((d, answer))
+            return d
+        return _defer.succeed(answer)
+
+    def release(self):
+        while self.held:
+            d, answer = self.held.pop(0)
+            d.callback(answer)
+
+    def change(self, path):
+        """Send a change message to the listeners of a directory."""
+        for listener, kw in list(self.listeners):
+            if self.paths.get(kw["context"]) == list(path):
+                listener(None, ("key", False, True))
+
+
+class _Client(object):
+    def __init__(self, registry):
+        self.registry = registry
+        self.contexts = 0
+
+    def context(self):
+        self.contexts += 1
+        return (0, self.contexts)
+
+
+class TestRegistryImport(_ut.TestCase):
+
+    def setUp(self):
+        tree = {"a": 1, "sub": {"b": 2, "deep": {"c": 3}}, "other": {"d": 4}}
+        self.registry = _Registry(tree)
+        self.clock = _task.Clock()
+        self.importer = _registry_import.RegistryImport(
+            _Client(self.registry), reactor=self.clock
+        )
+
+    def _read(self, subdirs=-1):
+        results = []
+        d = self.importer.read("dataset context", subdirs)
+        d.addCallback(results.append)
+        return results
+
+    def _read_packets(self):
+        """The packets sent to read directories, leaving out the ones setting up watches."""
+        return [
+            packet
+            for packet in self.registry.packets
+            if not any(name == "notify_on_change" for name, _, _ in packet.requests)
+        ]
+
+    def _tree_packets(self):
+        """The number of times the top directory of the tree was read."""
+        return sum(
+            1
+            for packet in self.registry.packets
+            if ("get", ("a",), {"key": (False, ("a",))}) in packet.requests
+        )
+
+    def test_one_packet_per_level(self):
+        results = self._read()
+        expected = [
+            ("a", 1),
+            ("other -> d", 4),
+            ("sub -> b", 2),
+            ("sub -> deep -> c", 3),
+        ]
+        self.assertEqual([expected], results)
+        # the first packet finds the directory, then one per level
+        self.assertEqual(4, len(self._read_packets()))
+
+    def test_subdirs(self):
+        self.assertEqual([[("a", 1)]], self._read(None))
+        self.assertEqual(
+            [[("a", 1), ("other -> d", 4), ("sub -> b", 2)]], self._read(1)
+        )
+        self.assertEqual(
+            [[("a", 1), ("sub -> b", 2), ("sub -> deep -> c", 3)]], self._read(["sub"])
+        )
+
+    def test_cached_until_timeout(self):
+        first = self._read()
+        packets = len(self._read_packets())
+        self.assertEqual(first, self._read())
+        # only the packet finding the directory is sent again
+        self.assertEqual(packets + 1, len(self._read_packets()))
+        self.clock.advance(_Globals.REGISTRY_CACHE_TIMEOUT)
+        self.assertEqual({}, self.importer._snapshots)
+        self.assertEqual({}, self.importer._watchers)
+        self.assertEqual([], self.registry.listeners)
+        self.assertEqual(first, self._read())
+        self.assertEqual(2, self._tree_packets())
+
+    def test_concurrent_reads_share_one_read(self):
+        self.registry.hold = True
+        first = self._read()
+        second = self._read()
+        while self.registry.held:
+            self.registry.release()
+        self.assertEqual(1, len(first))
+        self.assertEqual(first, second)
+        self.assertEqual(1, self._tree_packets())
+        self.assertEqual(1, len(self.importer._snapshots))
+        self.assertEqual(
+            [1, 1, 1, 1], [users for _, users, _ in self.importer._watchers.values()]
+        )
+        self.clock.advance(_Globals.REGISTRY_CACHE_TIMEOUT)
+        self.assertEqual([], self.clock.getDelayedCalls())
+        self.assertEqual({}, self.importer._watchers)
+        self.assertEqual([], self.registry.listeners)
+
+    def test_change_drops_snapshot(self):
+        first = self._read()
+        self._read(None)
+        self.assertEqual(2, len(self.importer._snapshots))
+        self.registry.change(("sub", "deep"))
+        # only the snapshot of the whole tree includes the changed directory
+        self.assertEqual(1, len(self.importer._snapshots))
+        self.assertEqual(1, len(self.importer._watchers))
+        self.assertEqual(1, len(self.registry.listeners))
+        self.assertIn((("sub", "deep"), False), self.registry.notify)
+        self.assertEqual(first, self._read())
+        self.assertEqual(3, self._tree_packets())
+
+
+if __name__ == "__main__":
+    _ut.main()